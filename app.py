@@ -1,19 +1,34 @@
 """
 Script running the flask app
 """
+import atexit
+import hashlib
 import logging.config
+import os
 import sqlite3
 import traceback
+import typing
 
 import pandas as pd
 import spotipy
-from sqlalchemy import func
 import sqlalchemy.exc
-from flask import Flask, redirect, render_template, request, url_for
+from flask import (Flask, jsonify, make_response, redirect, render_template, request,
+                   url_for)
 
 # For setting up the Flask-SQLAlchemy database session
+from src.catalog_cache import CatalogCache
+from src.catalog_lookup import TitleIndex
 from src.song_manager import SongManager, Songs
-from src.search_songs import get_closest_cluster, get_song_features, get_top_n_closest_song
+from src.metrics import (RequestMetrics, count_sql_statements, current_trace, end_trace,
+                         render_counters, render_gauges, span, start_trace)
+from src.neighbours import NeighbourTable
+from src.shared_catalog import build_catalog, load_shared_catalog
+from src.snapshot import load_snapshot
+from src.search_songs import (TRACK_ID_PATTERN, form_query, get_audio_features,
+                              get_audio_features_batch, get_closest_clusters,
+                              get_spotify_client, search_track_id)
+from src.song_index import SongIndex
+from src.ttl_cache import MISSING, TTLCache
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder="app/templates",
@@ -21,6 +36,8 @@ app = Flask(__name__, template_folder="app/templates",
 
 # Configure flask app from flask_config.py
 app.config.from_pyfile('config/flaskconfig.py')
+# Optionally override some of them with another file, e.g. for benchmarks or production
+app.config.from_envvar('FLASK_CONFIG_OVERRIDES', silent=True)
 
 # Define LOGGING_CONFIG in flask_config.py - path to config file for setting
 # up the logger (e.g. config/logging/local.conf)
@@ -37,6 +54,376 @@ logger.debug(
 # Initialize the database session
 song_manager = SongManager(app)
 
+# A serving snapshot built by `run.py snapshot`, optional. With a snapshot, the
+# centroids, the catalog and the index page are served without reading the database
+snapshot = None
+if app.config["SNAPSHOT_PATH"]:
+    snapshot = load_snapshot(app.config["SNAPSHOT_PATH"])
+    if not set(app.config["FEATURES"]).issubset(snapshot.features):
+        logger.error("The snapshot at %s does not hold the features %s",
+                     app.config["SNAPSHOT_PATH"], app.config["FEATURES"])
+        raise ValueError("The snapshot does not match the configured FEATURES")
+    # the centroid similarities are computed in the type of the snapshot matrix
+    app.config["PRECISION"] = snapshot.song_index.matrix.dtype.name
+# Catalog version of the songs table when the snapshot was loaded, 0 if it cannot be read.
+# Once the songs table changes (`run_rds.py update` or `add_data`), the snapshot is stale
+# and the app serves from the songs table instead
+snapshot_database_version = song_manager.get_catalog_version() if snapshot is not None else 0
+
+
+def get_catalog_version() -> int:
+    """Returns the catalog version of the snapshot, or of the songs table without one.
+    The snapshot is dropped when the songs table changed since it was loaded."""
+    global snapshot  # pylint: disable=global-statement
+    if snapshot is not None:
+        if (not snapshot_database_version
+                or song_manager.get_catalog_version() == snapshot_database_version):
+            return snapshot.version
+        logger.warning("The songs table changed since the snapshot was loaded, "
+                       "serving from the songs table")
+        snapshot = None
+    return song_manager.get_catalog_version()
+
+
+def load_centroids() -> pd.DataFrame:
+    """Returns the average features of each cluster, from the snapshot or the songs table
+
+    Returns:
+        a dataframe with a clusterId column and one column per feature
+    """
+    if snapshot is not None:
+        return snapshot.centroids
+    return song_manager.get_centroids(app.config["FEATURES"])
+
+
+# Cluster centroids only change when songs are ingested, so they are computed
+# once and reloaded when the catalog version is bumped by `run_rds.py add_data`
+centroid_cache = CatalogCache(
+    loader=load_centroids,
+    version_getter=get_catalog_version,
+    check_interval=app.config["CATALOG_CHECK_INTERVAL"])
+
+
+def load_catalog() -> tuple[SongIndex, TitleIndex]:
+    """Builds the in-memory search structures from one read of the songs table.
+    With SHARED_CATALOG_DIR, they are memory-mapped from a file shared by the workers
+    and only built by the first worker that sees a new catalog version.
+
+    Returns:
+        the similarity index and the title index of the catalog
+    """
+    if snapshot is not None:
+        return snapshot.song_index, snapshot.title_index
+
+    def build():
+        return build_catalog(song_manager.get_songs(), app.config["FEATURES"],
+                             app.config["PRECISION"])
+
+    if app.config["SHARED_CATALOG_DIR"]:
+        return load_shared_catalog(app.config["SHARED_CATALOG_DIR"],
+                                   song_manager.get_catalog_version(), build)
+    return build()
+
+
+def update_catalog(catalog: tuple[SongIndex, TitleIndex]
+                   ) -> typing.Optional[tuple[SongIndex, TitleIndex]]:
+    """Appends the songs ingested since the catalog was loaded (`run_rds.py update`),
+    reading only those songs from the songs table
+
+    Arguments:
+        catalog -- the similarity index and the title index
+
+    Returns:
+        the updated indexes, None if songs were also changed or removed
+        and the catalog needs to be rebuilt
+    """
+    song_index, title_index = catalog
+    if len(song_index) == 0:
+        return None
+    df_new = song_manager.get_songs_after(int(max(song_index.metadata["id"])))
+    if len(song_index) + len(df_new) != song_manager.count_songs():
+        return None
+    return song_index.append(df_new), title_index.append(df_new)
+
+
+# The features of every song are kept in memory as a normalized matrix grouped
+# by cluster, so finding the closest songs does not touch the database, and
+# their titles are indexed so that catalog songs are found without Spotify.
+# Songs appended to the table are added to the indexes without rebuilding them,
+# except when the indexes are shared by the workers or come from a snapshot.
+catalog_cache = CatalogCache(
+    loader=load_catalog,
+    version_getter=get_catalog_version,
+    check_interval=app.config["CATALOG_CHECK_INTERVAL"],
+    updater=(update_catalog if snapshot is None and not app.config["SHARED_CATALOG_DIR"]
+             else None))
+
+# Spotify lookups of popular songs are answered from memory (and from disk
+# across restarts if SPOTIFY_CACHE_PATH is set)
+search_cache = TTLCache(max_size=app.config["SPOTIFY_CACHE_SIZE"],
+                        ttl=app.config["SPOTIFY_CACHE_TTL"],
+                        path=app.config["SPOTIFY_CACHE_PATH"], table="search")
+features_cache = TTLCache(max_size=app.config["SPOTIFY_CACHE_SIZE"],
+                          ttl=app.config["SPOTIFY_CACHE_TTL"],
+                          path=app.config["SPOTIFY_CACHE_PATH"], table="audio_features")
+# the disk writes are committed in batches, commit the last ones on exit
+atexit.register(search_cache.flush)
+atexit.register(features_cache.flush)
+
+
+def load_neighbours() -> typing.Optional[NeighbourTable]:
+    """Loads the precomputed neighbours of the catalog songs (`run.py neighbours`)
+
+    Returns:
+        the neighbour table, None if there is none or if it was computed on other songs
+        than those of the catalog served, e.g. before songs were added
+    """
+    if not app.config["NEIGHBOURS_PATH"]:
+        return None
+    try:
+        table = NeighbourTable.load(app.config["NEIGHBOURS_PATH"])
+    except FileNotFoundError:
+        logger.warning("No precomputed neighbours found at %s, every search is "
+                       "computed online", app.config["NEIGHBOURS_PATH"])
+        return None
+    song_index, _ = catalog_cache.get()
+    if snapshot is not None and catalog_cache.version == snapshot.version:
+        # both record the content version of the songs they were built from
+        fresh = table.catalog_version == snapshot.version
+    else:
+        # the version of the songs table is a counter, compare the songs themselves
+        fresh = table.matches(song_index.metadata["track_uri"],
+                              song_index.metadata["clusterId"])
+    if not fresh:
+        logger.warning("The neighbours at %s were computed on another catalog, every "
+                       "search is computed online until they are recomputed",
+                       app.config["NEIGHBOURS_PATH"])
+        return None
+    return table
+
+
+def neighbours_version() -> int:
+    """Returns a version that changes with the catalog served, reloading it if it has
+    changed, and whenever the neighbours file is rewritten"""
+    catalog_cache.get()
+    modified = 0
+    if app.config["NEIGHBOURS_PATH"]:
+        try:
+            modified = os.stat(app.config["NEIGHBOURS_PATH"]).st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return hash((catalog_cache.version, modified))
+
+
+# The neighbours are checked against the catalog, and reloaded, whenever either changes
+neighbours_cache = CatalogCache(loader=load_neighbours, version_getter=neighbours_version,
+                                check_interval=app.config["CATALOG_CHECK_INTERVAL"])
+
+# Time spent in each stage of the requests, exposed at /metrics
+request_metrics = RequestMetrics(app.config["SLOW_REQUEST_SECONDS"])
+if app.config["METRICS_ENABLED"]:
+    count_sql_statements(song_manager.database.get_engine(app))
+
+# Rendered pages, keyed by everything that changes their content. The catalog
+# version is part of the key, so an ingestion makes every cached page stale
+response_cache = TTLCache(max_size=app.config["RESPONSE_CACHE_SIZE"],
+                          ttl=app.config["RESPONSE_CACHE_TTL"], table="responses")
+
+
+def lookup_neighbours(track_id: str, top_n: int):
+    """Looks up the precomputed closest songs of a Spotify track
+
+    Arguments:
+        track_id -- the Spotify id of the track, may be None
+        top_n -- number of songs to return
+
+    Returns:
+        a list of records of the closest songs, None if the track is not in the catalog
+    """
+    if track_id is None:
+        return None
+    neighbour_table = neighbours_cache.get()
+    if neighbour_table is None:
+        return None
+    return neighbour_table.lookup(f"spotify:track:{track_id}", top_n)
+
+
+def lookup_title(song_name: str, artist: typing.Optional[str] = None):
+    """Looks up a song of the catalog by its title. The songs table has no artist, so when
+    the user names one, only an exact title matches: a prefix of the title could be another
+    song of that artist.
+
+    Arguments:
+        song_name -- the song name typed by the user
+
+    Keyword Arguments:
+        artist -- the artist typed by the user (default: {None})
+
+    Returns:
+        a dictionary with the track_uri and the stored features of the song,
+        None if the title is not in the catalog or local lookups are disabled
+    """
+    if not app.config["LOCAL_LOOKUP"]:
+        return None
+    _, title_index = catalog_cache.get()
+    return title_index.resolve(song_name, app.config["LOCAL_LOOKUP_MIN_PREFIX"],
+                               exact=bool(artist and artist.strip()))
+
+
+def recommend(track_id: str, features: typing.Optional[dict]):
+    """Finds the closest anime songs of a Spotify track
+
+    Arguments:
+        track_id -- the Spotify id of the track
+        features -- the audio features of the track if already known, else None
+
+    Returns:
+        a list of records of the closest songs, None if the track has no audio features
+    """
+    # songs of the catalog are answered from the precomputed neighbours
+    with span("neighbours"):
+        top_songs = lookup_neighbours(track_id, app.config['TOP_N'])
+    if top_songs is not None:
+        return top_songs
+    if features is None:
+        with span("audio_features"):
+            features = get_audio_features(
+                track_id, get_spotify_client(app.config['SPOTIFY_POOL_SIZE'],
+                                             app.config['SPOTIFY_TIMEOUT']),
+                features_cache)
+    if features is None:
+        return None
+
+    song_features = pd.DataFrame.from_records([features])
+    with span("centroids"):
+        centroids = centroid_cache.get()
+
+    # get the closest clusters to look into
+    with span("closest_clusters"):
+        cluster_ids = get_closest_clusters(song_features, centroids,
+                                           app.config['FEATURES'],
+                                           app.config['NPROBE'],
+                                           app.config['PRECISION'])[0]
+    logger.debug("The closest clusters are %s", cluster_ids)
+
+    # find the closest ones in terms of cosine_similarity
+    with span("catalog"):
+        song_index, _ = catalog_cache.get()
+    with span("similarity"):
+        return song_index.top_n(song_features[song_index.features].to_numpy()[0],
+                                cluster_ids, app.config['TOP_N'])
+
+
+def list_songs(n_songs: int) -> list:
+    """Returns the first songs of the catalog, as listed on the index page
+
+    Arguments:
+        n_songs -- number of songs to return
+
+    Returns:
+        the songs, from the snapshot if there is one, else from the songs table
+    """
+    if snapshot is not None:
+        return snapshot.first_songs(n_songs)
+    return song_manager.session.query(Songs).limit(n_songs).all()
+
+
+def catalog_version() -> str:
+    """Returns the version of the catalog and of the precomputed neighbours served,
+    reloading the in-memory catalog and the neighbours if either has changed
+
+    Returns:
+        the version of the catalog and of the neighbours (0 if none are served), as a string
+    """
+    with span("catalog"):
+        neighbours_served = neighbours_cache.get() is not None
+    return f"{catalog_cache.version}.{neighbours_cache.version if neighbours_served else 0}"
+
+
+def cached_response(key: str, render: typing.Callable[[], str]):
+    """Answers a page from the response cache, rendering it on a miss.
+    The page is sent with an ETag hashed from its content, so clients and proxies
+    holding the same page get an empty 304 response, and a new template or rendering
+    changes the ETag.
+
+    Arguments:
+        key -- the key identifying the content of the page
+        render -- function without arguments that renders the page,
+            or returns None if there is nothing to show
+
+    Returns:
+        the response, a redirect to the index page if there is nothing to show
+    """
+    page = response_cache.get(key)
+    if page is MISSING:
+        with span("render"):
+            page = render()
+        if page is None:
+            return redirect(url_for('index'))
+        response_cache.set(key, page)
+    etag = hashlib.sha1(page.encode("utf-8")).hexdigest()
+    response = make_response("", 304) if etag in request.if_none_match else make_response(page)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["RESPONSE_MAX_AGE"]
+    return response
+
+
+@app.before_request
+def trace_request():
+    """Starts timing the stages of the request"""
+    if app.config["METRICS_ENABLED"] and request.endpoint not in (None, "static", "metrics"):
+        start_trace(request.endpoint)
+
+
+@app.after_request
+def record_request(response):
+    """Adds the timings of the request to the metrics
+
+    Arguments:
+        response -- the response of the request
+
+    Returns:
+        the unchanged response
+    """
+    trace = current_trace()
+    if trace is not None:
+        request_metrics.record(trace, response.status_code)
+    return response
+
+
+@app.teardown_request
+def stop_trace(_err):
+    """Stops timing, also when the request failed"""
+    end_trace()
+
+
+@app.route('/metrics')
+def metrics():
+    """View exposing the latency histograms and cache counters in the Prometheus text format.
+    Each gunicorn worker keeps its own metrics, so every series is labelled with the id of
+    the process that answered: sum them by the other labels to aggregate the workers.
+
+    Returns:
+        the metrics as plain text
+    """
+    caches = {"search": search_cache, "audio_features": features_cache,
+              "responses": response_cache}
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    # the id of the worker, read per request as the app may be imported before the fork
+    process = {"pid": os.getpid()}
+    lines = request_metrics.render(process)
+    lines += render_gauges("cache_size", "Size of the cache", ("cache",),
+                           {(name,): values["size"] for name, values in stats.items()},
+                           process)
+    for stat in ["hits", "misses", "evictions"]:
+        lines += render_counters(f"cache_{stat}_total", f"{stat.capitalize()} of the cache",
+                                 ("cache",),
+                                 {(name,): values[stat] for name, values in stats.items()},
+                                 process)
+    return app.response_class("\n".join(lines) + "\n",
+                              mimetype="text/plain; version=0.0.4")
+
 
 @app.route('/')
 def index():
@@ -51,10 +438,11 @@ def index():
     """
 
     try:
-        songs = song_manager.session.query(Songs).limit(
-            app.config["MAX_ROWS_SHOW"]).all()
         logger.debug("Index page accessed")
-        return render_template('index.html', songs=songs)
+        # the listed songs only depend on the catalog, not on the loaded neighbours
+        key = f"index|{app.config['MAX_ROWS_SHOW']}|{get_catalog_version()}"
+        return cached_response(key, lambda: render_template(
+            'index.html', songs=list_songs(app.config["MAX_ROWS_SHOW"])))
     except sqlite3.OperationalError as err:
         logger.error(
             "Error page returned. Not able to query local sqlite database: %s."
@@ -73,7 +461,7 @@ def index():
         return render_template('error.html')
 
 
-@app.route('/search', methods=['POST'])
+@app.route('/search', methods=['GET', 'POST'])
 def get_entry():
     """View that process a post with new song input
     It searches for the closest cluster of the song
@@ -84,64 +472,54 @@ def get_entry():
 
     try:
         # define the song name to be searched
-        song_name = request.form['song_name']
-        artist = request.form['artist']
+        song_name = request.values.get('song_name')
+        artist = request.values.get('artist')
+        if song_name is None or artist is None:
+            return redirect(url_for('index'))
 
-        # search for the song -> returns df_song with all possible features
+        # search for the song -> returns the Spotify id of the first result
         try:
-            song_features = get_song_features(song_name, artist)
+            # titles of the catalog are resolved with their stored features
+            with span("title_lookup"):
+                features = lookup_title(song_name, artist)
+            if features is not None:
+                track_id = features["track_uri"].split(":")[-1]
+            else:
+                with span("spotify_search"):
+                    track_id = search_track_id(
+                        form_query(song_name, artist),
+                        get_spotify_client(app.config['SPOTIFY_POOL_SIZE'],
+                                           app.config['SPOTIFY_TIMEOUT']),
+                        search_cache)
         except KeyError:
             return redirect(url_for('index'))
         except spotipy.SpotifyException:
             return redirect(url_for('index'))
 
         # in case there aren't any search results
-        if len(song_features) == 0:
+        if track_id is None:
             return redirect(url_for('index'))
-        
-        query = song_manager.session.query(
-            Songs.clusterId,
-            func.avg(Songs.danceability).label('danceability'),
-            func.avg(Songs.energy).label('energy'),
-            func.avg(Songs.loudness).label('loudness'),
-            func.avg(Songs.speechiness).label('speechiness'),
-            func.avg(Songs.acousticness).label('acousticness'),
-            func.avg(Songs.instrumentalness).label('instrumentalness'),
-            func.avg(Songs.liveness).label('liveness'),
-            func.avg(Songs.valence).label('valence'),
-            func.avg(Songs.tempo).label('tempo')
-        ).group_by(Songs.clusterId
-        ).statement
-        
-        centroids = pd.read_sql_query(
-            sql=query,
-            con=song_manager.database.engine
-        )
-
-        # get closest cluster
-        cluster_id = get_closest_cluster(song_features, centroids,
-                                        app.config['FEATURES'])
-
-        logger.info("Song queried: %s by %s", request.form['song_name'],
-                    request.form['artist'])
-        logger.debug("The closest cluster is Cluster %d", cluster_id)
-
-        # fetch all songs in that cluster
-
-        songs = pd.read_sql_query(
-            sql=song_manager.session.query(
-                Songs).filter_by(clusterId=cluster_id).statement,
-            con=song_manager.database.engine
-        )
-        
-        # find the closest ones in terms of cosine_similarity
-        top_songs = get_top_n_closest_song(
-            song_features, songs, app.config['FEATURES'], app.config['TOP_N'],
-            cluster_id=cluster_id)
-        
-        return render_template('search_results.html',
-                               searched=f"{song_name} by {artist}",
-                               songs=top_songs)
+
+        logger.info("Song queried: %s by %s", song_name, artist)
+        searched = f"{song_name} by {artist}"
+
+        def render():
+            try:
+                top_songs = recommend(track_id, features)
+            except KeyError:
+                return None
+            except spotipy.SpotifyException:
+                return None
+            if top_songs is None:
+                return None
+            with span("template"):
+                return render_template('search_results.html', searched=searched,
+                                       songs=top_songs)
+
+        key = "|".join(["search", track_id, searched, str(app.config['TOP_N']),
+                        ",".join(app.config['FEATURES']), str(app.config['NPROBE']),
+                        app.config['PRECISION'], catalog_version()])
+        return cached_response(key, render)
 
     except sqlite3.OperationalError as err:
         logger.error(
@@ -157,6 +535,128 @@ def get_entry():
         return render_template('error.html')
 
 
+@app.route('/api/recommendations', methods=['POST'])
+def get_recommendations():
+    """JSON view that recommends anime songs for many songs in one request
+
+    Expects a JSON body such as
+    `{"songs": [{"song_name": "...", "artist": "..."}, {"track_id": "..."}], "top_n": 10}`.
+    Audio features are fetched in batches, clusters are assigned with one
+    get_closest_clusters call and the songs probing a cluster are scored together.
+
+    Returns:
+        JSON with one result per given song, in the given order. A song that cannot be
+        resolved or scored has an `error` instead of songs, the others are still answered
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("songs"), list):
+        return jsonify(error="Expected a JSON object with a list of songs"), 400
+    queries = payload["songs"]
+    if len(queries) > app.config["API_MAX_BATCH"]:
+        return jsonify(error=f"At most {app.config['API_MAX_BATCH']} songs per request"), 400
+    top_n = payload.get("top_n", app.config["TOP_N"])
+    if not isinstance(top_n, int) or isinstance(top_n, bool) or top_n <= 0:
+        return jsonify(error="top_n needs to be a positive integer"), 400
+
+    try:
+        sp_api = get_spotify_client(app.config['SPOTIFY_POOL_SIZE'],
+                                    app.config['SPOTIFY_TIMEOUT'])
+
+        # resolve every song to a Spotify track id, the errors are reported per song
+        track_ids = []
+        errors = {}
+        local_features = {}
+        for pos, query in enumerate(queries):
+            track_ids.append(None)
+            if not isinstance(query, dict):
+                errors[pos] = "Expected a JSON object with a song_name or a track_id"
+                continue
+            if query.get("track_id"):
+                if TRACK_ID_PATTERN.fullmatch(str(query["track_id"])) is None:
+                    errors[pos] = "Invalid track id"
+                else:
+                    track_ids[pos] = str(query["track_id"])
+                continue
+            with span("title_lookup"):
+                features = lookup_title(query.get("song_name"), query.get("artist"))
+            if features is not None:
+                # titles of the catalog are resolved with their stored features
+                track_ids[pos] = features["track_uri"].split(":")[-1]
+                local_features[track_ids[pos]] = features
+                continue
+            try:
+                with span("spotify_search"):
+                    track_ids[pos] = search_track_id(
+                        form_query(query.get("song_name"), query.get("artist")),
+                        sp_api, search_cache)
+            except KeyError:
+                pass
+            except spotipy.SpotifyException as err:
+                logger.warning("Spotify search of %s failed: %s", query, err)
+                errors[pos] = "Spotify search failed"
+
+        results = [{"query": query, "track_id": track_id, "songs": []}
+                   for query, track_id in zip(queries, track_ids)]
+        for pos, error in errors.items():
+            results[pos]["error"] = error
+
+        # songs of the catalog are answered from the precomputed neighbours
+        to_score = []
+        for pos, track_id in enumerate(track_ids):
+            if pos in errors:
+                continue
+            with span("neighbours"):
+                songs = lookup_neighbours(track_id, top_n)
+            if songs is None:
+                to_score.append(pos)
+            else:
+                results[pos]["songs"] = songs
+
+        known_ids = [track_ids[pos] for pos in to_score
+                     if track_ids[pos] and track_ids[pos] not in local_features]
+        with span("audio_features"):
+            features_by_id = dict(zip(known_ids, get_audio_features_batch(
+                known_ids, sp_api, features_cache)))
+        features_by_id.update(local_features)
+        found = [pos for pos in to_score
+                 if track_ids[pos] and features_by_id.get(track_ids[pos])]
+        for pos in set(to_score).difference(found):
+            results[pos]["error"] = "Song not found on Spotify"
+
+        if found:
+            df_songs = pd.DataFrame.from_records(
+                [features_by_id[track_ids[pos]] for pos in found])
+            with span("centroids"):
+                centroids = centroid_cache.get()
+            with span("closest_clusters"):
+                cluster_ids = get_closest_clusters(df_songs, centroids,
+                                                   app.config['FEATURES'],
+                                                   app.config['NPROBE'],
+                                                   app.config['PRECISION'])
+            with span("catalog"):
+                song_index, _ = catalog_cache.get()
+            with span("similarity"):
+                top_songs = song_index.top_n_batch(
+                    df_songs[song_index.features].to_numpy(), cluster_ids, top_n)
+            for pos, probed, songs in zip(found, cluster_ids, top_songs):
+                results[pos]["clusterId"] = probed[0]
+                results[pos]["probedClusters"] = probed
+                results[pos]["songs"] = songs
+
+        logger.info("%d songs queried through the API, %d scored",
+                    len(queries), len(found))
+        return jsonify(results=results)
+
+    except spotipy.SpotifyException as err:
+        logger.error("Spotify request failed: %s", err)
+        return jsonify(error="Spotify request failed"), 502
+    except (sqlite3.OperationalError, sqlalchemy.exc.OperationalError) as err:
+        logger.error(
+            "Not able to query database: %s. Error: %s ",
+            app.config['SQLALCHEMY_DATABASE_URI'], err)
+        return jsonify(error="Database unavailable"), 503
+
+
 if __name__ == '__main__':
     app.run(debug=app.config["DEBUG"], port=app.config["PORT"],
             host=app.config["HOST"])
\ No newline at end of file
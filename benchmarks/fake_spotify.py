@@ -0,0 +1,132 @@
+"""
+A local stand-in for the Spotify Web API that answers the token, search and
+audio features requests of the app with canned payloads after a configurable latency.
+Point the app to it with the SPOTIFY_TOKEN_URL and SPOTIFY_API_PREFIX environment variables.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from benchmarks.synthetic_catalog import FEATURE_RANGES
+from src.search_songs import TRACK_ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+
+def fake_track_id(query: str) -> str:
+    """Returns the (stable) track id the fake server answers a search with"""
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:22]
+
+
+def fake_audio_features(track_id: str) -> dict:
+    """Returns (stable) random audio features of a track, in the format of Spotify"""
+    rng = np.random.default_rng(int(hashlib.sha1(track_id.encode("utf-8")).hexdigest()[:12], 16))
+    features = {name: float(rng.uniform(low, high)) for name, (low, high) in FEATURE_RANGES.items()}
+    features.update({"id": track_id, "uri": f"spotify:track:{track_id}",
+                     "type": "audio_features", "key": int(rng.integers(0, 12)),
+                     "duration_ms": int(rng.integers(60_000, 360_000))})
+    return features
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    """Answers the requests spotipy sends. The latency is read from the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Token requests"""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path.rstrip("/").endswith("/api/token"):
+            self._reply(200, {"access_token": "fake-token", "token_type": "Bearer",
+                              "expires_in": 3600})
+        else:
+            self._reply(404, {"error": {"status": 404, "message": "Not found"}})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Search and audio features requests"""
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        params = parse_qs(url.query)
+        if path.endswith("/search"):
+            track_id = fake_track_id(params.get("q", [""])[0])
+            self._reply(200, {"tracks": {"total": 1, "items": [
+                {"id": track_id, "name": params.get("q", [""])[0],
+                 "uri": f"spotify:track:{track_id}"}]}})
+        elif path.endswith("/audio-features"):
+            track_ids = params.get("ids", [""])[0].split(",")
+            if not all(TRACK_ID_PATTERN.fullmatch(track_id) for track_id in track_ids):
+                # as Spotify, one malformed id fails the request
+                self._reply(400, {"error": {"status": 400, "message": "invalid request"}})
+            else:
+                self._reply(200, {"audio_features": [fake_audio_features(track_id)
+                                                     for track_id in track_ids]})
+        elif "/audio-features/" in path:
+            self._reply(200, fake_audio_features(path.rsplit("/", 1)[-1]))
+        else:
+            self._reply(404, {"error": {"status": 404, "message": "Not found"}})
+
+    def _reply(self, status: int, payload: dict) -> None:
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+def start_fake_spotify(latency: float = 0.0, host: str = "127.0.0.1",
+                       port: int = 0) -> ThreadingHTTPServer:
+    """Starts the fake server in a background thread
+
+    Keyword Arguments:
+        latency -- seconds to wait before answering each request (default: {0.0})
+        host -- the host to listen on (default: {"127.0.0.1"})
+        port -- the port to listen on, 0 for any free port (default: {0})
+
+    Returns:
+        the running server, stop it with shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Fake Spotify listening on %s:%d with %.0fms latency",
+                *server.server_address[:2], latency * 1000)
+    return server
+
+
+def spotify_environment(server: ThreadingHTTPServer) -> dict:
+    """Returns the environment variables that point the app to a fake server"""
+    host, port = server.server_address[:2]
+    return {"SPOTIFY_TOKEN_URL": f"http://{host}:{port}/api/token",
+            "SPOTIFY_API_PREFIX": f"http://{host}:{port}/v1/",
+            "SPOTIPY_CLIENT_ID": "benchmark", "SPOTIPY_CLIENT_SECRET": "benchmark"}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Spotify Web API")
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds to wait before answering each request")
+    args = parser.parse_args()
+
+    fake_server = start_fake_spotify(args.latency, port=args.port)
+    for name, value in spotify_environment(fake_server).items():
+        print(f"export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake_server.shutdown()
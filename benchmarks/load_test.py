@@ -0,0 +1,208 @@
+"""
+Load test of the web app: serves app.py on a synthetic catalog with a fake Spotify,
+sends concurrent requests to `/search` and `/` and reports their latency percentiles
+and throughput as JSON
+"""
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import logging.config
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.fake_spotify import spotify_environment, start_fake_spotify
+from benchmarks.synthetic_catalog import generate_catalog, write_catalog
+
+logger = logging.getLogger(__name__)
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    """Summarizes the latencies of one endpoint
+
+    Arguments:
+        latencies -- seconds taken by each request
+        errors -- number of requests that did not succeed
+        seconds -- wall time taken by all the requests
+
+    Returns:
+        a dictionary with the percentiles (ms) and the throughput (requests/sec)
+    """
+    values = np.array(latencies) * 1000
+    return {"requests": len(latencies), "errors": errors,
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "mean_ms": float(values.mean()), "max_ms": float(values.max()),
+            "requests_per_sec": len(latencies) / seconds}
+
+
+def run_requests(base_url: str, requests_args: list[dict], concurrency: int) -> dict:
+    """Sends requests concurrently and measures their latency
+
+    Arguments:
+        base_url -- url of the app
+        requests_args -- keyword arguments of requests.get for each request
+        concurrency -- number of requests in flight at the same time
+
+    Returns:
+        the summary of the latencies
+    """
+    local = threading.local()
+
+    def send(kwargs: dict) -> tuple[float, bool]:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(base_url + kwargs["path"], params=kwargs.get("params"),
+                                     allow_redirects=False)
+        return time.perf_counter() - start, response.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, requests_args))
+    seconds = time.perf_counter() - start
+    return summarize([latency for latency, _ in results],
+                     sum(1 for _, success in results if not success), seconds)
+
+
+def search_queries(n_requests: int, n_distinct: int, catalog_ratio: float,
+                   n_songs: int, seed: int = 0) -> list[dict]:
+    """Builds the /search requests. A share of the song names are titles of the
+    catalog (resolved locally), the others are searched on the fake Spotify.
+
+    Arguments:
+        n_requests -- number of requests
+        n_distinct -- number of distinct searches, repeats are answered by the response cache
+        catalog_ratio -- share of the distinct searches that are titles of the catalog
+        n_songs -- number of songs in the catalog
+
+    Keyword Arguments:
+        seed -- seed of the random generator (default: {0})
+
+    Returns:
+        keyword arguments of each request
+    """
+    rng = np.random.default_rng(seed)
+    distinct = []
+    for number in range(n_distinct):
+        if rng.random() < catalog_ratio:
+            song_name = f"synthetic song {rng.integers(0, n_songs)}"
+        else:
+            song_name = f"outside song {number}"
+        distinct.append({"path": "/search",
+                         "params": {"song_name": song_name, "artist": "benchmark"}})
+    return [distinct[number % n_distinct] for number in range(n_requests)]
+
+
+def git_commit() -> str:
+    """Returns the commit of the benchmarked code, None outside of a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              check=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: argparse.Namespace) -> dict:
+    """Runs the load test
+
+    Arguments:
+        args -- the parsed command line arguments
+
+    Returns:
+        the report
+    """
+    workdir = tempfile.mkdtemp(prefix="anime_benchmark_")
+    engine_string = f"sqlite:///{os.path.join(workdir, 'songs.db')}"
+
+    start = time.perf_counter()
+    write_catalog(generate_catalog(args.songs, args.clusters, args.seed), engine_string)
+    catalog_seconds = time.perf_counter() - start
+
+    fake_spotify = start_fake_spotify(args.spotify_latency)
+    overrides = os.path.join(workdir, "overrides.py")
+    with open(overrides, "w", encoding="utf-8") as file:
+        file.write("NEIGHBOURS_PATH = None\nSPOTIFY_CACHE_PATH = None\n"
+                   "SLOW_REQUEST_SECONDS = None\n")
+        if args.no_response_cache:
+            file.write("RESPONSE_CACHE_TTL = 0\n")
+    os.environ.update(spotify_environment(fake_spotify))
+    os.environ.update({"SQLALCHEMY_DATABASE_URI": engine_string,
+                       "FLASK_CONFIG_OVERRIDES": overrides})
+
+    # the app reads its configuration when it is imported
+    flask_app = importlib.import_module("app").app
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # the first request loads the catalog into memory
+    start = time.perf_counter()
+    requests.get(base_url + "/", timeout=600)
+    warmup_seconds = time.perf_counter() - start
+
+    results = {}
+    if "index" in args.endpoints:
+        results["index"] = run_requests(base_url, [{"path": "/"}] * args.requests,
+                                        args.concurrency)
+    if "search" in args.endpoints:
+        results["search"] = run_requests(
+            base_url, search_queries(args.requests, args.distinct or args.requests,
+                                     args.catalog_ratio, args.songs, args.seed),
+            args.concurrency)
+    server.shutdown()
+    fake_spotify.shutdown()
+
+    return {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": git_commit(), "python": platform.python_version(),
+            "parameters": vars(args), "catalog_seconds": catalog_seconds,
+            "warmup_seconds": warmup_seconds, "results": results}
+
+
+if __name__ == "__main__":
+    logging.config.fileConfig("config/logging/local.conf")
+    parser = argparse.ArgumentParser(
+        description="Measure the latency and throughput of the web app")
+    parser.add_argument("--songs", type=int, default=439,
+                        help="Number of songs of the synthetic catalog")
+    parser.add_argument("--clusters", type=int, default=5, help="Number of clusters")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="Number of requests sent to each endpoint")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Number of requests in flight at the same time")
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="Number of distinct searches (default: one per request)")
+    parser.add_argument("--catalog_ratio", type=float, default=0.5,
+                        help="Share of the searches that are titles of the catalog")
+    parser.add_argument("--spotify_latency", type=float, default=0.05,
+                        help="Seconds the fake Spotify waits before answering")
+    parser.add_argument("--no_response_cache", action="store_true",
+                        help="Render every page instead of answering repeats from the cache")
+    parser.add_argument("--endpoints", nargs="+", default=["search", "index"],
+                        choices=["search", "index"], help="Endpoints to load")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--output", default="benchmarks/results/load_test.json",
+                        help="Path to write the JSON report to")
+    arguments = parser.parse_args()
+
+    report = main(arguments)
+    os.makedirs(os.path.dirname(arguments.output) or ".", exist_ok=True)
+    with open(arguments.output, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    # printed, since importing the app reconfigures (and disables) the loggers of this script
+    for endpoint, summary in report["results"].items():
+        print(f"{endpoint:<7} p50={summary['p50_ms']:.1f}ms p95={summary['p95_ms']:.1f}ms "
+              f"p99={summary['p99_ms']:.1f}ms {summary['requests_per_sec']:.1f} requests/sec "
+              f"({summary['errors']} errors)")
+    print(f"Report written to {arguments.output}")
@@ -0,0 +1,309 @@
+"""
+Micro-benchmarks of the core preprocessing, model and search functions on synthetic
+catalogs of 1e3 to 1e6 songs, offline. The timings are written as a JSON report, which
+can be kept as a baseline and compared with a later run: the comparison fails when a
+function got slower than its baseline by more than a threshold.
+"""
+import argparse
+import datetime
+import json
+import logging
+import logging.config
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import typing
+
+import pandas as pd
+import yaml
+
+from benchmarks.load_test import git_commit
+from benchmarks.synthetic_catalog import generate_catalog
+from src.evaluate_model import assign_labels, assign_new_labels, evaluate, model_centroids
+from src.model import get_model
+from src.preprocessing import clean, featurize
+from src.search_songs import get_closest_cluster, get_top_n_closest_song
+
+logger = logging.getLogger(__name__)
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+# the exact silhouette compares every pair of songs
+EXACT_SILHOUETTE_MAX_ROWS = 10_000
+
+
+def raw_songs(n_songs: int, seed: int = 0) -> pd.DataFrame:
+    """Returns synthetic songs with the columns of the raw data downloaded from Spotify
+
+    Arguments:
+        n_songs -- number of songs
+
+    Keyword Arguments:
+        seed -- seed of the random generator (default: {0})
+
+    Returns:
+        the raw songs
+    """
+    return (generate_catalog(n_songs, seed=seed)
+            .drop(columns=["id", "clusterId"])
+            .rename(columns={"title": "name", "duration": "duration_ms", "track_uri": "uri"}))
+
+
+def prepare(n_songs: int, config: dict, seed: int = 0) -> dict:
+    """Builds the inputs of every benchmark for one size, by running the pipeline once
+
+    Arguments:
+        n_songs -- number of songs
+        config -- the configuration of config/model.yaml
+
+    Keyword Arguments:
+        seed -- seed of the random generator (default: {0})
+
+    Returns:
+        the raw, cleaned and featurized songs, the scaler, the model, the scored songs,
+        the labelled catalog and its centroids
+    """
+    raw = raw_songs(n_songs, seed)
+    cleaned = clean(raw, **config["preprocessing"]["clean"])
+    features, scaler = featurize(cleaned, precision=config["precision"],
+                                 **config["preprocessing"]["featurize"])
+    model = get_model(features, precision=config["precision"], **config["model"]["get_model"])
+    scores = assign_new_labels(raw, scaler, model,
+                               **config["evaluate_model"]["assign_new_labels"])
+    catalog = assign_labels(features, model)
+    return {"raw": raw, "cleaned": cleaned, "features": features, "scaler": scaler,
+            "model": model, "scores": scores, "catalog": catalog,
+            "centroids": model_centroids(model)}
+
+
+class Benchmark:
+    """A function timed on the inputs built by prepare().
+
+    Args:
+        name (str): name of the benchmark, the benchmarked function unless it runs
+            the function in another mode
+        run (Callable[[dict, dict], typing.Any]): calls the function on the inputs
+            and the configuration
+        max_rows (int): largest size the benchmark runs on, optional
+    """
+
+    def __init__(self, name: str, run: typing.Callable[[dict, dict], typing.Any],
+                 max_rows: typing.Optional[int] = None):
+        self.name = name
+        self.run = run
+        self.max_rows = max_rows
+
+
+def _search_settings(config: dict) -> dict:
+    return config["search_songs"]["get_closest_cluster"]
+
+
+def _evaluate_settings(config: dict, method: str) -> dict:
+    return {**config["evaluate_model"]["evaluate"], "method": method}
+
+
+BENCHMARKS = [
+    Benchmark("clean", lambda data, config: clean(
+        data["raw"], **config["preprocessing"]["clean"])),
+    Benchmark("featurize", lambda data, config: featurize(
+        data["cleaned"], precision=config["precision"], **config["preprocessing"]["featurize"])),
+    Benchmark("get_model", lambda data, config: get_model(
+        data["features"], precision=config["precision"], **config["model"]["get_model"])),
+    Benchmark("assign_labels", lambda data, config: assign_labels(
+        data["features"], data["model"])),
+    Benchmark("assign_new_labels", lambda data, config: assign_new_labels(
+        data["raw"], data["scaler"], data["model"],
+        **config["evaluate_model"]["assign_new_labels"])),
+    Benchmark("evaluate", lambda data, config: evaluate(
+        data["scores"], **_evaluate_settings(config, "exact")),
+        max_rows=EXACT_SILHOUETTE_MAX_ROWS),
+    Benchmark("evaluate_sampled", lambda data, config: evaluate(
+        data["scores"], **_evaluate_settings(config, "sampled"))),
+    # every song of the catalog searched at once
+    Benchmark("get_closest_cluster", lambda data, config: get_closest_cluster(
+        data["catalog"], data["centroids"], **_search_settings(config))),
+    # one song searched in its cluster of the catalog
+    Benchmark("get_top_n_closest_song", lambda data, config: get_top_n_closest_song(
+        data["catalog"].iloc[[0]], data["catalog"], top_n=10,
+        cluster_id=int(data["catalog"].loc[0, "clusterId"]), **_search_settings(config))),
+]
+
+
+def time_function(function: typing.Callable[[], typing.Any], repeat: int) -> dict:
+    """Times a function as timeit does: a call is looped until the loop takes at least
+    0.2 seconds, then the loop is repeated
+
+    Arguments:
+        function -- the function to time, without arguments
+        repeat -- number of times the loop is repeated
+
+    Returns:
+        the number of calls per loop, the minimum and median seconds of a call
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    seconds = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"number": number, "min_seconds": min(seconds),
+            "median_seconds": statistics.median(seconds)}
+
+
+def run_benchmarks(sizes: list[int], config: dict, repeat: int = 3,
+                   names: typing.Optional[list[str]] = None, seed: int = 0) -> dict:
+    """Times the benchmarks on synthetic catalogs of each size
+
+    Arguments:
+        sizes -- number of songs of each catalog
+        config -- the configuration of config/model.yaml
+
+    Keyword Arguments:
+        repeat -- number of timed loops of each function (default: {3})
+        names -- names of the benchmarks to run, all of them if None (default: {None})
+        seed -- seed of the random generator (default: {0})
+
+    Raises:
+        KeyError -- unknown benchmark name
+
+    Returns:
+        benchmark name -> number of songs -> timings and songs per second
+    """
+    known = [benchmark.name for benchmark in BENCHMARKS]
+    if names is not None and not set(names).issubset(known):
+        logger.error("Unknown benchmarks %s, the benchmarks are %s", names, known)
+        raise KeyError("Unknown benchmark")
+    results: dict[str, dict] = {}
+    for n_songs in sizes:
+        start = time.perf_counter()
+        data = prepare(n_songs, config, seed)
+        logger.info("Inputs of %d songs prepared in %.1f seconds", n_songs,
+                    time.perf_counter() - start)
+        for benchmark in BENCHMARKS:
+            if names is not None and benchmark.name not in names:
+                continue
+            if benchmark.max_rows is not None and n_songs > benchmark.max_rows:
+                continue
+            timing = time_function(lambda: benchmark.run(data, config), repeat)
+            timing["rows_per_second"] = n_songs / timing["min_seconds"]
+            results.setdefault(benchmark.name, {})[str(n_songs)] = timing
+            logger.info("%s on %d songs: %.4f seconds", benchmark.name, n_songs,
+                        timing["min_seconds"])
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.25,
+            min_seconds: float = 0.001) -> list[dict]:
+    """Compares the timings of a run with those of a baseline run
+
+    Arguments:
+        results -- the results of run_benchmarks()
+        baseline -- the results of the baseline run
+
+    Keyword Arguments:
+        threshold -- largest allowed slowdown, relative to the baseline (default: {0.25})
+        min_seconds -- smallest slowdown in seconds counted as a regression, below which
+            the difference is timing noise (default: {0.001})
+
+    Returns:
+        for each function and size timed in both runs, the minimum seconds of both runs,
+        their ratio and whether the function regressed
+    """
+    comparison = []
+    for name, timings in results.items():
+        for n_songs, timing in timings.items():
+            if n_songs not in baseline.get(name, {}):
+                continue
+            before = baseline[name][n_songs]["min_seconds"]
+            after = timing["min_seconds"]
+            comparison.append({"function": name, "rows": int(n_songs),
+                               "baseline_seconds": before, "seconds": after,
+                               "ratio": after / before,
+                               "regressed": (after > before * (1 + threshold)
+                                             and after - before > min_seconds)})
+    return comparison
+
+
+def machine() -> dict:
+    """Returns what the timings depend on besides the code: the platform, the processor
+    and its number of cores, and the versions of numpy, pandas and scikit-learn"""
+    # pylint: disable=import-outside-toplevel
+    import numpy
+    import sklearn
+    return {"platform": platform.platform(), "processor": platform.machine(),
+            "cpus": os.cpu_count(), "numpy": numpy.__version__, "pandas": pd.__version__,
+            "scikit-learn": sklearn.__version__}
+
+
+def main(args: argparse.Namespace) -> dict:
+    """Runs the micro-benchmarks, and compares them with a baseline if one is given
+
+    Arguments:
+        args -- the parsed command line arguments
+
+    Returns:
+        the report
+    """
+    with open(args.config, "r", encoding="utf-8") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+    report = {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+              "commit": git_commit(), "python": platform.python_version(),
+              "machine": machine(),
+              "parameters": vars(args),
+              "results": run_benchmarks(args.sizes, config, args.repeat, args.functions,
+                                        args.seed)}
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        report["baseline_commit"] = baseline.get("commit")
+        for key in ["python", "machine"]:
+            if baseline.get(key) != report[key]:
+                logger.warning("The baseline was recorded with another %s: %s, this run: %s",
+                               key, baseline.get(key), report[key])
+        report["comparison"] = compare(report["results"], baseline["results"],
+                                       args.threshold, args.min_seconds)
+    return report
+
+
+if __name__ == "__main__":
+    # the logger of this script is created before the configuration
+    logging.config.fileConfig("config/logging/local.conf", disable_existing_loggers=False)
+    # the timed functions log every call
+    logging.getLogger("src").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(
+        description="Time the preprocessing, model and search functions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="Number of songs of each synthetic catalog")
+    parser.add_argument("--functions", nargs="+", default=None,
+                        choices=[benchmark.name for benchmark in BENCHMARKS],
+                        help="Functions to time (default: all)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed loops of each function")
+    parser.add_argument("--config", default="config/model.yaml",
+                        help="Path to configuration file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--output", default="benchmarks/results/micro.json",
+                        help="Path to write the JSON report to, e.g. the baseline file")
+    parser.add_argument("--compare", default=None,
+                        help="Path of a baseline report to compare the timings with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Largest allowed slowdown relative to the baseline")
+    parser.add_argument("--min_seconds", type=float, default=0.001,
+                        help="Smallest slowdown in seconds counted as a regression")
+    arguments = parser.parse_args()
+
+    micro_report = main(arguments)
+    os.makedirs(os.path.dirname(arguments.output) or ".", exist_ok=True)
+    with open(arguments.output, "w", encoding="utf-8") as output:
+        json.dump(micro_report, output, indent=2)
+    for function, sizes in micro_report["results"].items():
+        for rows, result in sizes.items():
+            print(f"{function:<24} {rows:>8} rows {result['min_seconds'] * 1000:>10.2f}ms "
+                  f"{result['rows_per_second']:>14.0f} rows/sec")
+    print(f"Report written to {arguments.output}")
+    regressions = [row for row in micro_report.get("comparison", []) if row["regressed"]]
+    for row in regressions:
+        print(f"REGRESSION {row['function']} on {row['rows']} rows: "
+              f"{row['baseline_seconds'] * 1000:.2f}ms -> {row['seconds'] * 1000:.2f}ms "
+              f"({row['ratio']:.2f}x)")
+    if regressions:
+        sys.exit(1)
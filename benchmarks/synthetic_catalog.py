@@ -0,0 +1,105 @@
+"""
+Generate synthetic catalogs of anime songs in the schema of the songs table,
+from the size of the real catalog (439 songs) up to millions of songs
+"""
+import argparse
+import logging
+import logging.config
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from src.song_manager import SongManager, Songs, create_db
+
+logger = logging.getLogger(__name__)
+
+# range of the values of each audio feature, as returned by Spotify
+FEATURE_RANGES = {
+    "danceability": (0.0, 1.0),
+    "energy": (0.0, 1.0),
+    "loudness": (-30.0, 0.0),
+    "speechiness": (0.0, 1.0),
+    "acousticness": (0.0, 1.0),
+    "instrumentalness": (0.0, 1.0),
+    "liveness": (0.0, 1.0),
+    "valence": (0.0, 1.0),
+    "tempo": (60.0, 200.0),
+}
+
+
+def synthetic_track_id(number: int) -> str:
+    """Returns a Spotify-like track id (22 characters) of a synthetic song"""
+    return f"bench{number:017d}"
+
+
+def generate_catalog(n_songs: int, n_clusters: int = 5, seed: int = 0) -> pd.DataFrame:
+    """Generates songs whose features are spread around n_clusters centers
+
+    Arguments:
+        n_songs -- number of songs to generate
+        n_clusters -- number of clusters of the catalog
+        seed -- seed of the random generator
+
+    Returns:
+        a dataframe with one column per column of the songs table
+    """
+    rng = np.random.default_rng(seed)
+    low = np.array([bounds[0] for bounds in FEATURE_RANGES.values()])
+    high = np.array([bounds[1] for bounds in FEATURE_RANGES.values()])
+    centers = rng.uniform(low, high, size=(n_clusters, len(FEATURE_RANGES)))
+    cluster_ids = rng.integers(0, n_clusters, size=n_songs)
+    noise = rng.normal(0, 0.1, size=(n_songs, len(FEATURE_RANGES))) * (high - low)
+    values = np.clip(centers[cluster_ids] + noise, low, high)
+
+    df_songs = pd.DataFrame(values, columns=list(FEATURE_RANGES))
+    df_songs.insert(0, "id", np.arange(1, n_songs + 1))
+    df_songs.insert(1, "title", [f"synthetic song {number}" for number in range(n_songs)])
+    df_songs.insert(2, "clusterId", cluster_ids)
+    df_songs["key"] = rng.integers(0, 12, size=n_songs)
+    df_songs["duration"] = rng.integers(60_000, 360_000, size=n_songs)
+    df_songs["track_uri"] = [f"spotify:track:{synthetic_track_id(number)}"
+                             for number in range(n_songs)]
+    logger.info("%d synthetic songs generated in %d clusters", n_songs, n_clusters)
+    # in the order of the columns of the table
+    return df_songs[[column.name for column in Songs.__table__.columns]]
+
+
+def write_catalog(df_songs: pd.DataFrame, engine_string: str, chunk_size: int = 10_000) -> None:
+    """Creates the tables and inserts the songs in chunks, then bumps the catalog version
+
+    Arguments:
+        df_songs -- songs generated by generate_catalog()
+        engine_string -- SQLAlchemy connection URI of the database
+
+    Keyword Arguments:
+        chunk_size -- number of songs inserted per statement (default: {10_000})
+    """
+    create_db(engine_string)
+    engine = sqlalchemy.create_engine(engine_string)
+    columns = list(df_songs.columns)
+    with engine.begin() as conn:
+        for start in range(0, len(df_songs), chunk_size):
+            chunk = df_songs.iloc[start:start + chunk_size]
+            conn.execute(Songs.__table__.insert(),
+                         [dict(zip(columns, row)) for row in chunk.itertuples(index=False)])
+    engine.dispose()
+
+    song_manager = SongManager(engine_string=engine_string)
+    song_manager.bump_catalog_version()
+    song_manager.close()
+    logger.info("%d songs written to %s", len(df_songs), engine_string)
+
+
+if __name__ == "__main__":
+    logging.config.fileConfig("config/logging/local.conf")
+    parser = argparse.ArgumentParser(
+        description="Create a database filled with a synthetic catalog of songs")
+    parser.add_argument("--songs", type=int, default=439, help="Number of songs to generate")
+    parser.add_argument("--clusters", type=int, default=5, help="Number of clusters")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--engine_string", default="sqlite:///data/benchmark.db",
+                        help="SQLAlchemy connection URI of the database to create")
+    args = parser.parse_args()
+
+    write_catalog(generate_catalog(args.songs, args.clusters, args.seed), args.engine_string)
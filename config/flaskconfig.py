@@ -20,3 +20,46 @@ FEATURES = ['danceability', 'energy', 'loudness',
        'speechiness', 'acousticness', 'instrumentalness',
         'liveness','valence', 'tempo']
 TOP_N = 10
+# Seconds between two checks of the catalog version for reloading cached centroids
+CATALOG_CHECK_INTERVAL = 5
+# The Spotify client (token and HTTP connections) is shared by all requests of a worker
+SPOTIFY_POOL_SIZE = 10  # Maximum number of keep-alive connections to Spotify
+SPOTIFY_TIMEOUT = 5  # Seconds to wait for a Spotify response
+# Spotify searches (by normalized query) and audio features (by track id) are cached
+SPOTIFY_CACHE_SIZE = 10000  # Maximum number of entries kept in memory per cache
+SPOTIFY_CACHE_TTL = 24 * 60 * 60  # Seconds before a cached lookup expires
+SPOTIFY_CACHE_PATH = os.environ.get('SPOTIFY_CACHE_PATH')  # sqlite file to persist the caches to, optional
+API_MAX_BATCH = 1000  # Maximum number of songs in one /api/recommendations request
+# Number of closest clusters searched for recommendations. 1 only searches the closest
+# cluster; higher values find more of the true nearest songs at the cost of latency
+NPROBE = 1
+# Numeric type of the similarity matrix and of the centroid similarities: float32 halves
+# the memory of the catalog and doubles the throughput of the products, float64 is exact.
+# A snapshot is served in the type it was built in instead
+PRECISION = os.environ.get('PRECISION', 'float32')
+# Precomputed neighbours of the catalog songs (`run.py neighbours`). Searches for catalog
+# songs are answered from this file; None or a missing file computes every search online
+NEIGHBOURS_PATH = "models/neighbours.npz"
+# Song names matching a title of the catalog are resolved locally, without Spotify.
+# The songs table has no artist, so only the title is matched, and as a whole when an artist is given
+LOCAL_LOOKUP = True
+LOCAL_LOOKUP_MIN_PREFIX = 4  # Minimum length of a song name to be matched as a title prefix, without an artist
+# Rendered pages are cached by the searched track, the settings above and the catalog version
+RESPONSE_CACHE_SIZE = 1000  # Maximum number of rendered pages kept in memory
+RESPONSE_CACHE_TTL = 60 * 60  # Seconds before a rendered page is rendered again
+RESPONSE_MAX_AGE = 60  # Seconds browsers and proxies may reuse a page before revalidating its ETag
+# Stages of the requests are timed and exposed at /metrics in the Prometheus text format
+# (per gunicorn worker, each series labelled with the pid of the worker that answered)
+METRICS_ENABLED = True
+SLOW_REQUEST_SECONDS = 1.0  # Requests slower than this are logged with their stages, None disables
+# Production serving with gunicorn (config/gunicorn.conf.py, dockerfiles/Dockerfile.app.prod)
+WORKERS = int(os.environ.get('WORKERS', 4))  # Number of preforked worker processes
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 4))  # Threads handling requests in each worker
+WORKER_TIMEOUT = 30  # Seconds a worker can be silent before it is restarted
+# Directory of the catalog file memory-mapped by all workers (built once per catalog version).
+# None builds the catalog in the memory of each process
+SHARED_CATALOG_DIR = os.environ.get('SHARED_CATALOG_DIR')
+# Serving snapshot built by `run.py snapshot`. When set, the app boots from this file and
+# only reads the catalog version from the database, and serves from the database once the
+# songs table changed; restart the app to serve a new snapshot
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH')
@@ -0,0 +1,39 @@
+"""
+gunicorn configuration for serving the app with preforked workers, e.g.
+`gunicorn --config config/gunicorn.conf.py`
+"""
+import logging
+import sys
+
+from config import flaskconfig
+from src.shared_catalog import prepare_shared_catalog
+
+wsgi_app = "app:app"
+bind = f"{flaskconfig.HOST}:{flaskconfig.PORT}"
+workers = flaskconfig.WORKERS
+threads = flaskconfig.WORKER_THREADS
+timeout = flaskconfig.WORKER_TIMEOUT
+# the app is imported by each worker, so that no database connection is shared across forks
+preload_app = False
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Writes the shared catalog file once in the master, before any worker starts"""
+    # a serving snapshot is already a file mapped by every worker
+    if not flaskconfig.SHARED_CATALOG_DIR or flaskconfig.SNAPSHOT_PATH:
+        return
+    try:
+        prepare_shared_catalog(flaskconfig.SQLALCHEMY_DATABASE_URI, flaskconfig.FEATURES,
+                               flaskconfig.SHARED_CATALOG_DIR, flaskconfig.PRECISION)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Shared catalog not prepared, the first worker builds it")
+
+
+def post_worker_init(worker):  # pylint: disable=unused-argument
+    """Loads (maps) the catalog before the worker accepts requests"""
+    try:
+        sys.modules["app"].catalog_cache.get()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Catalog not loaded at startup, it is loaded by the first request")
@@ -5,13 +5,20 @@ import logging.config
 import os
 
 import joblib
-import pandas as pd
 import yaml
 
-from src.evaluate_model import assign_labels, assign_new_labels, evaluate
-from src.model import get_model, save_model
-from src.preprocessing import clean, featurize, read_from_local
+from src.evaluate_model import (assign_labels, assign_labels_streaming, assign_new_labels,
+                                 assign_new_labels_parallel, evaluate)
+from src.model import get_minibatch_model, get_model, load_model, save_model, sweep_k
+from src.model_artifact import ModelArtifact, export_artifact
+from src.neighbours import compute_neighbours, save_neighbours
+from src.pipeline import file_digest, run_pipeline
+from src.preprocessing import (clean, clean_streaming, featurize, featurize_streaming,
+                               read_from_local)
+from src.profiling import StepProfiler
 from src.s3 import download_file_from_s3, upload_file_to_s3
+from src.snapshot import save_snapshot
+from src.tables import read_table, write_table
 
 logging.config.fileConfig("config/logging/local.conf")
 logger = logging.getLogger("running_pipeline")
@@ -21,7 +28,8 @@ S3_BUCKET = os.getenv("S3_BUCKET")
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("step", choices=["acquire", "clean", "featurize", "train", "score", "evaluate"],
+    parser.add_argument("step", choices=["acquire", "clean", "featurize", "train", "score", "evaluate",
+                                 "neighbours", "snapshot", "export", "all"],
                         help="which step to run")
     parser.add_argument("--input", "-i", default=None,
                         help="Path to input data")
@@ -37,8 +45,16 @@ if __name__ == "__main__":
                         help="Specifical to the cleaning step to save the downloaded file from s3")
     parser.add_argument("--origin_data", default=None,
                         help="specific for the train step, gives the cleaned unprocessed file")
+    parser.add_argument("--report_output", default=None,
+                        help="specific for the train step in sweep mode, path to save the comparison of the candidate models")
     parser.add_argument("--scalar", default=None,
-                        help="specific for the score step, gives the standard scalar used in featurize")
+                        help="specific for the score, snapshot and export steps, gives the standard scalar used in featurize")
+
+    parser.add_argument("--force", action="store_true",
+                        help="specific for the all step, runs every step even if its inputs and configuration are unchanged")
+    parser.add_argument("--profile", action="store_true",
+                        help="profile the step (CPU time per function, allocations, wall time, peak RSS and rows/sec "
+                             "of each phase) and save the report next to the outputs")
 
     args = parser.parse_args()
 
@@ -49,74 +65,170 @@ if __name__ == "__main__":
     except FileNotFoundError:
         logger.error(
             "The path to the config file is wrong! Please check your path.")
+        raise
     logger.info("Configuration file loaded from %s", args.config)
 
+    # in streaming/minibatch/parallel mode, the clean, featurize, train and score steps
+    # stream their inputs from disk in chunks and write their outputs chunk by chunk
+    streaming = ((args.step in ["clean", "featurize"]
+                  and config["preprocessing"].get("mode", "full") == "streaming")
+                 or (args.step == "train"
+                     and config["model"].get("mode", "full") == "minibatch")
+                 or (args.step == "score"
+                     and config["evaluate_model"].get("score", {}).get("mode", "full") == "parallel"))
+
+    profiler = StepProfiler(args.step, enabled=args.profile)
+    profiler.start()
+    file_in = None
+    # number of rows processed by the step, when the step reports it
+    n_rows = None
+
     if args.input is not None:
         # unless it"s the acquisition step, most input can be read as a dataframe
-        if args.step not in ["acquire", "clean"]:
+        if args.step not in ["acquire", "clean", "export"] and not streaming:
+            with profiler.phase("read input") as phase:
+                try:
+                    file_in = read_table(args.input)
+                    phase.rows = len(file_in)
+                    logger.info("Input data loaded from %s", args.input)
+                except FileNotFoundError:
+                    logger.error(
+                        "Cannot find file at the specified input path %s", args.input)
+                    raise
+
+    if args.origin_data is not None and not streaming:
+        with profiler.phase("read origin data") as phase:
             try:
-                file_in = pd.read_csv(args.input)
-                logger.info("Input data loaded from %s", args.input)
+                origin_data = read_table(args.origin_data)
+                phase.rows = len(origin_data)
+                logger.info("Input data loaded from %s", args.origin_data)
             except FileNotFoundError:
                 logger.error(
-                    "Cannot find file at the specified input path %s", args.input)
-
-    if args.origin_data is not None:
-        try:
-            origin_data = pd.read_csv(args.origin_data)
-            logger.info("Input data loaded from %s", args.origin_data)
-        except FileNotFoundError:
-            logger.error(
-                "Cannot find file at the specified input path %s", args.origin_data)
+                    "Cannot find file at the specified input path %s", args.origin_data)
+                raise
 
     if args.model is not None:
-        try:
-            model_in = joblib.load(args.model)
-            logger.info("Input model loaded from %s", args.model)
-        except FileNotFoundError:
-            logger.error(
-                "Cannot find model at the specified path %s", args.model)
+        with profiler.phase("load model"):
+            try:
+                # a joblib model, or a model artifact written by the export step
+                model_in = load_model(args.model)
+                logger.info("Input model loaded from %s", args.model)
+            except FileNotFoundError:
+                logger.error(
+                    "Cannot find model at the specified path %s", args.model)
+                raise
 
     if args.scalar is not None:
-        try:
-            scalar_in = joblib.load(args.scalar)
-            logger.info("Input scalar loaded from %s", args.scalar)
-        except FileNotFoundError:
-            logger.error(
-                "Cannot find scalar at the specified path %s", args.scalar)
+        with profiler.phase("load scalar"):
+            try:
+                scalar_in = joblib.load(args.scalar)
+                logger.info("Input scalar loaded from %s", args.scalar)
+            except FileNotFoundError:
+                logger.error(
+                    "Cannot find scalar at the specified path %s", args.scalar)
+                raise
+    elif args.model is not None and isinstance(model_in, ModelArtifact):
+        # a model artifact holds the scaler of its features
+        scalar_in = model_in.scaler
 
     # taking actions based on step name
-    if args.step == "acquire":
-        upload_file_to_s3(args.input, S3_BUCKET)
-    elif args.step == "clean":
-        # download file from s3 and save as an csv
-        download_file_from_s3(local_path=args.mid_output, s3path=S3_BUCKET)
-        file_in = read_from_local(args.mid_output)
-        file_out = clean(file_in, **config["preprocessing"]["clean"])
-    elif args.step == "featurize":
-        file_out, model_out = featurize(
-            file_in, **config["preprocessing"]["featurize"])
-    elif args.step == "train":
-        model_out = get_model(file_in, **config["model"]["get_model"])
-        file_out = assign_labels(origin_data, model_out)
-    elif args.step == "score":
-        file_out = assign_new_labels(
-            file_in, scalar_in, model_in, **config["evaluate_model"]["assign_new_labels"])
-    else:
-        file_out = evaluate(file_in)
+    with profiler.phase(args.step) as phase:
+        if args.step == "acquire":
+            upload_file_to_s3(args.input, S3_BUCKET)
+        elif args.step == "all":
+            # each stage of the pipeline is profiled as a phase
+            status = run_pipeline(config, force=args.force, profiler=profiler)
+            logger.info("Pipeline finished: %s", status)
+        elif args.step == "clean" and streaming:
+            download_file_from_s3(local_path=args.mid_output, s3path=S3_BUCKET)
+            n_rows = clean_streaming(args.mid_output, args.file_output,
+                                     chunk_size=config["preprocessing"]["chunk_size"],
+                                     **config["preprocessing"]["clean"])
+        elif args.step == "clean":
+            # download file from s3 and save as an csv
+            download_file_from_s3(local_path=args.mid_output, s3path=S3_BUCKET)
+            file_in = read_from_local(args.mid_output)
+            file_out = clean(file_in, **config["preprocessing"]["clean"])
+        elif args.step == "featurize" and streaming:
+            model_out = featurize_streaming(args.input, args.file_output,
+                                            chunk_size=config["preprocessing"]["chunk_size"],
+                                            precision=config["precision"],
+                                            **config["preprocessing"]["featurize"])
+        elif args.step == "featurize":
+            file_out, model_out = featurize(
+                file_in, precision=config["precision"], **config["preprocessing"]["featurize"])
+        elif args.step == "train" and streaming:
+            model_out = get_minibatch_model(args.input, precision=config["precision"],
+                                            **config["model"]["get_minibatch_model"])
+            n_rows = assign_labels_streaming(
+                args.input, args.origin_data, model_out, args.file_output,
+                config["model"]["get_minibatch_model"]["chunk_size"])
+        elif args.step == "train" and config["model"].get("mode", "full") == "sweep":
+            model_out, report = sweep_k(file_in, precision=config["precision"],
+                                        **config["model"]["sweep_k"])
+            file_out = assign_labels(origin_data, model_out)
+            if args.report_output is not None:
+                report.to_csv(args.report_output, index=False)
+                logger.info("Comparison of the candidate models saved to %s", args.report_output)
+        elif args.step == "train":
+            model_out = get_model(file_in, precision=config["precision"],
+                                  **config["model"]["get_model"])
+            file_out = assign_labels(origin_data, model_out)
+        elif args.step == "score" and streaming:
+            n_rows = assign_new_labels_parallel(
+                args.input, args.file_output, scalar_in, model_in,
+                chunk_size=config["evaluate_model"]["score"]["chunk_size"],
+                n_jobs=config["evaluate_model"]["score"]["n_jobs"],
+                **config["evaluate_model"]["assign_new_labels"])
+        elif args.step == "score":
+            file_out = assign_new_labels(
+                file_in, scalar_in, model_in, **config["evaluate_model"]["assign_new_labels"])
+        elif args.step == "neighbours":
+            neighbours = compute_neighbours(
+                file_in, **config["neighbours"]["compute_neighbours"])
+        elif args.step in ["snapshot", "export"]:
+            # written below, once the output path is known
+            pass
+        else:
+            file_out = evaluate(file_in, **config["evaluate_model"]["evaluate"])
+        if n_rows is None and file_in is not None:
+            n_rows = len(file_in)
+        phase.rows = n_rows
 
     # define the output files
-    if args.file_output is not None:
-        try:
-            if args.step not in ["acquire", "evaluate"]:
-                file_out.to_csv(args.file_output, index=False)
-            if args.step == "evaluate":
-                with open(args.file_output, "w", encoding="utf-8") as f:
-                    f.write(file_out)
-            logger.info("Output saved to %s", args.file_output)
-        except FileNotFoundError:
-            logger.error(
-                "The specified output path at %s does not exist", args.file_output)
-
-    if args.model_output is not None:
-        save_model(model_out, output_path=args.model_output)
+    with profiler.phase("write output") as phase:
+        if args.file_output is not None:
+            try:
+                if args.step == "neighbours":
+                    save_neighbours(file_in, *neighbours, output_path=args.file_output,
+                                    features=config["neighbours"]["compute_neighbours"]["features"])
+                elif args.step == "snapshot":
+                    save_snapshot(file_in, output_path=args.file_output,
+                                  scaler=scalar_in if args.scalar is not None else None,
+                                  precision=config["precision"],
+                                  **config["snapshot"]["save_snapshot"])
+                elif args.step == "export":
+                    # the training data is only hashed, as metadata of the artifact
+                    export_artifact(model_in, scalar_in, args.file_output,
+                                    data_hash=file_digest(args.input) if args.input else None)
+                elif streaming:
+                    # already written chunk by chunk
+                    pass
+                elif args.step not in ["acquire", "evaluate", "snapshot", "export"]:
+                    # csv or parquet, depending on the extension
+                    write_table(file_out, args.file_output)
+                    phase.rows = len(file_out)
+                if args.step == "evaluate":
+                    with open(args.file_output, "w", encoding="utf-8") as f:
+                        f.write(file_out)
+                logger.info("Output saved to %s", args.file_output)
+            except FileNotFoundError:
+                logger.error(
+                    "The specified output path at %s does not exist", args.file_output)
+
+        if args.model_output is not None:
+            save_model(model_out, output_path=args.model_output)
+
+    profiler.stop()
+    # next to the outputs of the step, if profiled
+    profiler.save(args.file_output or args.model_output or os.path.join("models", args.step))
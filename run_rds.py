@@ -1,14 +1,22 @@
-"""allow users to have two operation options regarding rds instance when running this script
+"""allow users to have three operation options regarding rds instance when running this script
     1. create a database
     2. add data to a specific database
+    3. add new songs to the catalog of a database, assigning them to the trained clusters
 """
 import argparse
+import json
 import logging
 
+import joblib
 import sqlalchemy.exc
+import yaml
 
 import src.song_manager as songs
 from config.flaskconfig import SQLALCHEMY_DATABASE_URI
+from src.catalog_update import update_from_config
+from src.model import load_model
+from src.model_artifact import ModelArtifact
+from src.tables import read_table
 
 logging.config.fileConfig("config/logging/local.conf")
 logger = logging.getLogger("rds_running")
@@ -20,13 +28,24 @@ if __name__ == "__main__":
     parser.add_argument("operation", default="create_db",
                         help="This argument decides whether to create a new database"
                         "Or to add data to a current database. You can choose between `create`"
-                        "or  `add_data`",
-                        choices=["create", "add_data"])
+                        "or  `add_data`, or `update` to add new songs without retraining",
+                        choices=["create", "add_data", "update"])
     parser.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
                         help="SQLAlchemy connection URI for database")
     parser.add_argument("--data_path", default="data/intermediate/clustered_songs.csv",
                         help="If use add_data, then need to provide this argument."
                         "Gives a list of songs to be added.")
+    parser.add_argument("--model", default="models/model.bin",
+                        help="If use update, the model artifact (or joblib model) assigning "
+                        "the new songs to clusters")
+    parser.add_argument("--scalar", default="models/scalar.joblib",
+                        help="If use update with a joblib model, the standard scalar used in "
+                        "featurize. A model artifact holds its scaler")
+    parser.add_argument("--state", default="models/cluster_state.json",
+                        help="If use update, the centroids updated by the previous updates, "
+                        "started from the model if it does not exist")
+    parser.add_argument("--config", default="config/model.yaml",
+                        help="Path to configuration file")
 
     args = parser.parse_args()
 
@@ -37,6 +56,17 @@ if __name__ == "__main__":
         except sqlalchemy.exc.OperationalError as err:
             logger.error("Could not connect to database!")
             raise err
+    elif args.operation == "update":
+        # data_path holds new songs with the audio features returned by Spotify
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+        model = load_model(args.model)
+        scaler = model.scaler if isinstance(model, ModelArtifact) else joblib.load(args.scalar)
+        sm = songs.SongManager(engine_string=args.engine_string)
+        drift = update_from_config(read_table(args.data_path), scaler, model, sm, args.state,
+                                   config)
+        sm.close()
+        logger.info("Drift since training: %s", json.dumps(drift))
     else:
         # add data from the csv file line by line to the database
         sm = songs.SongManager(engine_string=args.engine_string)
@@ -0,0 +1,109 @@
+"""
+A single-file binary format for named numpy arrays and a JSON header. Arrays are stored
+uncompressed at aligned offsets, so loading maps them into memory without parsing or
+copying, and processes mapping the same file share its pages.
+"""
+import json
+import logging
+import os
+import typing
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ANIMEBND"
+FORMAT_VERSION = 1
+# offset of every array in the file is a multiple of this
+ALIGNMENT = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_bundle(path: str, arrays: dict[str, np.ndarray],
+                attrs: typing.Optional[dict] = None) -> None:
+    """Writes arrays and attributes to a bundle file. The file is written next to the
+    target and renamed, so readers never see a partially written bundle.
+
+    Arguments:
+        path -- the path of the file to write
+        arrays -- name -> array, of numeric, boolean or fixed-width string dtype
+
+    Keyword Arguments:
+        attrs -- JSON serializable attributes stored in the header (default: {None})
+
+    Raises:
+        TypeError -- an array holds python objects
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            logger.error("Array %s holds python objects and cannot be mapped", name)
+            raise TypeError(f"Array {name} holds python objects, convert it to a fixed-width dtype")
+
+    # offsets depend on the header length, which depends on the offsets: fix the header
+    # length by padding it to a generous upper bound computed from a first pass
+    entries = {name: {"dtype": array.dtype.str, "shape": list(array.shape), "offset": 0}
+               for name, array in arrays.items()}
+    header = {"format_version": FORMAT_VERSION, "attrs": attrs or {}, "arrays": entries}
+    header_size = _aligned(len(json.dumps(header).encode("utf-8")) + 32 * len(arrays) + 64)
+    offset = _aligned(len(MAGIC) + 8 + header_size)
+    for name, array in arrays.items():
+        entries[name]["offset"] = offset
+        offset = _aligned(offset + array.nbytes)
+    encoded = json.dumps(header).encode("utf-8").ljust(header_size)
+
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(header_size.to_bytes(8, "little"))
+        file.write(encoded)
+        for name, array in arrays.items():
+            file.seek(entries[name]["offset"])
+            file.write(array.tobytes())
+        file.truncate(offset)
+    os.replace(tmp_path, path)
+    logger.info("%d arrays written to %s (%.1f MB)", len(arrays), path, offset / 1e6)
+
+
+def load_bundle(path: str, mmap: bool = True) -> tuple[dict[str, np.ndarray], dict]:
+    """Reads a bundle written by save_bundle()
+
+    Arguments:
+        path -- the path of the bundle
+
+    Keyword Arguments:
+        mmap -- map the arrays read-only instead of reading them into memory (default: {True})
+
+    Raises:
+        ValueError -- the file is not a bundle
+
+    Returns:
+        name -> array, and the attributes of the bundle
+    """
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            logger.error("%s is not a bundle file", path)
+            raise ValueError(f"{path} is not a bundle file")
+        header_size = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_size).decode("utf-8"))
+        if header["format_version"] != FORMAT_VERSION:
+            logger.error("Bundle format %s is not supported", header["format_version"])
+            raise ValueError(f"Unsupported bundle format {header['format_version']}")
+
+        arrays = {}
+        for name, entry in header["arrays"].items():
+            dtype = np.dtype(entry["dtype"])
+            shape = tuple(entry["shape"])
+            if mmap and dtype.itemsize and np.prod(shape, dtype=np.int64) > 0:
+                # a plain array viewing the map, which stays open while the array is used
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=entry["offset"],
+                                         shape=shape).view(np.ndarray)
+            else:
+                file.seek(entry["offset"])
+                count = int(np.prod(shape, dtype=np.int64))
+                arrays[name] = np.fromfile(file, dtype=dtype, count=count).reshape(shape)
+    logger.debug("%d arrays loaded from %s", len(arrays), path)
+    return arrays, header["attrs"]
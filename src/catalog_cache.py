@@ -0,0 +1,89 @@
+"""
+Keep values derived from the songs table (e.g. cluster centroids) in memory
+and reload them only when the catalog version changes after an ingestion
+"""
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """Holds a value computed from the songs table until the catalog version changes.
+
+    Args:
+        loader (callable): function without arguments that builds the value from the database
+        version_getter (callable): function without arguments that returns the current
+            catalog version, e.g. `SongManager.get_catalog_version`
+        check_interval (float): minimum number of seconds between two version checks.
+            0 checks the version on every access.
+        updater (callable): function that takes the cached value and returns it updated
+            with the songs ingested since, or None if it cannot and the value needs to be
+            reloaded. Optional, the value is always reloaded without it.
+    """
+
+    def __init__(self, loader: typing.Callable[[], typing.Any],
+                 version_getter: typing.Callable[[], int],
+                 check_interval: float = 0,
+                 updater: typing.Optional[typing.Callable[[typing.Any],
+                                                          typing.Optional[typing.Any]]] = None):
+        self.loader = loader
+        self.version_getter = version_getter
+        self.check_interval = check_interval
+        self.updater = updater
+        self._value: typing.Any = None
+        self._version: typing.Optional[int] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> typing.Optional[int]:
+        """The catalog version the cached value was built from (None if not loaded)"""
+        return self._version
+
+    def get(self) -> typing.Any:
+        """Returns the cached value, loading or reloading it if needed
+
+        Returns:
+            the value built by the loader
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._version is None:
+                self._load(self.version_getter(), now)
+            elif now - self._last_check >= self.check_interval:
+                version = self.version_getter()
+                self._last_check = now
+                if version != self._version:
+                    self._refresh(version, now)
+            return self._value
+
+    def invalidate(self) -> None:
+        """Drops the cached value so that the next access reloads it"""
+        with self._lock:
+            self._value = None
+            self._version = None
+        logger.info("Catalog cache invalidated")
+
+    def _refresh(self, version: int, now: float) -> None:
+        if self.updater is not None:
+            value = self.updater(self._value)
+            if value is not None:
+                logger.info("Catalog version changed from %d to %d, updated",
+                            self._version, version)
+                self._value = value
+                self._version = version
+                return
+        logger.info("Catalog version changed from %d to %d, reloading",
+                    self._version, version)
+        self._load(version, now)
+
+    def _load(self, version: int, now: float) -> None:
+        # the version is read before loading, so an ingestion that happens
+        # while loading is picked up by the next check
+        self._value = self.loader()
+        self._version = version
+        self._last_check = now
+        logger.debug("Catalog cache loaded at version %d", version)
@@ -0,0 +1,174 @@
+"""
+Resolve searched song names against the titles of the anime songs in the catalog,
+so that searches for songs we already have do not need to go to Spotify
+"""
+import bisect
+import logging
+import typing
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import validate_features
+
+logger = logging.getLogger(__name__)
+
+# number of titles sharing a prefix that are compared when resolving a prefix
+MAX_PREFIX_CANDIDATES = 50
+
+
+def normalize_title(title: str) -> str:
+    """A helper function that normalizes a song title for matching
+    (unicode compatibility forms, case and whitespace)
+
+    Arguments:
+        title -- the title to normalize
+
+    Returns:
+        the normalized title
+    """
+    return " ".join(unicodedata.normalize("NFKC", str(title)).casefold().split())
+
+
+class TitleIndex:
+    """Sorted index of normalized catalog titles with the stored features of each song.
+
+    Args:
+        keys (list[str] | np.ndarray): normalized titles in sorted order
+        rows (np.ndarray): row in `values` of each key
+        features (list[str]): names of the feature columns
+        values (np.ndarray): (n_songs, n_features) stored features of the songs
+        track_uris (np.ndarray): Spotify uri of each song
+    """
+
+    def __init__(self, keys: list[str], rows: np.ndarray, features: list[str],
+                 values: np.ndarray, track_uris: np.ndarray):
+        self.keys = keys
+        self.rows = rows
+        self.features = list(features)
+        self.values = values
+        self.track_uris = track_uris
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_dataframe(cls, df_songs: pd.DataFrame, features: list[str]) -> "TitleIndex":
+        """Builds the index from a dataframe of songs as stored in the songs table
+
+        Arguments:
+            df_songs -- songs with title, track_uri and feature columns
+            features -- the features to return for a matched song
+
+        Raises:
+            KeyError -- Nonexisting features
+
+        Returns:
+            a TitleIndex
+        """
+        if not validate_features(df_songs, features + ["title", "track_uri"]):
+            logger.error("The features selected is not an available song feature!")
+            raise KeyError("Nonexisting feature")
+
+        titles = [normalize_title(title) for title in df_songs["title"]]
+        # stable sort, so duplicated titles resolve to the first ingested song
+        order = sorted(range(len(titles)), key=titles.__getitem__)
+        logger.info("Title index built with %d songs", len(titles))
+        return cls([titles[row] for row in order], np.array(order, dtype=np.int64),
+                   features, df_songs[features].to_numpy(dtype=np.float64),
+                   df_songs["track_uri"].to_numpy())
+
+    def append(self, df_new: pd.DataFrame) -> "TitleIndex":
+        """Returns a new index with songs added after the current ones
+
+        Arguments:
+            df_new -- songs with title, track_uri and feature columns
+
+        Raises:
+            KeyError -- Nonexisting features
+
+        Returns:
+            a TitleIndex
+        """
+        if not validate_features(df_new, self.features + ["title", "track_uri"]):
+            logger.error("The features selected is not an available song feature!")
+            raise KeyError("Nonexisting feature")
+
+        titles = [normalize_title(title) for title in df_new["title"]]
+        pairs = list(zip(list(self.keys), self.rows.tolist()))
+        pairs.extend((title, len(self.values) + row) for row, title in enumerate(titles))
+        # the current keys are one sorted run and the new keys another, which the stable
+        # sort merges; duplicated titles still resolve to the first ingested song
+        pairs.sort(key=lambda pair: pair[0])
+        logger.info("%d songs appended to the title index", len(titles))
+        return TitleIndex([key for key, _ in pairs],
+                          np.array([row for _, row in pairs], dtype=np.int64), self.features,
+                          np.concatenate([self.values,
+                                          df_new[self.features].to_numpy(dtype=np.float64)]),
+                          np.concatenate([self.track_uris.astype(object),
+                                          df_new["track_uri"].to_numpy(dtype=object)]))
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Returns the arrays and attributes of the index, e.g. to be written with save_bundle()
+
+        Returns:
+            name -> array, with text as fixed-width strings
+            the attributes of the index
+        """
+        return ({"keys": np.array(self.keys, dtype=str), "rows": self.rows,
+                 "values": self.values, "track_uris": self.track_uris.astype(str)},
+                {"features": self.features})
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], attrs: dict) -> "TitleIndex":
+        """Builds the index from the arrays returned by to_arrays(), without copying them
+
+        Arguments:
+            arrays -- name -> array, e.g. memory-mapped by load_bundle()
+            attrs -- the attributes returned by to_arrays()
+
+        Returns:
+            a TitleIndex
+        """
+        return cls(arrays["keys"], arrays["rows"], attrs["features"], arrays["values"],
+                   arrays["track_uris"])
+
+    def resolve(self, song_name: str, min_prefix: int = 4,
+                exact: bool = False) -> typing.Optional[dict]:
+        """Finds a catalog song by its title. An exact match (after normalization) wins,
+        otherwise the shortest title starting with the given name is used.
+
+        Arguments:
+            song_name -- the song name typed by the user
+
+        Keyword Arguments:
+            min_prefix -- minimum length of a name to be matched as a prefix (default: {4})
+            exact -- only match the whole title, e.g. when the user also named an artist,
+                which a prefix match would ignore (default: {False})
+
+        Returns:
+            a dictionary with the track_uri and the stored features of the song,
+            None if no title matches
+        """
+        if not song_name:
+            return None
+        query = normalize_title(song_name)
+        pos = bisect.bisect_left(self.keys, query)
+
+        match = None
+        if pos < len(self.keys) and self.keys[pos] == query:
+            match = pos
+        elif not exact and len(query) >= min_prefix:
+            candidates = [cand for cand in range(pos, min(pos + MAX_PREFIX_CANDIDATES, len(self.keys)))
+                          if self.keys[cand].startswith(query)]
+            if candidates:
+                match = min(candidates, key=lambda cand: len(self.keys[cand]))
+        if match is None:
+            return None
+
+        row = self.rows[match]
+        res = dict(zip(self.features, self.values[row].tolist()))
+        res["track_uri"] = str(self.track_uris[row])
+        logger.debug("%s resolved to %s in the catalog", song_name, res["track_uri"])
+        return res
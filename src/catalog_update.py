@@ -0,0 +1,243 @@
+"""
+Add new songs to the catalog without retraining: the songs are scaled with the saved
+scaler, assigned to the closest cluster, appended to the songs table, and the centroids
+are updated as running means. Drift metrics tell when the updates add up to a catalog
+the model no longer fits, and a full retrain is due.
+"""
+import copy
+import json
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.evaluate_model import assign_new_labels
+from src.model_artifact import ModelArtifact
+from src.preprocessing import clean
+from src.song_manager import SongManager
+
+if typing.TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
+    from sklearn.preprocessing import StandardScaler
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterState:
+    """Centroids of the model updated with the songs added since training, in the scaled
+    feature space of the model, with what is needed to measure drift.
+
+    Args:
+        features (list[str]): the features of the model, in centroid column order
+        initial_centroids (np.ndarray): (k, n_features) centroids of the trained model
+        centroids (np.ndarray): (k, n_features) centroids updated with the added songs
+        counts (np.ndarray): number of songs of each cluster
+        n_initial (int): number of songs in the catalog when the model was trained
+        n_added (int): number of songs added since
+        baseline_rms (float): root mean squared distance of the training songs to their centroid
+        added_squared_distance (float): sum of squared distances of the added songs
+            to the centroid they were assigned to
+    """
+
+    def __init__(self, features: list[str], initial_centroids: np.ndarray,
+                 centroids: np.ndarray, counts: np.ndarray, n_initial: int,
+                 n_added: int = 0, baseline_rms: float = 1.0,
+                 added_squared_distance: float = 0.0):
+        self.features = list(features)
+        self.initial_centroids = np.array(initial_centroids, dtype=np.float64)
+        self.centroids = np.array(centroids, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.n_initial = int(n_initial)
+        self.n_added = int(n_added)
+        self.baseline_rms = float(baseline_rms)
+        self.added_squared_distance = float(added_squared_distance)
+
+    @classmethod
+    def from_model(cls, model: "BaseEstimator", cluster_sizes: pd.Series) -> "ClusterState":
+        """Starts the state of a trained model
+
+        Arguments:
+            model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
+            cluster_sizes -- number of songs of each cluster in the catalog, indexed by clusterId
+
+        Returns:
+            a ClusterState without added songs
+        """
+        n_clusters = model.cluster_centers_.shape[0]
+        counts = cluster_sizes.reindex(range(n_clusters), fill_value=0).to_numpy()
+        if isinstance(model, ModelArtifact):
+            baseline_rms = float(model.attrs["baseline_rms"])
+        else:
+            # inertia_ covers the songs of labels_ (the last batch of a MiniBatchKMeans)
+            baseline_rms = float(np.sqrt(model.inertia_ / max(len(model.labels_), 1)))
+        return cls(model.feature_names_in_.tolist(), model.cluster_centers_,
+                   model.cluster_centers_, counts, counts.sum(), baseline_rms=baseline_rms)
+
+    def to_dict(self) -> dict:
+        """Returns the state as a JSON serializable dictionary"""
+        return {"features": self.features,
+                "initial_centroids": self.initial_centroids.tolist(),
+                "centroids": self.centroids.tolist(), "counts": self.counts.tolist(),
+                "n_initial": self.n_initial, "n_added": self.n_added,
+                "baseline_rms": self.baseline_rms,
+                "added_squared_distance": self.added_squared_distance}
+
+    def update(self, values: np.ndarray, labels: np.ndarray) -> None:
+        """Moves the centroids to the running mean of their songs, including the new ones
+
+        Arguments:
+            values -- (n_songs, n_features) scaled features of the new songs
+            labels -- the cluster assigned to each new song
+        """
+        assigned = self.centroids[labels]
+        self.added_squared_distance += float(((values - assigned) ** 2).sum())
+        n_clusters = len(self.centroids)
+        new_counts = np.bincount(labels, minlength=n_clusters)
+        sums = np.zeros_like(self.centroids)
+        np.add.at(sums, labels, values)
+        updated = new_counts > 0
+        totals = self.counts + new_counts
+        self.centroids[updated] = ((self.centroids[updated] * self.counts[updated][:, None]
+                                    + sums[updated]) / totals[updated][:, None])
+        self.counts = totals
+        self.n_added += len(labels)
+
+    def drift(self, max_centroid_shift: float, max_fit_ratio: float,
+              max_added_share: float) -> dict:
+        """Measures how far the catalog moved from the one the model was trained on
+
+        Arguments:
+            max_centroid_shift -- largest allowed centroid move, in baseline rms distances
+            max_fit_ratio -- largest allowed rms distance of the added songs to their
+                centroid, relative to that of the training songs
+            max_added_share -- largest allowed number of added songs, relative to the
+                number of songs the model was trained on
+
+        Returns:
+            the metrics, and whether one of them is over its threshold
+        """
+        shift = float(np.linalg.norm(self.centroids - self.initial_centroids, axis=1).max()
+                      / self.baseline_rms)
+        fit_ratio = (float(np.sqrt(self.added_squared_distance / self.n_added)
+                           / self.baseline_rms) if self.n_added else 0.0)
+        added_share = self.n_added / max(self.n_initial, 1)
+        return {"centroid_shift": shift, "fit_ratio": fit_ratio, "added_share": added_share,
+                "n_added": self.n_added,
+                "needs_retrain": bool(shift > max_centroid_shift or fit_ratio > max_fit_ratio
+                                      or added_share > max_added_share)}
+
+
+def save_state(state: ClusterState, output_path: str) -> None:
+    """Writes the cluster state to a JSON file
+
+    Arguments:
+        state -- the state to save
+        output_path -- the path of the file
+    """
+    try:
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(state.to_dict(), file, indent=2)
+        logger.info("Cluster state saved to %s", output_path)
+    except FileNotFoundError as err:
+        logger.error("Path does not exist at %s", output_path)
+        raise err
+
+
+def load_state(path: str) -> ClusterState:
+    """Reads a cluster state written by save_state()
+
+    Arguments:
+        path -- the path of the file
+
+    Returns:
+        the ClusterState
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return ClusterState(**json.load(file))
+
+
+def update_catalog(df_new: pd.DataFrame, scaler: "StandardScaler", model: "BaseEstimator",
+                   state: ClusterState, song_manager: SongManager,
+                   clean_features: list[str], col_mapper: dict,
+                   features: list[str]) -> tuple[pd.DataFrame, ClusterState]:
+    """Adds new songs to the catalog, in time proportional to the number of new songs
+
+    Arguments:
+        df_new -- the new songs, with the audio features returned by Spotify
+        scaler -- the scaler used during the featurizing step, or the scaler of a ModelArtifact
+        model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
+        state -- the centroids updated by the previous updates, changed in place once
+            the songs are added
+        song_manager -- connection to the songs table
+        clean_features -- the features needed for data cleaning
+        col_mapper -- the column mapper needed for data cleaning
+        features -- a list of features to calculate cluster on
+
+    Raises:
+        ValueError -- the features of the state and the model differ
+
+    Returns:
+        the songs added to the songs table, with their clusterId
+        the updated state
+    """
+    if state.features != model.feature_names_in_.tolist():
+        logger.error("The cluster state does not belong to the model")
+        raise ValueError("Cluster state and model features differ")
+    df_clean = clean(df_new, col_mapper, clean_features).reset_index(drop=True)
+    existing = song_manager.get_existing_track_uris(df_clean["track_uri"].tolist())
+    keep = ~df_clean["track_uri"].isin(existing) & ~df_clean["track_uri"].duplicated()
+    if not keep.all():
+        logger.warning("%d songs are already in the catalog and are skipped",
+                       int((~keep).sum()))
+    df_new = df_new.reset_index(drop=True)[keep.to_numpy()].reset_index(drop=True)
+    df_clean = df_clean[keep].reset_index(drop=True)
+    if len(df_clean) == 0:
+        logger.info("No new songs to add")
+        return df_clean.assign(clusterId=pd.Series(dtype=np.int64)), state
+
+    # label with the running centroids instead of those of the trained model
+    current_model = copy.copy(model)
+    current_model.cluster_centers_ = state.centroids.copy()
+    df_scaled = assign_new_labels(df_new, scaler, current_model, clean_features,
+                                  col_mapper, features)
+    labels = df_scaled["clusterId"].to_numpy(dtype=np.int64)
+
+    df_added = df_clean.assign(clusterId=labels)
+    if song_manager.add_songs(df_added) != len(df_added):
+        logger.error("The new songs could not be added to the songs table")
+        raise ValueError("Songs not added")
+    # the state only moves once the songs are stored
+    state.update(df_scaled[state.features].to_numpy(dtype=np.float64), labels)
+    logger.info("%d songs added to the catalog", len(df_added))
+    return df_added, state
+
+
+def update_from_config(df_new: pd.DataFrame, scaler: "StandardScaler", model: "BaseEstimator",
+                       song_manager: SongManager, state_path: str, config: dict) -> dict:
+    """Runs update_catalog() with the state kept in a file, starting it from the model
+    and the songs table on the first update
+
+    Arguments:
+        df_new -- the new songs, with the audio features returned by Spotify
+        scaler -- the scaler used during the featurizing step, or the scaler of a ModelArtifact
+        model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
+        song_manager -- connection to the songs table
+        state_path -- the path of the cluster state file
+        config -- the configuration of config/model.yaml
+
+    Returns:
+        the drift metrics after the update
+    """
+    try:
+        state = load_state(state_path)
+    except FileNotFoundError:
+        logger.info("No cluster state at %s, starting one from the model", state_path)
+        state = ClusterState.from_model(model, song_manager.get_cluster_sizes())
+    update_catalog(df_new, scaler, model, state, song_manager,
+                   **config["evaluate_model"]["assign_new_labels"])
+    save_state(state, state_path)
+    drift = state.drift(**config["catalog_update"]["drift"])
+    if drift["needs_retrain"]:
+        logger.warning("The catalog drifted from the trained model (%s), retrain it", drift)
+    return drift
@@ -2,21 +2,31 @@
 Assign each song a clusterId based on the optimal KMeans model
 Evaluate the KMeans model results
 """
+import collections
+import itertools
+import json
 import logging
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-from sklearn.preprocessing import StandardScaler
 
-from src.preprocessing import clean
+from src.model_artifact import ModelArtifact
+from src.preprocessing import clean, read_chunks
+from src.tables import TableWriter, is_parquet, read_table_part, split_table
 from src.search_songs import get_closest_cluster
 
+# sklearn and scipy are only imported to evaluate, or to score with sklearn estimators:
+# scoring with a ModelArtifact needs numpy and pandas only
+if typing.TYPE_CHECKING:
+    from sklearn.base import BaseEstimator
+    from sklearn.preprocessing import StandardScaler
+
 logger = logging.getLogger(__name__)
 
-def assign_labels(df_features: pd.DataFrame, model: BaseEstimator) -> pd.DataFrame:
+def assign_labels(df_features: pd.DataFrame, model: "BaseEstimator") -> pd.DataFrame:
     """assigns labels to songs in the dataset based on optimal model result
 
     Arguments:
@@ -40,9 +50,58 @@ def assign_labels(df_features: pd.DataFrame, model: BaseEstimator) -> pd.DataFra
     return df_new
 
 
+def assign_labels_streaming(features_path: str, origin_path: str, model: "BaseEstimator",
+                            output_path: str, chunk_size: int = 10_000) -> int:
+    """assigns labels to songs of a featurized csv file, reading it and the matching
+    cleaned file in chunks and appending each labelled chunk to the output file
+
+    Arguments:
+        features_path -- the path of the featurized dataset the model was trained on
+        origin_path -- the path of the cleaned dataset, with the same rows in the same order
+        model -- trained KMeans or MiniBatchKMeans model or a ModelArtifact
+        output_path -- the path of the csv or parquet file to write
+
+    Keyword Arguments:
+        chunk_size -- number of rows held in memory at a time (default: {10_000})
+
+    Raises:
+        KeyError -- "Unmatched columns between the model and df_features"
+        ValueError -- the two files do not have the same number of rows
+
+    Returns:
+        the number of songs labelled
+    """
+    features = model.feature_names_in_.tolist()
+    with TableWriter(output_path) as output:
+        # zip() would stop silently at the end of the shorter file when it ends on a
+        # chunk boundary, dropping the remaining rows of the other one
+        for df_features, df_origin in itertools.zip_longest(
+                read_chunks(features_path, chunk_size), read_chunks(origin_path, chunk_size)):
+            if df_features is None or df_origin is None or len(df_features) != len(df_origin):
+                logger.error("The featurized and cleaned files do not have the same rows")
+                raise ValueError("Featurized and cleaned files have different lengths")
+            if not set(features).issubset(df_features.columns):
+                logger.error("Unmatched columns between the model and df_features")
+                raise KeyError("Unmatched columns between the model and df_features")
+            # sklearn only predicts with data of the type the model was fitted in
+            labels = model.predict(df_features[features].astype(
+                model.cluster_centers_.dtype)).astype(np.int64)
+            output.write(df_origin.assign(clusterId=labels))
+    logger.info("%d songs labelled in chunks of %d", output.n_rows, chunk_size)
+    return output.n_rows
+
+
+def _is_kmeans(model: typing.Any) -> bool:
+    # an artifact is checked first, so that scoring with one does not import sklearn
+    if isinstance(model, ModelArtifact):
+        return True
+    from sklearn.cluster import KMeans, MiniBatchKMeans  # pylint: disable=import-outside-toplevel
+    return isinstance(model, (KMeans, MiniBatchKMeans))
+
+
 def assign_new_labels(df_song: pd.DataFrame,
-                      scalar: StandardScaler,
-                      model: BaseEstimator,
+                      scalar: "StandardScaler",
+                      model: "BaseEstimator",
                       clean_features: list[str],
                       col_mapper: dict,
                       features: list[str]) -> pd.DataFrame:
@@ -50,32 +109,66 @@ def assign_new_labels(df_song: pd.DataFrame,
 
     Arguments:
         df_song -- a dataframe of given songs with features
-        scalar -- the scalar used during the featurizing step
-        model -- the KMeans model
+        scalar -- the scalar used during the featurizing step, or the scaler of a ModelArtifact
+        model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
         clean_features -- the features needed for data cleaning
         col-mapper -- the column mapper needed for data cleaning
         features -- a list of features to calculate cluster on
 
     Raises:
-        TypeError -- the given model is not a KMeans model
+        TypeError -- the given model is not a KMeans or MiniBatchKMeans model or an artifact
         ValueError -- the given dataframe of songs is empty
 
     Returns:
         a dataframe of songs with both features and labels
     """
     # check if the model is a KMeans model
-    if not isinstance(model, KMeans):
+    if not _is_kmeans(model):
         logger.error("Invalid model! Needs to be a Kmeans model")
         raise TypeError("Invalid model")
     # check if df_song is empty:
     if len(df_song) == 0:
         logger.error("No song provided!")
         raise ValueError("No song provided.")
+    return label_songs(df_song, scalar, model_centroids(model), clean_features,
+                       col_mapper, features)
+
+
+def model_centroids(model: "BaseEstimator") -> pd.DataFrame:
+    """Returns the centroids of a KMeans model as a dataframe
+
+    Arguments:
+        model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
+
+    Returns:
+        a dataframe with a clusterId column and one column per feature of the model
+    """
     # find centroids from the model, make it into a dataframe
     centroids = pd.DataFrame(model.cluster_centers_,
                              columns=model.feature_names_in_.tolist())
     # give cluster_ids
-    centroids = centroids.reset_index().rename(columns={"index": "clusterId"})
+    return centroids.reset_index().rename(columns={"index": "clusterId"})
+
+
+def label_songs(df_song: pd.DataFrame,
+                scalar: "StandardScaler",
+                centroids: pd.DataFrame,
+                clean_features: list[str],
+                col_mapper: dict,
+                features: list[str]) -> pd.DataFrame:
+    """Cleans and scales songs and assigns each to the closest centroid
+
+    Arguments:
+        df_song -- a dataframe of given songs with features
+        scalar -- the scalar used during the featurizing step
+        centroids -- the centroids returned by model_centroids()
+        clean_features -- the features needed for data cleaning
+        col-mapper -- the column mapper needed for data cleaning
+        features -- a list of features to calculate cluster on
+
+    Returns:
+        a dataframe of songs with both scaled features and labels
+    """
     # first transform the df_song to scaled version
     df_song = clean(df_song, col_mapper, clean_features)
     df_song_scale = pd.DataFrame(scalar.transform(df_song[scalar.feature_names_in_.tolist()]),
@@ -85,18 +178,227 @@ def assign_new_labels(df_song: pd.DataFrame,
                      axis=1)
 
 
-def evaluate(df_sample: pd.DataFrame) -> str:
-    """Returns the silhouette score of a clustering results
+# what each scoring worker holds, set once by _init_scorer()
+_scorer: dict = {}
+
+
+def _init_scorer(scalar: "StandardScaler", centroids: pd.DataFrame, clean_features: list[str],
+                 col_mapper: dict, features: list[str]) -> None:
+    _scorer.update(scalar=scalar, centroids=centroids, clean_features=clean_features,
+                   col_mapper=col_mapper, features=features)
+
+
+def _score_part(input_path: str, part: tuple[int, int],
+                csv_header: typing.Optional[bool]) -> typing.Any:
+    df_labelled = label_songs(read_table_part(input_path, part), **_scorer)
+    if csv_header is None:
+        return df_labelled
+    # formatting csv takes longer than scoring, so the worker does it too
+    return df_labelled.to_csv(index=False, header=csv_header), len(df_labelled)
+
+
+def assign_new_labels_parallel(input_path: str,
+                               output_path: str,
+                               scalar: "StandardScaler",
+                               model: "BaseEstimator",
+                               clean_features: list[str],
+                               col_mapper: dict,
+                               features: list[str],
+                               chunk_size: int = 10_000,
+                               n_jobs: typing.Optional[int] = None) -> int:
+    """Assigns labels to the songs of a large file: parts of the file are read, scored
+    and formatted by a pool of worker processes, each holding the scaler and the
+    centroids, and written to the output in the order of the input as they complete
+
+    Arguments:
+        input_path -- the path of the csv or parquet file of songs with features
+        output_path -- the path of the csv or parquet file to write
+        scalar -- the scalar used during the featurizing step, or the scaler of a ModelArtifact
+        model -- the KMeans or MiniBatchKMeans model or a ModelArtifact
+        clean_features -- the features needed for data cleaning
+        col-mapper -- the column mapper needed for data cleaning
+        features -- a list of features to calculate cluster on
+
+    Keyword Arguments:
+        chunk_size -- number of songs scored at a time by a worker, approximately
+            (a parquet file is split at row groups) (default: {10_000})
+        n_jobs -- number of worker processes, all the cores if None (default: {None})
+
+    Raises:
+        TypeError -- the given model is not a KMeans or MiniBatchKMeans model or an artifact
+
+    Returns:
+        the number of songs labelled
+    """
+    if not _is_kmeans(model):
+        logger.error("Invalid model! Needs to be a Kmeans model")
+        raise TypeError("Invalid model")
+    n_jobs = n_jobs or os.cpu_count() or 1
+    scorer = (scalar, model_centroids(model), clean_features, col_mapper, features)
+
+    with TableWriter(output_path) as output:
+        if n_jobs == 1:
+            for chunk in read_chunks(input_path, chunk_size):
+                output.write(label_songs(chunk, *scorer))
+        else:
+            parts = split_table(input_path, chunk_size)
+            as_csv = not is_parquet(output_path)
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_scorer,
+                                     initargs=scorer) as pool:
+                # the workers read their own parts, and a bounded number of parts in
+                # flight keeps memory independent of the file
+                pending: collections.deque = collections.deque()
+
+                def write_next():
+                    result = pending.popleft().result()
+                    if as_csv:
+                        output.write_csv(*result)
+                    else:
+                        output.write(result)
+
+                for pos, part in enumerate(parts):
+                    pending.append(pool.submit(_score_part, input_path, part,
+                                               pos == 0 if as_csv else None))
+                    if len(pending) >= 2 * n_jobs:
+                        write_next()
+                while pending:
+                    write_next()
+    logger.info("%d songs labelled in chunks of %d on %d processes",
+                output.n_rows, chunk_size, n_jobs)
+    return output.n_rows
+
+
+def silhouette_samples_chunked(values: np.ndarray, labels: np.ndarray,
+                               rows: typing.Optional[np.ndarray] = None,
+                               max_block_mb: float = 80) -> np.ndarray:
+    """Computes the exact silhouette of songs against all the songs, as many rows at a
+    time as the distances of max_block_mb hold, so that memory does not grow with the
+    number of rows
+
+    Arguments:
+        values -- the features of all the songs
+        labels -- the cluster of each song, as integers from 0 to the number of clusters - 1
+        rows -- the songs to compute the silhouette of, all of them if None (default: {None})
+
+    Keyword Arguments:
+        max_block_mb -- memory of the distances held at a time, in MB, of at least one row
+            of distances to all the songs (default: {80})
+
+    Returns:
+        the silhouette of each song of rows
+    """
+    rows = np.arange(len(values)) if rows is None else np.asarray(rows)
+    # float64 distances of a chunk of rows to every song
+    chunk_size = max(1, int(max_block_mb * 1e6) // (8 * len(values)))
+    n_clusters = int(labels.max()) + 1
+    cluster_sizes = np.bincount(labels, minlength=n_clusters)
+    # summing the distances per cluster is a product with the one-hot labels
+    one_hot = np.zeros((len(values), n_clusters))
+    one_hot[np.arange(len(values)), labels] = 1.0
+    squared_norms = np.einsum("ij,ij->i", values, values)
+
+    res = np.empty(len(rows))
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        # computed in place, so the block is the only array of chunk_size * n songs
+        distances = values[chunk] @ values.T
+        distances *= -2
+        distances += squared_norms[chunk, None]
+        distances += squared_norms[None, :]
+        np.maximum(distances, 0.0, out=distances)
+        np.sqrt(distances, out=distances)
+        distances[np.arange(len(chunk)), chunk] = 0.0
+        sums = distances @ one_hot
+
+        own = labels[chunk]
+        own_sizes = cluster_sizes[own]
+        intra = sums[np.arange(len(chunk)), own] / np.maximum(own_sizes - 1, 1)
+        means = sums / np.maximum(cluster_sizes, 1)
+        means[np.arange(len(chunk)), own] = np.inf
+        means[:, cluster_sizes == 0] = np.inf
+        nearest = means.min(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scores = (nearest - intra) / np.maximum(intra, nearest)
+        # songs alone in their cluster have a silhouette of 0 by convention
+        res[start:start + len(chunk)] = np.where(own_sizes > 1, np.nan_to_num(scores), 0.0)
+    return res
+
+
+def sampled_silhouette(values: np.ndarray, labels: np.ndarray, sample_size: int,
+                       confidence: float = 0.95, seed: int = 42,
+                       max_block_mb: float = 80) -> dict:
+    """Estimates the silhouette score from a sample stratified by cluster. The exact
+    silhouette of each sampled song is computed against all the songs, so the cost is
+    linear in the number of songs.
+
+    Arguments:
+        values -- the features of all the songs
+        labels -- the cluster of each song, as integers from 0 to the number of clusters - 1
+        sample_size -- number of songs to sample, split between clusters by their size
+
+    Keyword Arguments:
+        confidence -- level of the confidence interval (default: {0.95})
+        seed -- random state seed (default: {42})
+        max_block_mb -- memory of the distances held at a time, in MB (default: {80})
+
+    Returns:
+        the estimate, the bounds of its confidence interval and the sample size
+    """
+    rng = np.random.default_rng(seed)
+    n_songs = len(values)
+    sizes = np.bincount(labels)
+    clusters = np.flatnonzero(sizes)
+    # proportional allocation, with at least two songs of each cluster to estimate its variance
+    allocation = {cluster: int(min(sizes[cluster],
+                                   max(2, round(sample_size * sizes[cluster] / n_songs))))
+                  for cluster in clusters}
+    samples = {cluster: rng.choice(np.flatnonzero(labels == cluster), size, replace=False)
+               for cluster, size in allocation.items()}
+    scores = silhouette_samples_chunked(values, labels, np.concatenate(list(samples.values())),
+                                        max_block_mb)
+
+    estimate = 0.0
+    variance = 0.0
+    offset = 0
+    for cluster, sample in samples.items():
+        stratum = scores[offset:offset + len(sample)]
+        offset += len(sample)
+        weight = sizes[cluster] / n_songs
+        estimate += weight * stratum.mean()
+        if len(sample) > 1:
+            # with the finite population correction, strata sampled entirely add no variance
+            variance += (weight ** 2 * stratum.var(ddof=1) / len(sample)
+                         * (1 - len(sample) / sizes[cluster]))
+    from scipy.stats import norm  # pylint: disable=import-outside-toplevel
+    margin = norm.ppf(0.5 + confidence / 2) * np.sqrt(variance)
+    return {"method": "sampled", "score": float(estimate),
+            "ci_low": float(estimate - margin), "ci_high": float(estimate + margin),
+            "confidence": confidence, "sample_size": int(offset)}
+
+
+def evaluate(df_sample: pd.DataFrame, method: str = "exact", max_block_mb: float = 80,
+             sample_size: int = 10_000, confidence: float = 0.95, seed: int = 42) -> str:
+    """Returns quality metrics of a clustering result: the silhouette score, the
+    Calinski-Harabasz and Davies-Bouldin indexes and the inertia
 
     Arguments:
         df_sample -- the sample dataframe that has been assigned labels
 
+    Keyword Arguments:
+        method -- `exact` for the silhouette of all the songs, computed in chunks,
+            or `sampled` for an estimate from a stratified sample (default: {"exact"})
+        max_block_mb -- memory of the song-to-song distances held at a time, in MB (default: {80})
+        sample_size -- number of songs sampled by the sampled method (default: {10_000})
+        confidence -- level of the confidence interval of the sampled method (default: {0.95})
+        seed -- random state seed of the sampled method (default: {42})
+
     Raises:
         TypeError -- input not a dataframe
         KeyError -- input does not have a label column called "clusterId"
+        ValueError -- unknown method, or fewer than 2 or as many clusters as songs
 
     Returns:
-        the silhouette score of the clustered results
+        the metrics as a JSON document
     """
     if not isinstance(df_sample, pd.DataFrame):
         logger.error("The argument needs to be a dataframe"
@@ -106,6 +408,33 @@ def evaluate(df_sample: pd.DataFrame) -> str:
         logger.error(
             "Needs to have a clusterId label column in your dataframe")
         raise KeyError("No clusterId column")
-    score = silhouette_score(df_sample.drop(
-        "clusterId", axis=1), df_sample["clusterId"])
-    return f"Silhoutee score: {score}"
+    if method not in ["exact", "sampled"]:
+        logger.error("The silhouette method needs to be exact or sampled but is %s", method)
+        raise ValueError(f"Unknown method {method}")
+
+    values = df_sample.drop("clusterId", axis=1).to_numpy(dtype=np.float64)
+    # clusters renumbered from 0 to the number of clusters - 1
+    cluster_ids, labels = np.unique(df_sample["clusterId"].to_numpy(), return_inverse=True)
+    if not 2 <= len(cluster_ids) < len(values):
+        logger.error("The songs need to be in between 2 and %d clusters", len(values) - 1)
+        raise ValueError("Invalid number of clusters")
+
+    if method == "exact":
+        silhouette = {"method": "exact",
+                      "score": float(silhouette_samples_chunked(values, labels,
+                                                                max_block_mb=max_block_mb).mean())}
+    else:
+        silhouette = sampled_silhouette(values, labels, sample_size, confidence, seed,
+                                        max_block_mb)
+    # pylint: disable=import-outside-toplevel
+    from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score
+    centroids = np.stack([values[labels == label].mean(axis=0)
+                          for label in range(len(cluster_ids))])
+    metrics = {"n_songs": len(values), "n_clusters": len(cluster_ids),
+               "silhouette": silhouette,
+               "calinski_harabasz": float(calinski_harabasz_score(values, labels)),
+               "davies_bouldin": float(davies_bouldin_score(values, labels)),
+               "inertia": float(((values - centroids[labels]) ** 2).sum())}
+    logger.info("Silhouette score (%s) of %d songs: %.4f", method, len(values),
+                silhouette["score"])
+    return json.dumps(metrics, indent=2)
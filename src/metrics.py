@@ -0,0 +1,303 @@
+"""
+Time the stages of a request and count its SQL statements, aggregate them into
+latency histograms and format them in the Prometheus text exposition format
+"""
+import bisect
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+import typing
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the latency buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds of the buckets of SQL statements per request
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# the trace of the request being handled, None outside of a traced request
+_CURRENT_TRACE: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative histogram of observed values, one series per combination of labels.
+
+    Args:
+        name (str): name of the metric
+        documentation (str): help text of the metric
+        label_names (tuple[str]): names of the labels of the series
+        buckets (tuple[float]): upper bounds of the buckets, in increasing order
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        """Adds an observation
+
+        Arguments:
+            value -- the observed value
+            label_values -- the values of the labels, in the order of label_names
+        """
+        pos = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # counts of each bucket (+Inf last), sum and count of the observations
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][pos] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values) -> int:
+        """Returns the number of observations of a series"""
+        series = self._series.get(label_values)
+        return 0 if series is None else series[2]
+
+    def render(self, constant_labels: typing.Optional[dict] = None) -> list[str]:
+        """Formats the histogram in the Prometheus text format
+
+        Keyword Arguments:
+            constant_labels -- labels added to every series, e.g. the process id
+                (default: {None})
+
+        Returns:
+            the lines of the metric
+        """
+        constant_labels = constant_labels or {}
+        names = tuple(constant_labels) + self.label_names
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(val[0]), val[1], val[2]) for key, val in self._series.items()}
+        for label_values, (counts, total, count) in sorted(series.items()):
+            label_values = tuple(constant_labels.values()) + label_values
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(names + ("le",),
+                                        label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render_gauges(name: str, documentation: str, label_names: tuple,
+                  samples: dict[tuple, float],
+                  constant_labels: typing.Optional[dict] = None) -> list[str]:
+    """Formats current values (e.g. cache sizes) as a Prometheus gauge
+
+    Arguments:
+        name -- name of the metric
+        documentation -- help text of the metric
+        label_names -- names of the labels of the samples
+        samples -- values of the labels -> value of the sample
+
+    Keyword Arguments:
+        constant_labels -- labels added to every sample, e.g. the process id
+            (default: {None})
+
+    Returns:
+        the lines of the metric
+    """
+    return _render_samples(name, "gauge", documentation, label_names, samples, constant_labels)
+
+
+def render_counters(name: str, documentation: str, label_names: tuple,
+                    samples: dict[tuple, float],
+                    constant_labels: typing.Optional[dict] = None) -> list[str]:
+    """Formats cumulative totals (e.g. cache hits) as a Prometheus counter, which
+    rate() reads as resetting when the process restarts
+
+    Arguments:
+        name -- name of the metric, ending with `_total`
+        documentation -- help text of the metric
+        label_names -- names of the labels of the samples
+        samples -- values of the labels -> value of the sample
+
+    Keyword Arguments:
+        constant_labels -- labels added to every sample, e.g. the process id
+            (default: {None})
+
+    Returns:
+        the lines of the metric
+    """
+    return _render_samples(name, "counter", documentation, label_names, samples,
+                           constant_labels)
+
+
+def _render_samples(name: str, metric_type: str, documentation: str, label_names: tuple,
+                    samples: dict[tuple, float],
+                    constant_labels: typing.Optional[dict]) -> list[str]:
+    constant_labels = constant_labels or {}
+    names = tuple(constant_labels) + tuple(label_names)
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for label_values, value in sorted(samples.items()):
+        labels = _format_labels(names, tuple(constant_labels.values()) + tuple(label_values))
+        lines.append(f"{name}{labels} {_format_value(value)}")
+    return lines
+
+
+class Trace:
+    """Time spent in each stage of one request and number of SQL statements it ran.
+
+    Args:
+        name (str): name of the traced request, e.g. its endpoint
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.sql_statements = 0
+
+    def elapsed(self) -> float:
+        """Seconds since the trace started"""
+        return time.perf_counter() - self.start
+
+    def add(self, stage: str, seconds: float) -> None:
+        """Adds time to a stage, a stage entered several times is summed"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def breakdown(self) -> str:
+        """Returns the time of each stage in milliseconds, for logging"""
+        return ", ".join(f"{stage}={seconds * 1000:.1f}ms"
+                         for stage, seconds in self.stages.items())
+
+
+def start_trace(name: str) -> Trace:
+    """Starts tracing the current request
+
+    Arguments:
+        name -- name of the request
+
+    Returns:
+        the trace that spans record to
+    """
+    trace = Trace(name)
+    _CURRENT_TRACE.set(trace)
+    return trace
+
+
+def current_trace() -> typing.Optional[Trace]:
+    """Returns the trace of the current request, None outside of a traced request"""
+    return _CURRENT_TRACE.get()
+
+
+def end_trace() -> None:
+    """Stops tracing the current request"""
+    _CURRENT_TRACE.set(None)
+
+
+@contextlib.contextmanager
+def span(stage: str):
+    """Context manager that adds the time spent in its block to a stage of the current
+    trace. It does nothing outside of a traced request.
+
+    Arguments:
+        stage -- the name of the stage
+    """
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - start)
+
+
+def _count_statement(*_args, **_kwargs) -> None:
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.sql_statements += 1
+
+
+def count_sql_statements(engine) -> None:
+    """Counts the SQL statements run by an engine in the trace of the current request
+
+    Arguments:
+        engine -- the sqlalchemy engine
+    """
+    if not event.contains(engine, "before_cursor_execute", _count_statement):
+        event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+class RequestMetrics:
+    """Aggregates the traces of the requests into histograms.
+
+    Args:
+        slow_request_seconds (float): requests slower than this are logged with the
+            time of each stage. None never logs.
+    """
+
+    def __init__(self, slow_request_seconds: typing.Optional[float] = None):
+        self.slow_request_seconds = slow_request_seconds
+        self.request_latency = Histogram(
+            "request_latency_seconds", "Latency of the requests",
+            ("endpoint", "status"))
+        self.stage_latency = Histogram(
+            "request_stage_latency_seconds", "Latency of the stages of the requests",
+            ("endpoint", "stage"))
+        self.sql_statements = Histogram(
+            "request_sql_statements", "Number of SQL statements run per request",
+            ("endpoint",), buckets=STATEMENT_BUCKETS)
+
+    def record(self, trace: Trace, status: int) -> None:
+        """Adds a finished request to the histograms
+
+        Arguments:
+            trace -- the trace of the request
+            status -- the HTTP status code of the response
+        """
+        elapsed = trace.elapsed()
+        self.request_latency.observe(elapsed, trace.name, str(status))
+        for stage, seconds in trace.stages.items():
+            self.stage_latency.observe(seconds, trace.name, stage)
+        self.sql_statements.observe(trace.sql_statements, trace.name)
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+            logger.warning("Slow request %s took %.1fms with %d SQL statements: %s",
+                           trace.name, elapsed * 1000, trace.sql_statements,
+                           trace.breakdown())
+
+    def render(self, constant_labels: typing.Optional[dict] = None) -> list[str]:
+        """Formats the histograms in the Prometheus text format
+
+        Keyword Arguments:
+            constant_labels -- labels added to every series, e.g. the process id
+                (default: {None})
+
+        Returns:
+            the lines of the metrics
+        """
+        return (self.request_latency.render(constant_labels)
+                + self.stage_latency.render(constant_labels)
+                + self.sql_statements.render(constant_labels))
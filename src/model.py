@@ -2,17 +2,24 @@
 Use a clusering model to cluster the anime songs
 """
 import logging
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor
 
 import joblib
 import numpy as np
 import pandas as pd
-from sklearn.base import BaseEstimator
-from sklearn.cluster import KMeans
 
-from src.preprocessing import validate_features
+from src.model_artifact import ModelArtifact, is_artifact, load_artifact
+from src.preprocessing import numeric_type, read_chunks, validate_features
+
+if typing.TYPE_CHECKING:  # sklearn is only imported by the training steps
+    from sklearn.base import BaseEstimator
 
 logger = logging.getLogger(__name__)
 WRONG_INDICATOR = -10
+# how sweep_k() picks the best candidate
+SWEEP_CRITERIA = ["silhouette", "elbow"]
 
 
 def get_train_data(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
@@ -47,7 +54,8 @@ def get_train_data(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
 
 def get_model(df: pd.DataFrame, cols: list[str],
               k: int,
-              seed=42) -> BaseEstimator:
+              seed=42,
+              precision: str = "float64") -> "BaseEstimator":
     """run a K-means model on a dataframe
 
     Arguments:
@@ -57,16 +65,187 @@ def get_model(df: pd.DataFrame, cols: list[str],
 
     Keyword Arguments:
         seed -- random state seed (default: {42})
+        precision -- numeric type the model is fitted in, and of its centroids,
+            `float64` or `float32` (default: {"float64"})
 
     Returns:
         a KMeans models
     """
-    df_in = get_train_data(df, cols)
+    df_in = get_train_data(df, cols).astype(numeric_type(precision))
+    from sklearn.cluster import KMeans  # pylint: disable=import-outside-toplevel
     # create a KMeans models
     mod = KMeans(n_clusters=k, random_state=seed).fit(df_in)
     return mod
 
-def save_model(model: BaseEstimator, output_path: str) -> None:
+
+def get_minibatch_model(input_path: str, cols: list[str],
+                        k: int,
+                        seed=42,
+                        chunk_size: int = 10_000,
+                        n_epochs: int = 3,
+                        precision: str = "float64") -> "BaseEstimator":
+    """run a mini-batch K-means model on a csv file streamed in chunks, so that the
+    memory used depends on the chunk size instead of the size of the file
+
+    Arguments:
+        input_path -- the path of the featurized csv or parquet file
+        cols -- features to include in the K-Means algorithm
+        k -- number of clusters
+
+    Keyword Arguments:
+        seed -- random state seed (default: {42})
+        chunk_size -- number of rows read and fitted at a time (default: {10_000})
+        n_epochs -- number of passes over the file (default: {3})
+        precision -- numeric type the model is fitted in, and of its centroids,
+            `float64` or `float32` (default: {"float64"})
+
+    Raises:
+        ValueError -- the file has fewer rows than clusters, or unknown precision
+
+    Returns:
+        a MiniBatchKMeans model
+    """
+    from sklearn.cluster import MiniBatchKMeans  # pylint: disable=import-outside-toplevel
+    dtype = numeric_type(precision)
+    mod = MiniBatchKMeans(n_clusters=k, random_state=seed, n_init=3)
+    # the columns are validated (and logged) once, on the first chunk
+    train_cols = None
+    for epoch in range(n_epochs):
+        # the first batch initializes the centers, so it needs at least k rows
+        pending = []
+        n_rows = 0
+        for chunk in read_chunks(input_path, chunk_size):
+            if train_cols is None:
+                train_cols = get_train_data(chunk, cols).columns.tolist()
+            df_in = chunk[train_cols].astype(dtype)
+            if epoch == 0 and not hasattr(mod, "cluster_centers_"):
+                pending.append(df_in)
+                if sum(len(df) for df in pending) < k:
+                    continue
+                df_in = pd.concat(pending)
+                pending = []
+            mod.partial_fit(df_in)
+            n_rows += len(df_in)
+        if not hasattr(mod, "cluster_centers_"):
+            logger.error("At least %d rows are needed to find %d clusters", k, k)
+            raise ValueError("Fewer rows than clusters")
+        logger.info("Epoch %d of %d: %d rows fitted in chunks of %d",
+                    epoch + 1, n_epochs, n_rows, chunk_size)
+    return mod
+
+
+def fit_candidate(df_in: pd.DataFrame, k: int, seed: int,
+                  sample_size: int = 10_000) -> tuple["BaseEstimator", dict]:
+    """Fits one candidate of a k-sweep and scores it. Runs in a worker process,
+    limited to one thread so that the workers do not compete for the cores.
+
+    Arguments:
+        df_in -- the training data
+        k -- number of clusters
+        seed -- random state seed
+
+    Keyword Arguments:
+        sample_size -- number of songs the silhouette score is computed on (default: {10_000})
+
+    Returns:
+        the KMeans model and a dictionary of k, seed, inertia and silhouette
+    """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.cluster import KMeans
+    from sklearn.metrics import silhouette_score
+    from threadpoolctl import threadpool_limits
+    with threadpool_limits(limits=1):
+        model = KMeans(n_clusters=k, random_state=seed).fit(df_in)
+        silhouette = silhouette_score(df_in, model.labels_,
+                                      sample_size=min(sample_size, len(df_in)),
+                                      random_state=seed)
+    return model, {"k": k, "seed": seed, "inertia": float(model.inertia_),
+                   "silhouette": float(silhouette)}
+
+
+def select_candidate(report: pd.DataFrame, criterion: str) -> int:
+    """Picks the best candidate of a k-sweep
+
+    Arguments:
+        report -- one row per candidate with k, seed, inertia and silhouette
+        criterion -- `silhouette` for the highest silhouette score, or `elbow` for the k
+            where the inertia curve bends the most, with its lowest inertia seed
+
+    Returns:
+        the index of the best row
+    """
+    if criterion == "silhouette":
+        return int(report["silhouette"].idxmax())
+    # the elbow is the k with the largest second difference of the (best) inertia curve
+    inertia = report.groupby("k")["inertia"].min().sort_index()
+    if len(inertia) < 3:
+        best_k = inertia.index[0]
+    else:
+        bend = inertia.shift(1) - 2 * inertia + inertia.shift(-1)
+        best_k = bend.idxmax()
+    return int(report.loc[report["k"] == best_k, "inertia"].idxmin())
+
+
+def sweep_k(df: pd.DataFrame, cols: list[str],
+            k_values: list[int],
+            seeds: list[int],
+            criterion: str = "silhouette",
+            sample_size: int = 10_000,
+            n_jobs: typing.Optional[int] = None,
+            precision: str = "float64") -> tuple["BaseEstimator", pd.DataFrame]:
+    """Fits a K-means model for every number of clusters and seed in parallel
+    and keeps the best one
+
+    Arguments:
+        df -- dataframe to work on
+        cols -- features to include in the K-Means algorithm
+        k_values -- numbers of clusters to try
+        seeds -- random state seeds to try for each number of clusters
+
+    Keyword Arguments:
+        criterion -- how to pick the best model, one of SWEEP_CRITERIA (default: {"silhouette"})
+        sample_size -- number of songs the silhouette score is computed on (default: {10_000})
+        n_jobs -- number of worker processes, all the cores if None (default: {None})
+        precision -- numeric type the candidates are fitted in, `float64` or `float32`
+            (default: {"float64"})
+
+    Raises:
+        ValueError -- unknown criterion or precision, or a number of clusters
+            the data cannot have
+
+    Returns:
+        the best KMeans model
+        a comparison report of the candidates, with the best one flagged as `selected`
+    """
+    if criterion not in SWEEP_CRITERIA:
+        logger.error("Criterion %s is not one of %s", criterion, SWEEP_CRITERIA)
+        raise ValueError(f"Unknown criterion {criterion}")
+    df_in = get_train_data(df, cols).astype(numeric_type(precision))
+    if min(k_values) < 2 or max(k_values) >= len(df_in):
+        logger.error("Numbers of clusters need to be between 2 and %d", len(df_in) - 1)
+        raise ValueError("Invalid number of clusters")
+
+    candidates = [(k, seed) for k in k_values for seed in seeds]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(candidates))
+    logger.info("Fitting %d candidate models on %d processes", len(candidates), n_jobs)
+    if n_jobs == 1:
+        results = [fit_candidate(df_in, k, seed, sample_size) for k, seed in candidates]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(fit_candidate, df_in, k, seed, sample_size)
+                       for k, seed in candidates]
+            results = [future.result() for future in futures]
+
+    report = pd.DataFrame([stats for _, stats in results])
+    best = select_candidate(report, criterion)
+    report["selected"] = report.index == best
+    logger.info("Selected k=%d (seed %d) by %s: silhouette %.3f, inertia %.1f",
+                report.loc[best, "k"], report.loc[best, "seed"], criterion,
+                report.loc[best, "silhouette"], report.loc[best, "inertia"])
+    return results[best][0], report
+
+
+def save_model(model: "BaseEstimator", output_path: str) -> None:
     """A helper function that saves a model to a path
 
     Arguments:
@@ -80,3 +259,17 @@ def save_model(model: BaseEstimator, output_path: str) -> None:
     except FileNotFoundError as err:
         logger.error("Path does not exist at %s", output_path)
         raise err
+
+
+def load_model(path: str) -> typing.Union["BaseEstimator", ModelArtifact]:
+    """Loads a model saved by save_model(), or an artifact written by export_artifact()
+
+    Arguments:
+        path -- the path of the joblib or artifact file
+
+    Returns:
+        the model, or the ModelArtifact holding the model and its scaler
+    """
+    if is_artifact(path):
+        return load_artifact(path)
+    return joblib.load(path)
@@ -0,0 +1,157 @@
+"""
+Export the fitted scaler and KMeans model to a small bundle of arrays (centroids, feature
+names, scaler mean and scale) with their metadata, so that scoring maps a file instead of
+unpickling sklearn estimators. The loaded artifact has the fitted attributes and the
+transform/predict methods the scoring code uses, computed with numpy only.
+"""
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.bundle import MAGIC, load_bundle, save_bundle
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_FORMAT = 1
+
+
+class ArtifactScaler:
+    """The fitted parameters of a StandardScaler, applied without sklearn.
+
+    Args:
+        feature_names_in_ (np.ndarray): names of the scaled columns
+        mean_ (np.ndarray): mean of each scaled column
+        scale_ (np.ndarray): standard deviation of each scaled column
+    """
+
+    def __init__(self, feature_names_in_: np.ndarray, mean_: np.ndarray, scale_: np.ndarray):
+        self.feature_names_in_ = feature_names_in_
+        self.mean_ = mean_
+        self.scale_ = scale_
+
+    def transform(self, df: typing.Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """Scales the columns as StandardScaler.transform() does
+
+        Arguments:
+            df -- the columns of feature_names_in_, in that order
+
+        Returns:
+            the scaled values
+        """
+        return (np.asarray(df, dtype=np.float64) - self.mean_) / self.scale_
+
+
+class ModelArtifact:
+    """A KMeans model and the scaler of its features, loaded from an artifact file.
+
+    Args:
+        feature_names_in_ (np.ndarray): the features of the model, in centroid column order
+        cluster_centers_ (np.ndarray): (k, n_features) centroids, in the scaled feature space
+        scaler (ArtifactScaler): the scaler fitted by the featurize step
+        attrs (dict): number of clusters, seed, hash of the training data, model type and
+            root mean squared distance of the training songs to their centroid
+    """
+
+    def __init__(self, feature_names_in_: np.ndarray, cluster_centers_: np.ndarray,
+                 scaler: ArtifactScaler, attrs: dict):
+        self.feature_names_in_ = feature_names_in_
+        self.cluster_centers_ = cluster_centers_
+        self.scaler = scaler
+        self.attrs = attrs
+
+    @property
+    def n_clusters(self) -> int:
+        """The number of clusters of the model"""
+        return self.cluster_centers_.shape[0]
+
+    def predict(self, df: typing.Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """Assigns each song to the centroid at the smallest euclidean distance,
+        as KMeans.predict() does
+
+        Arguments:
+            df -- scaled songs, with the columns of feature_names_in_ in that order
+
+        Returns:
+            the cluster of each song
+        """
+        values = np.asarray(df, dtype=self.cluster_centers_.dtype)
+        # |x - c|^2 without the |x|^2 term, which is the same for every centroid
+        distances = ((self.cluster_centers_ ** 2).sum(axis=1)
+                     - 2 * values @ self.cluster_centers_.T)
+        return np.argmin(distances, axis=1).astype(np.int32)
+
+
+def export_artifact(model: typing.Any, scaler: typing.Any, output_path: str,
+                    data_hash: typing.Optional[str] = None) -> None:
+    """Writes the arrays needed to score songs with a fitted model to an artifact file
+
+    Arguments:
+        model -- the KMeans or MiniBatchKMeans model
+        scaler -- the StandardScaler fitted by the featurize step
+        output_path -- the path of the file to write
+
+    Keyword Arguments:
+        data_hash -- hash of the data the model was trained on, stored as metadata (default: {None})
+
+    Raises:
+        KeyError -- the model uses features the scaler does not scale
+    """
+    features = [str(col) for col in model.feature_names_in_]
+    scaler_columns = [str(col) for col in scaler.feature_names_in_]
+    if not set(features).issubset(scaler_columns):
+        logger.error("The model features %s are not all scaled by the scaler", features)
+        raise KeyError("Model features not scaled by the scaler")
+    arrays = {"features": np.array(features, dtype=str),
+              "centroids": np.asarray(model.cluster_centers_),
+              "scaler.columns": np.array(scaler_columns, dtype=str),
+              "scaler.mean": np.asarray(scaler.mean_, dtype=np.float64),
+              "scaler.scale": np.asarray(scaler.scale_, dtype=np.float64)}
+    seed = model.random_state
+    attrs = {"artifact_format": ARTIFACT_FORMAT, "model": type(model).__name__,
+             "k": int(model.cluster_centers_.shape[0]),
+             "seed": int(seed) if isinstance(seed, (int, np.integer)) else None,
+             "data_hash": data_hash,
+             # the baseline of the drift of `run_rds.py update`, which loads the artifact.
+             # inertia_ covers the songs of labels_ (the last batch of a MiniBatchKMeans)
+             "baseline_rms": float(np.sqrt(model.inertia_ / max(len(model.labels_), 1)))}
+    try:
+        save_bundle(output_path, arrays, attrs)
+    except FileNotFoundError as err:
+        logger.error("Path does not exist at %s", output_path)
+        raise err
+    logger.info("Model artifact with %d clusters saved to %s", attrs["k"], output_path)
+
+
+def is_artifact(path: str) -> bool:
+    """Returns whether a model file is a bundle rather than a joblib pickle"""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def load_artifact(path: str, mmap: bool = True) -> ModelArtifact:
+    """Loads an artifact written by export_artifact(), without importing sklearn
+
+    Arguments:
+        path -- the path of the artifact file
+
+    Keyword Arguments:
+        mmap -- map the arrays instead of reading them into memory (default: {True})
+
+    Raises:
+        ValueError -- the file is not a model artifact of a supported format
+
+    Returns:
+        the ModelArtifact
+    """
+    arrays, attrs = load_bundle(path, mmap=mmap)
+    if attrs.get("artifact_format") != ARTIFACT_FORMAT:
+        logger.error("%s is not a model artifact of format %d", path, ARTIFACT_FORMAT)
+        raise ValueError(f"{path} is not a model artifact")
+    scaler = ArtifactScaler(arrays["scaler.columns"].astype(object), arrays["scaler.mean"],
+                            arrays["scaler.scale"])
+    artifact = ModelArtifact(arrays["features"].astype(object), arrays["centroids"],
+                             scaler, attrs)
+    logger.info("Model artifact with %d clusters loaded from %s", artifact.n_clusters, path)
+    return artifact
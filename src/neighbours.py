@@ -0,0 +1,171 @@
+"""
+Precompute the closest songs of every song in the catalog, so that searching for a song
+that is already in the catalog is answered by a lookup instead of similarity computations
+"""
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import validate_features
+from src.snapshot import content_version
+from src.song_index import as_python, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def compute_neighbours(df_songs: pd.DataFrame, features: list[str], k: int,
+                       block_size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+    """Finds the k closest songs (in terms of cosine similarity) of every song in the catalog.
+    Songs are processed in blocks, so memory is bounded by block_size x n_songs similarities.
+
+    Arguments:
+        df_songs -- the clustered songs with their features
+        features -- the features to compute similarity on
+        k -- number of neighbours to keep for each song
+
+    Keyword Arguments:
+        block_size -- number of songs scored per matrix product (default: {1024})
+
+    Raises:
+        KeyError -- Nonexisting features
+
+    Returns:
+        (n_songs, k) row positions of the neighbours, most similar first
+        (n_songs, k) cosine similarities of the neighbours
+    """
+    if not validate_features(df_songs, features):
+        logger.error("The features selected is not an available song feature!")
+        raise KeyError("Nonexisting feature")
+
+    matrix = np.ascontiguousarray(
+        normalize_rows(df_songs[features].to_numpy(dtype=np.float64)), dtype=np.float32)
+    n_songs = matrix.shape[0]
+    k = min(k, n_songs)
+    indices = np.empty((n_songs, k), dtype=np.int32)
+    scores = np.empty((n_songs, k), dtype=np.float32)
+
+    for start in range(0, n_songs, block_size):
+        sims = matrix[start:start + block_size] @ matrix.T
+        # top k of every row of the block at once, then sorted within the k
+        inds = np.argpartition(sims, -k, axis=1)[:, -k:]
+        top = np.take_along_axis(sims, inds, axis=1)
+        order = np.argsort(-top, axis=1, kind="stable")
+        indices[start:start + block_size] = np.take_along_axis(inds, order, axis=1)
+        scores[start:start + block_size] = np.take_along_axis(top, order, axis=1)
+        logger.debug("Neighbours computed for %d of %d songs",
+                     min(start + block_size, n_songs), n_songs)
+    logger.info("%d neighbours computed for each of %d songs", k, n_songs)
+    return indices, scores
+
+
+def save_neighbours(df_songs: pd.DataFrame, indices: np.ndarray, scores: np.ndarray,
+                    output_path: str, features: list[str]) -> None:
+    """Saves the neighbours with the metadata of the songs to a compact binary file, with
+    the version of the catalog they were computed on (that of a snapshot of the same songs)
+
+    Arguments:
+        df_songs -- the clustered songs the neighbours were computed on
+        indices -- row positions of the neighbours of each song
+        scores -- cosine similarities of the neighbours of each song
+        output_path -- the path to the .npz file to write
+        features -- the features the neighbours were computed on
+    """
+    try:
+        np.savez(output_path, indices=indices, scores=scores,
+                 track_uri=df_songs["track_uri"].to_numpy(dtype=str),
+                 title=df_songs["title"].to_numpy(dtype=str),
+                 clusterId=df_songs["clusterId"].to_numpy(dtype=np.int64),
+                 catalog_version=np.int64(content_version(df_songs, features)))
+        logger.info("Neighbours saved to %s", output_path)
+    except FileNotFoundError as err:
+        logger.error("Path does not exist at %s", output_path)
+        raise err
+
+
+class NeighbourTable:
+    """Answers recommendations for catalog songs from precomputed neighbours.
+
+    Args:
+        indices (np.ndarray): row positions of the neighbours of each song
+        scores (np.ndarray): cosine similarities of the neighbours of each song
+        metadata (dict): column name -> array with one value per song
+        catalog_version (int): content version of the songs the neighbours were computed on,
+            0 if unknown
+    """
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray,
+                 metadata: dict[str, np.ndarray], catalog_version: int = 0):
+        self.indices = indices
+        self.scores = scores
+        self.metadata = metadata
+        self.catalog_version = catalog_version
+        self._rows = {uri: row for row, uri in enumerate(metadata["track_uri"].tolist())}
+
+    def __len__(self) -> int:
+        return self.indices.shape[0]
+
+    def __contains__(self, track_uri: str) -> bool:
+        return track_uri in self._rows
+
+    @classmethod
+    def load(cls, path: str) -> "NeighbourTable":
+        """Loads the neighbours written by save_neighbours()
+
+        Arguments:
+            path -- the path to the .npz file
+
+        Returns:
+            a NeighbourTable
+        """
+        with np.load(path) as data:
+            # files written before the catalog version was recorded have none
+            table = cls(data["indices"], data["scores"],
+                        {col: data[col] for col in ["title", "track_uri", "clusterId"]},
+                        int(data["catalog_version"]) if "catalog_version" in data.files else 0)
+        logger.info("Neighbours of %d songs loaded from %s", len(table), path)
+        return table
+
+    def matches(self, track_uris: typing.Iterable[str],
+                cluster_ids: typing.Iterable[int]) -> bool:
+        """Returns whether the neighbours were computed on exactly these songs and clusters
+
+        Arguments:
+            track_uris -- the Spotify uris of the songs of the catalog
+            cluster_ids -- the cluster of each song, in the same order
+
+        Returns:
+            True if every song of the catalog, and no other, has neighbours,
+            with the cluster it has in the catalog
+        """
+        track_uris = list(track_uris)
+        clusters = self.metadata["clusterId"]
+        if len(track_uris) != len(self._rows):
+            return False
+        for uri, cluster_id in zip(track_uris, cluster_ids):
+            row = self._rows.get(uri)
+            if row is None or clusters[row] != cluster_id:
+                return False
+        return True
+
+    def lookup(self, track_uri: str, top_n: int) -> typing.Optional[list[dict]]:
+        """Returns the precomputed closest songs of a catalog song
+
+        Arguments:
+            track_uri -- the Spotify uri of the song, e.g. spotify:track:<id>
+            top_n -- number of songs to return
+
+        Returns:
+            a list of records of the closest songs, most similar first,
+            None if the song is not in the catalog or fewer than top_n neighbours were kept
+        """
+        row = self._rows.get(track_uri)
+        if row is None or top_n > self.indices.shape[1]:
+            return None
+        res = []
+        for pos, score in zip(self.indices[row, :top_n], self.scores[row, :top_n]):
+            record = {col: as_python(values[pos]) for col, values in self.metadata.items()}
+            record["similarity"] = float(score)
+            res.append(record)
+        return res
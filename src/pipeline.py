@@ -0,0 +1,290 @@
+"""
+Run the whole model pipeline (clean, featurize, train, export, score, evaluate, neighbours
+and snapshot) in one process: the stages hand dataframes and models to each other in memory,
+and a stage is skipped when its inputs and its part of the configuration are unchanged
+since it last ran
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+import joblib
+import pandas as pd
+
+from src.evaluate_model import assign_labels, assign_new_labels, evaluate
+from src.model import get_model, save_model, sweep_k
+from src.model_artifact import export_artifact, load_artifact
+from src.neighbours import compute_neighbours, save_neighbours
+from src.preprocessing import clean, featurize
+from src.profiling import StepProfiler
+from src.s3 import download_file_from_s3
+from src.snapshot import save_snapshot
+from src.tables import read_table, write_table
+
+logger = logging.getLogger(__name__)
+
+# artifacts that are not written by a stage, but read from outside the pipeline
+EXTERNAL_ARTIFACTS = ["raw", "sample"]
+MODEL_ARTIFACTS = ["scaler", "model"]
+
+
+def file_digest(path: str) -> str:
+    """Returns the sha256 of the content of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _clean(inputs: dict, config: dict, paths: dict) -> dict:
+    cleaned = clean(inputs["raw"], **config["preprocessing"]["clean"])
+    write_table(cleaned, paths["cleaned"])
+    return {"cleaned": cleaned}
+
+
+def _featurize(inputs: dict, config: dict, paths: dict) -> dict:
+    features, scaler = featurize(inputs["cleaned"], precision=config["precision"],
+                                 **config["preprocessing"]["featurize"])
+    write_table(features, paths["features"])
+    save_model(scaler, paths["scaler"])
+    return {"features": features, "scaler": scaler}
+
+
+def _train(inputs: dict, config: dict, paths: dict) -> dict:
+    if config["model"].get("mode", "full") == "sweep":
+        model, report = sweep_k(inputs["features"], precision=config["precision"],
+                                **config["model"]["sweep_k"])
+        if paths.get("k_sweep") is not None:
+            report.to_csv(paths["k_sweep"], index=False)
+    else:
+        model = get_model(inputs["features"], precision=config["precision"],
+                          **config["model"]["get_model"])
+    clusters = assign_labels(inputs["cleaned"], model)
+    write_table(clusters, paths["clusters"])
+    save_model(model, paths["model"])
+    return {"clusters": clusters, "model": model}
+
+
+def _export(inputs: dict, config: dict, paths: dict) -> dict:
+    export_artifact(inputs["model"], inputs["scaler"], paths["artifact"],
+                    data_hash=file_digest(paths["features"]))
+    return {}
+
+
+def _score(inputs: dict, config: dict, paths: dict) -> dict:
+    # the exported artifact, as served, holds the scaler of its features
+    scores = assign_new_labels(inputs["sample"], inputs["artifact"].scaler, inputs["artifact"],
+                               **config["evaluate_model"]["assign_new_labels"])
+    write_table(scores, paths["scores"])
+    return {"scores": scores}
+
+
+def _evaluate(inputs: dict, config: dict, paths: dict) -> dict:
+    evaluation = evaluate(inputs["scores"], **config["evaluate_model"]["evaluate"])
+    with open(paths["evaluation"], "w", encoding="utf-8") as file:
+        file.write(evaluation)
+    return {"evaluation": evaluation}
+
+
+def _neighbours(inputs: dict, config: dict, paths: dict) -> dict:
+    neighbours = compute_neighbours(inputs["clusters"],
+                                    **config["neighbours"]["compute_neighbours"])
+    save_neighbours(inputs["clusters"], *neighbours, output_path=paths["neighbours"],
+                    features=config["neighbours"]["compute_neighbours"]["features"])
+    return {}
+
+
+def _snapshot(inputs: dict, config: dict, paths: dict) -> dict:
+    save_snapshot(inputs["clusters"], output_path=paths["snapshot"], scaler=inputs["scaler"],
+                  precision=config["precision"], **config["snapshot"]["save_snapshot"])
+    return {}
+
+
+def _train_config(config: dict) -> dict:
+    mode = config["model"].get("mode", "full")
+    return {"mode": mode, "precision": config["precision"],
+            "model": config["model"]["sweep_k" if mode == "sweep" else "get_model"]}
+
+
+class Stage:
+    """A stage of the pipeline.
+
+    Args:
+        name (str): name of the stage, as the step of run.py
+        inputs (list[str]): artifacts the stage reads
+        outputs (list[str]): artifacts the stage writes
+        settings (Callable[[dict], dict]): returns the part of the configuration the stage
+            depends on, a change of which re-runs the stage
+        run (Callable[[dict, dict, dict], dict]): computes and writes the outputs from the
+            inputs, the configuration and the artifact paths, and returns the outputs
+            handed to the next stages
+    """
+
+    def __init__(self, name: str, inputs: list[str], outputs: list[str],
+                 settings: typing.Callable[[dict], dict],
+                 run: typing.Callable[[dict, dict, dict], dict]):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.settings = settings
+        self.run = run
+
+
+# in the order they run
+STAGES = [
+    Stage("clean", ["raw"], ["cleaned"],
+          lambda config: config["preprocessing"]["clean"], _clean),
+    Stage("featurize", ["cleaned"], ["features", "scaler"],
+          lambda config: {**config["preprocessing"]["featurize"],
+                          "precision": config["precision"]}, _featurize),
+    Stage("train", ["features", "cleaned"], ["clusters", "model"], _train_config, _train),
+    Stage("export", ["model", "scaler"], ["artifact"], lambda config: {}, _export),
+    Stage("score", ["sample", "artifact"], ["scores"],
+          lambda config: config["evaluate_model"]["assign_new_labels"], _score),
+    Stage("evaluate", ["scores"], ["evaluation"],
+          lambda config: config["evaluate_model"]["evaluate"], _evaluate),
+    Stage("neighbours", ["clusters"], ["neighbours"],
+          lambda config: config["neighbours"]["compute_neighbours"], _neighbours),
+    Stage("snapshot", ["clusters", "scaler"], ["snapshot"],
+          lambda config: {**config["snapshot"]["save_snapshot"],
+                          "precision": config["precision"]}, _snapshot),
+]
+
+
+class PipelineRunner:
+    """Runs the stages of the pipeline in one process.
+
+    A stage is identified by the hash of its configuration and of its inputs: the content
+    of the external files, or the hash of the stage that wrote them. The hashes of the
+    last successful runs are kept in a manifest file, and a stage whose hash is in the
+    manifest and whose outputs exist is skipped. The outputs of skipped stages are read
+    from their files when a later stage needs them.
+
+    Args:
+        config (dict): the configuration of config/model.yaml
+        paths (dict): path of each artifact, of the manifest and of the optional k-sweep report
+        force (bool): run every stage even if unchanged
+        profiler (StepProfiler): profiles each stage that runs as a phase, optional
+    """
+
+    def __init__(self, config: dict, paths: dict, force: bool = False,
+                 profiler: typing.Optional[StepProfiler] = None):
+        self.config = config
+        self.paths = paths
+        self.force = force
+        self.profiler = profiler or StepProfiler("all")
+        # artifacts held in memory, and the hash of each artifact
+        self.data: dict[str, typing.Any] = {}
+        self.keys: dict[str, str] = {}
+
+    def load_manifest(self) -> dict[str, str]:
+        """Returns stage name -> hash of its last successful run"""
+        try:
+            with open(self.paths["manifest"], "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def save_manifest(self, manifest: dict[str, str]) -> None:
+        """Writes the hashes of the last successful runs"""
+        with open(self.paths["manifest"], "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+
+    def external_key(self, name: str) -> typing.Optional[str]:
+        """Returns the hash of an external artifact, None if its file does not exist.
+        The raw data is downloaded from S3 first if it is not on disk."""
+        path = self.paths[name]
+        if name == "raw" and not os.path.exists(path) and os.getenv("S3_BUCKET"):
+            download_file_from_s3(local_path=path, s3path=os.getenv("S3_BUCKET"))
+        if not os.path.exists(path):
+            return None
+        return file_digest(path)
+
+    def stage_key(self, stage: Stage) -> typing.Optional[str]:
+        """Returns the hash of a stage, None if one of its inputs is not available"""
+        input_keys = {}
+        for name in stage.inputs:
+            if name not in self.keys and name in EXTERNAL_ARTIFACTS:
+                self.keys[name] = self.external_key(name)
+            input_keys[name] = self.keys.get(name)
+            if input_keys[name] is None:
+                return None
+        document = json.dumps({"stage": stage.name, "config": stage.settings(self.config),
+                               "inputs": input_keys}, sort_keys=True, default=str)
+        return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+    def artifact(self, name: str) -> typing.Any:
+        """Returns an artifact, read from its file unless a stage of this run produced it"""
+        if name not in self.data:
+            if name in MODEL_ARTIFACTS:
+                self.data[name] = joblib.load(self.paths[name])
+            elif name == "artifact":
+                self.data[name] = load_artifact(self.paths[name])
+            else:
+                self.data[name] = read_table(self.paths[name])
+            logger.info("%s loaded from %s", name, self.paths[name])
+        return self.data[name]
+
+    def run(self) -> dict[str, str]:
+        """Runs the stages whose inputs or configuration changed
+
+        Returns:
+            stage name -> `ran`, `skipped` (unchanged) or `missing input`
+        """
+        manifest = self.load_manifest()
+        status = {}
+        for stage in STAGES:
+            key = self.stage_key(stage)
+            if key is None:
+                logger.warning("Stage %s is not run, as one of its inputs %s is missing",
+                               stage.name, stage.inputs)
+                status[stage.name] = "missing input"
+                continue
+            if (not self.force and manifest.get(stage.name) == key
+                    and all(os.path.exists(self.paths[name]) for name in stage.outputs)):
+                logger.info("Stage %s is unchanged, skipped", stage.name)
+                status[stage.name] = "skipped"
+            else:
+                start = time.perf_counter()
+                with self.profiler.phase(stage.name) as phase:
+                    inputs = {name: self.artifact(name) for name in stage.inputs}
+                    self.data.update(stage.run(inputs, self.config, self.paths))
+                    # the rows of the first table the stage reads
+                    phase.rows = next((len(value) for value in inputs.values()
+                                       if isinstance(value, pd.DataFrame)), None)
+                manifest[stage.name] = key
+                self.save_manifest(manifest)
+                logger.info("Stage %s ran in %.2f seconds", stage.name,
+                            time.perf_counter() - start)
+                status[stage.name] = "ran"
+            self.keys.update({name: key for name in stage.outputs})
+        return status
+
+
+def run_pipeline(config: dict, force: bool = False,
+                 profiler: typing.Optional[StepProfiler] = None) -> dict[str, str]:
+    """Runs the pipeline with the artifact paths of the `pipeline` section of the configuration
+
+    Arguments:
+        config -- the configuration of config/model.yaml
+
+    Keyword Arguments:
+        force -- run every stage even if unchanged (default: {False})
+        profiler -- profiles each stage that runs as a phase (default: {None})
+
+    Raises:
+        ValueError -- the configuration selects a streaming mode, which reads from disk
+
+    Returns:
+        stage name -> `ran`, `skipped` (unchanged) or `missing input`
+    """
+    if (config["preprocessing"].get("mode", "full") == "streaming"
+            or config["model"].get("mode", "full") == "minibatch"):
+        logger.error("The in-process pipeline hands data in memory, "
+                     "run the steps one by one to stream them from disk")
+        raise ValueError("Streaming modes are not supported by the in-process pipeline")
+    return PipelineRunner(config, config["pipeline"]["paths"], force, profiler).run()
@@ -4,13 +4,21 @@ Featurize the cleaned data - standard scaling
 
 """
 import logging
+import typing
 
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import StandardScaler
+
+from src.tables import TableWriter, read_table_chunks
+
+if typing.TYPE_CHECKING:  # sklearn is only imported by the steps fitting the scaler
+    from sklearn.preprocessing import StandardScaler
 
 logger = logging.getLogger(__name__)
 
+# numeric types of the features, centroids and similarity matrices, by precision setting
+PRECISIONS = {"float64": np.float64, "float32": np.float32}
+
 
 def read_from_local(path: str, **kwargs) -> pd.DataFrame:
     """Read a csv file from a local path
@@ -36,6 +44,43 @@ def read_from_local(path: str, **kwargs) -> pd.DataFrame:
     return res
 
 
+def numeric_type(precision: str) -> type:
+    """Returns the numpy type of a precision setting
+
+    Arguments:
+        precision -- one of PRECISIONS, `float64` or `float32`
+
+    Raises:
+        ValueError -- unknown precision
+
+    Returns:
+        np.float64 or np.float32
+    """
+    if precision not in PRECISIONS:
+        logger.error("Precision %s is not one of %s", precision, list(PRECISIONS))
+        raise ValueError(f"Unknown precision {precision}")
+    return PRECISIONS[precision]
+
+
+def read_chunks(input_path: str, chunk_size: int) -> typing.Iterator[pd.DataFrame]:
+    """Reads a csv or parquet file in chunks of rows, so that only one chunk is held in memory
+
+    Arguments:
+        input_path -- the path of the csv or parquet file
+        chunk_size -- number of rows per chunk
+
+    Raises:
+        ValueError -- the chunk size is not positive
+
+    Returns:
+        an iterator over the chunks
+    """
+    if chunk_size <= 0:
+        logger.error("The chunk size needs to be positive but is %d", chunk_size)
+        raise ValueError("Chunk size not positive")
+    return read_table_chunks(input_path, chunk_size)
+
+
 def validate_features(df: pd.DataFrame, features: list[str]) -> bool:
     """A helper function that checks whether the given features exist in the dataframe
 
@@ -95,15 +140,21 @@ def clean(df_in: pd.DataFrame, col_mapper: dict, features: list[str]) -> pd.Data
     return df_new
 
 
-def featurize(df_in: pd.DataFrame, features: list[str]) -> tuple[pd.DataFrame, StandardScaler]:
+def featurize(df_in: pd.DataFrame, features: list[str],
+              precision: str = "float64") -> tuple[pd.DataFrame, "StandardScaler"]:
     """Generate features from the cleaned dataset
 
     Arguments:
         df_in -- the cleaned dataframe
         features -- list of features to include in the final dataframe
 
+    Keyword Arguments:
+        precision -- numeric type of the scaled columns, `float64` or `float32`.
+            The scaler is fitted in float64 either way (default: {"float64"})
+
     Raises:
         TypeError -- the first argument is not a pandas dataframe
+        ValueError -- unknown precision
 
     Returns:
         a dataframe with scaled columns
@@ -114,6 +165,7 @@ def featurize(df_in: pd.DataFrame, features: list[str]) -> tuple[pd.DataFrame, S
         logger.error("The first argument should be a pandas dataframe,"
                      "but it is now %s", type(df_in))
         raise TypeError("Not a pandas dataframe")
+    dtype = numeric_type(precision)
     # check if features exist`
     if validate_features(df_in, features):
         df_in = df_in[features]
@@ -123,13 +175,90 @@ def featurize(df_in: pd.DataFrame, features: list[str]) -> tuple[pd.DataFrame, S
         logger.error("The original whole dataframe is selected.")
 
     # conduct scaling on numerical columns
+    from sklearn.preprocessing import StandardScaler  # pylint: disable=import-outside-toplevel
     std_scale = StandardScaler()
     df_num = df_in.select_dtypes(include=np.number)
     df_rest = df_in.select_dtypes(exclude=np.number)
     std_scale.fit(df_num)
-    df_scale = pd.DataFrame(std_scale.transform(df_num),
+    df_scale = pd.DataFrame(std_scale.transform(df_num).astype(dtype, copy=False),
                             columns=df_num.columns)
     # combine numerical and non-numerical columns
     df_fin = pd.concat([df_scale, df_rest], axis=1)
 
     return df_fin, std_scale
+
+
+def clean_streaming(input_path: str, output_path: str, col_mapper: dict,
+                    features: list[str], chunk_size: int = 10_000) -> int:
+    """Clean a raw csv file a chunk of rows at a time, appending each cleaned chunk
+    to the output file, so that memory does not depend on the size of the file
+
+    Arguments:
+        input_path -- the path of the raw csv file
+        output_path -- the path of the cleaned csv or parquet file to write
+        col_mapper -- a dictionary containing column names to change
+        features -- list of features to include in the final dataframe
+
+    Keyword Arguments:
+        chunk_size -- number of rows held in memory at a time (default: {10_000})
+
+    Returns:
+        the number of rows cleaned
+    """
+    with TableWriter(output_path) as output:
+        for chunk in read_chunks(input_path, chunk_size):
+            output.write(clean(chunk, col_mapper, features))
+    logger.info("%d rows cleaned in chunks of %d", output.n_rows, chunk_size)
+    return output.n_rows
+
+
+def featurize_streaming(input_path: str, output_path: str, features: list[str],
+                        chunk_size: int = 10_000, precision: str = "float64") -> "StandardScaler":
+    """Generate features from a cleaned csv file in two passes over its chunks: the first
+    fits the scaler incrementally, the second scales each chunk and appends it to the output
+
+    Arguments:
+        input_path -- the path of the cleaned csv or parquet file
+        output_path -- the path of the featurized csv or parquet file to write
+        features -- list of features to include in the final dataframe
+
+    Keyword Arguments:
+        chunk_size -- number of rows held in memory at a time (default: {10_000})
+        precision -- numeric type of the scaled columns, `float64` or `float32`
+            (default: {"float64"})
+
+    Raises:
+        ValueError -- the input file is empty, or unknown precision
+
+    Returns:
+        the standard scaler fitted on the whole file
+    """
+    dtype = numeric_type(precision)
+    from sklearn.preprocessing import StandardScaler  # pylint: disable=import-outside-toplevel
+    std_scale = StandardScaler()
+    num_columns = None
+    for chunk in read_chunks(input_path, chunk_size):
+        if validate_features(chunk, features):
+            chunk = chunk[features]
+        elif num_columns is None:
+            logger.error(
+                "The given features %s do not exist in the dataframe", features)
+            logger.error("The original whole dataframe is selected.")
+        # the numeric columns of the first chunk are scaled in all the chunks
+        if num_columns is None:
+            num_columns = chunk.select_dtypes(include=np.number).columns.tolist()
+        std_scale.partial_fit(chunk[num_columns])
+    if num_columns is None:
+        logger.error("No rows to featurize in %s", input_path)
+        raise ValueError("Empty input file")
+
+    with TableWriter(output_path) as output:
+        for chunk in read_chunks(input_path, chunk_size):
+            if validate_features(chunk, features):
+                chunk = chunk[features]
+            df_scale = pd.DataFrame(
+                std_scale.transform(chunk[num_columns]).astype(dtype, copy=False),
+                columns=num_columns, index=chunk.index)
+            output.write(pd.concat([df_scale, chunk.drop(columns=num_columns)], axis=1))
+    logger.info("%d rows featurized in chunks of %d", output.n_rows, chunk_size)
+    return std_scale
@@ -0,0 +1,188 @@
+"""
+Profile a run.py step: the CPU time of every function (cProfile), the peak of python
+allocations (tracemalloc), the wall time, peak RSS and rows per second of each phase of
+the step (reading the inputs, running the step, writing the outputs). When profiling is
+disabled, the phases are empty context managers and nothing is measured.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import pstats
+import time
+import tracemalloc
+import typing
+
+try:
+    import resource
+except ImportError:  # peak RSS is only available on unix
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# number of functions and allocation sites listed in the text summary
+TOP_N = 30
+
+
+def peak_rss_mb() -> dict[str, typing.Optional[float]]:
+    """Returns the peak resident memory of this process and of its finished child
+    processes (e.g. the workers of a pool), in megabytes, None where unavailable"""
+    if resource is None:
+        return {"self": None, "children": None}
+    # kilobytes on linux
+    return {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+
+class Phase:
+    """Measures of one phase of a step, filled in by StepProfiler.phase().
+
+    Args:
+        name (str): name of the phase
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows: typing.Optional[int] = None
+        self.wall_seconds = 0.0
+        self.peak_traced_mb = 0.0
+        self.peak_rss_mb: dict[str, typing.Optional[float]] = {}
+
+    def to_dict(self) -> dict:
+        """Returns the measures as a JSON serializable dictionary"""
+        rows_per_second = (self.rows / self.wall_seconds
+                           if self.rows is not None and self.wall_seconds > 0 else None)
+        return {"name": self.name, "wall_seconds": self.wall_seconds, "rows": self.rows,
+                "rows_per_second": rows_per_second, "peak_traced_mb": self.peak_traced_mb,
+                "peak_rss_mb": self.peak_rss_mb}
+
+
+class StepProfiler:
+    """Profiles the phases of a step of the pipeline.
+
+    Args:
+        step (str): name of the step
+        enabled (bool): profile the step, or do nothing
+    """
+
+    def __init__(self, step: str, enabled: bool = False):
+        self.step = step
+        self.enabled = enabled
+        self.phases: list[Phase] = []
+        self._profile: typing.Optional[cProfile.Profile] = None
+        self._start = 0.0
+        self._wall_seconds = 0.0
+        self._top_allocations: list[str] = []
+        # peak traced bytes of each open phase, outermost first, up to the last reset of
+        # the tracemalloc peak (by a nested phase)
+        self._open_peaks: list[int] = []
+
+    def start(self) -> None:
+        """Starts the CPU profiler and the allocation tracking"""
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._start = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self) -> None:
+        """Stops the CPU profiler and the allocation tracking"""
+        if not self.enabled or self._profile is None:
+            return
+        self._profile.disable()
+        self._wall_seconds = time.perf_counter() - self._start
+        # allocation sites of the memory still held at the end of the step
+        statistics = tracemalloc.take_snapshot().statistics("lineno")[:TOP_N]
+        self._top_allocations = [str(stat) for stat in statistics]
+        tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[Phase]:
+        """Measures a phase of the step. The number of rows it processed can be set
+        on the yielded Phase, to report its rows per second. Phases can be nested (the
+        stages of the `all` step): the peak of a phase includes those of its nested phases.
+
+        Arguments:
+            name -- name of the phase, e.g. `read input` or the step
+
+        Returns:
+            a context manager yielding the Phase
+        """
+        phase = Phase(name)
+        if not self.enabled:
+            yield phase
+            return
+        # the peak is reset for this phase, keep that of the enclosing phase so far
+        if self._open_peaks:
+            self._open_peaks[-1] = max(self._open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        self._open_peaks.append(0)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.wall_seconds = time.perf_counter() - start
+            peak = max(self._open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+            if self._open_peaks:
+                self._open_peaks[-1] = max(self._open_peaks[-1], peak)
+            phase.peak_traced_mb = peak / 1e6
+            phase.peak_rss_mb = peak_rss_mb()
+            self.phases.append(phase)
+            logger.info("Phase %s: %.3f seconds, %s rows, peak traced %.1f MB",
+                        name, phase.wall_seconds, phase.rows, phase.peak_traced_mb)
+
+    def report(self) -> dict:
+        """Returns the measures of the step and of its phases"""
+        return {"step": self.step, "wall_seconds": self._wall_seconds,
+                "peak_rss_mb": peak_rss_mb(),
+                "phases": [phase.to_dict() for phase in self.phases]}
+
+    def summary(self, sort: str = "cumulative") -> str:
+        """Returns a text summary: the phases, the functions taking the most CPU time
+        and the allocation sites holding the most memory at the end of the step
+
+        Keyword Arguments:
+            sort -- pstats sort key of the functions, e.g. `cumulative` or `tottime`
+                (default: {"cumulative"})
+
+        Returns:
+            the summary
+        """
+        out = io.StringIO()
+        out.write(f"step {self.step}: {self._wall_seconds:.3f} seconds\n\n")
+        out.write(f"{'phase':<20} {'seconds':>10} {'rows':>12} {'rows/s':>14} "
+                  f"{'traced MB':>10} {'RSS MB':>10}\n")
+        for phase in self.report()["phases"]:
+            rows = "" if phase["rows"] is None else phase["rows"]
+            speed = ("" if phase["rows_per_second"] is None
+                     else f"{phase['rows_per_second']:.0f}")
+            rss = phase["peak_rss_mb"]["self"]
+            out.write(f"{phase['name']:<20} {phase['wall_seconds']:>10.3f} {rows:>12} "
+                      f"{speed:>14} {phase['peak_traced_mb']:>10.1f} "
+                      f"{'' if rss is None else f'{rss:.1f}':>10}\n")
+        if self._profile is not None:
+            out.write(f"\nfunctions by {sort} time\n")
+            pstats.Stats(self._profile, stream=out).sort_stats(sort).print_stats(TOP_N)
+        out.write("allocation sites still held at the end of the step\n")
+        out.write("\n".join(self._top_allocations) + "\n")
+        return out.getvalue()
+
+    def save(self, output_prefix: str) -> None:
+        """Writes the report to `<prefix>.profile.json`, the text summary to
+        `<prefix>.profile.txt` and the CPU profile to `<prefix>.profile.prof`,
+        which `python -m pstats` can sort by any column
+
+        Arguments:
+            output_prefix -- the path the profile files are named after
+        """
+        if not self.enabled:
+            return
+        with open(f"{output_prefix}.profile.json", "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+        with open(f"{output_prefix}.profile.txt", "w", encoding="utf-8") as file:
+            file.write(self.summary())
+        if self._profile is not None:
+            self._profile.dump_stats(f"{output_prefix}.profile.prof")
+        logger.info("Profile of step %s saved to %s.profile.json", self.step, output_prefix)
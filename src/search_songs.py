@@ -6,34 +6,108 @@ Thhe module contains methods that
 """
 import logging
 import os
-from typing import Union
+import re
+import threading
+from typing import Optional, Union
 
 import numpy as np
 import pandas as pd
+import requests
 import spotipy  # type: ignore
-from sklearn.metrics.pairwise import cosine_similarity
+from requests.adapters import HTTPAdapter
 from spotipy.oauth2 import SpotifyClientCredentials  # type: ignore
+from urllib3.util.retry import Retry
+
+from src.preprocessing import numeric_type
+from src.ttl_cache import MISSING, TTLCache
 
 logger = logging.getLogger(__name__)
 
+SPOTIFY_POOL_SIZE = 10
+SPOTIFY_TIMEOUT = 5
+# maximum number of track ids Spotify accepts in one audio features request
+AUDIO_FEATURES_BATCH = 100
+# Spotify track ids are 22 base62 characters
+TRACK_ID_PATTERN = re.compile(r"[0-9A-Za-z]{22}")
+
+# the client shared by all requests of this process, see get_spotify_client()
+_SHARED_API: Optional[spotipy.client.Spotify] = None
+_SHARED_API_LOCK = threading.Lock()
+
+
+class LockedClientCredentials(SpotifyClientCredentials):
+    """Client credentials manager that can be shared between threads.
+
+    spotipy keeps the token in memory and exchanges a new one when it is about to
+    expire; the lock makes sure only one thread does the exchange at a time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._token_lock = threading.Lock()
+
+    def get_access_token(self, *args, **kwargs):
+        with self._token_lock:
+            return super().get_access_token(*args, **kwargs)
+
 
-def establish_api() -> spotipy.client.Spotify:
+def make_requests_session(pool_size: int = SPOTIFY_POOL_SIZE) -> requests.Session:
+    """Creates a keep-alive HTTP session with a connection pool and retries on server errors
+
+    Keyword Arguments:
+        pool_size -- maximum number of connections kept open (default: {SPOTIFY_POOL_SIZE})
+
+    Returns:
+        a requests session
+    """
+    # urllib3 1.26 renamed method_whitelist to allowed_methods, and botocore of
+    # requirements.txt needs urllib3 older than 1.26
+    methods = frozenset(["GET", "POST"])
+    methods_argument = ({"allowed_methods": methods} if hasattr(Retry, "DEFAULT_ALLOWED_METHODS")
+                        else {"method_whitelist": methods})
+    retry = Retry(total=3, connect=3, read=3, backoff_factor=0.3,
+                  status_forcelist=(429, 500, 502, 503, 504), **methods_argument)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def establish_api(requests_session: Union[requests.Session, bool] = True,
+                  requests_timeout: float = SPOTIFY_TIMEOUT) -> spotipy.client.Spotify:
     """Establish an Spotify API client
 
+    Keyword Arguments:
+        requests_session -- HTTP session to send requests with, True for a new one (default: {True})
+        requests_timeout -- seconds to wait for a response (default: {SPOTIFY_TIMEOUT})
+
     Returns: an spotify api agent
 
     """
     cid = os.getenv("SPOTIPY_CLIENT_ID")
     secret = os.getenv("SPOTIPY_CLIENT_SECRET")
 
-    # establish a spotify api service
-
-    client_credentials_manager = SpotifyClientCredentials(
-        client_id=cid, client_secret=secret)
+    # newer spotipy versions write the token to a .cache file by default, which every
+    # process sharing the working directory would pick up: keep it in memory
+    cache_kwargs = {}
+    if hasattr(spotipy, "cache_handler"):
+        cache_kwargs["cache_handler"] = spotipy.cache_handler.MemoryCacheHandler()
 
+    # establish a spotify api service
     try:
+        client_credentials_manager = LockedClientCredentials(
+            client_id=cid, client_secret=secret, **cache_kwargs)
         sp_api = spotipy.Spotify(
-            client_credentials_manager=client_credentials_manager)
+            client_credentials_manager=client_credentials_manager,
+            requests_session=requests_session,
+            requests_timeout=requests_timeout)
+        # point the client to another server, e.g. the fake Spotify of the benchmarks
+        if os.getenv("SPOTIFY_TOKEN_URL"):
+            client_credentials_manager.OAUTH_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL")
+        if os.getenv("SPOTIFY_API_PREFIX"):
+            sp_api.prefix = os.getenv("SPOTIFY_API_PREFIX")
     except spotipy.oauth2.SpotifyOauthError as err:
         logger.error(
             "The configured client id and secret does not match. Please check them again!")
@@ -41,17 +115,44 @@ def establish_api() -> spotipy.client.Spotify:
     return sp_api
 
 
-def search_on_spotify(query: str) -> dict:
+def get_spotify_client(pool_size: int = SPOTIFY_POOL_SIZE,
+                       timeout: float = SPOTIFY_TIMEOUT) -> spotipy.client.Spotify:
+    """Returns the Spotify client shared by every request of this process,
+    creating it on the first call. The token and the HTTP connections are reused
+    across calls.
+
+    Keyword Arguments:
+        pool_size -- maximum number of connections kept open, used on the first call (default: {SPOTIFY_POOL_SIZE})
+        timeout -- seconds to wait for a response, used on the first call (default: {SPOTIFY_TIMEOUT})
+
+    Returns:
+        the shared spotify api agent
+    """
+    global _SHARED_API  # pylint: disable=global-statement
+    with _SHARED_API_LOCK:
+        if _SHARED_API is None:
+            _SHARED_API = establish_api(requests_session=make_requests_session(pool_size),
+                                        requests_timeout=timeout)
+            logger.info("Shared Spotify client created")
+        return _SHARED_API
+
+
+def search_on_spotify(query: str,
+                      sp_api: Optional[spotipy.client.Spotify] = None) -> dict:
     """A helper function that searches on Spotify with a given query
 
     Arguments:
         query -- the query to search on Spotify
 
+    Keyword Arguments:
+        sp_api -- the client to search with, the shared client if None (default: {None})
+
     Returns:
         a dictionary containing search results
     """
     try:
-        sp_api = establish_api()
+        if sp_api is None:
+            sp_api = get_spotify_client()
         search_results = sp_api.search(query, limit=1, offset=0, type="track")
         logger.info("The song %s has been searched", query)
     except spotipy.oauth2.SpotifyOauthError as err:
@@ -92,7 +193,140 @@ def form_query(song_name: str, artist_name: str) -> str:
     return song_to_search
 
 
-def get_song_features(song_name: str, artist_name: str) -> pd.DataFrame:
+def normalize_query(query: str) -> str:
+    """A helper function that normalizes a query so that equivalent searches share a cache entry
+
+    Arguments:
+        query -- the query formed by form_query()
+
+    Returns:
+        the query in lower case with single spaces
+    """
+    return " ".join(query.casefold().split())
+
+
+def search_track_id(query: str, sp_api: Optional[spotipy.client.Spotify] = None,
+                    cache: Optional[TTLCache] = None) -> Optional[str]:
+    """Searches for a track on Spotify and returns the id of the first result
+
+    Arguments:
+        query -- the query to search on Spotify
+
+    Keyword Arguments:
+        sp_api -- the client to search with, the shared client if None (default: {None})
+        cache -- cache of track ids keyed by the normalized query (default: {None})
+
+    Returns:
+        the Spotify id of the track, None if the search returns nothing
+    """
+    key = normalize_query(query)
+    if cache is not None:
+        track_id = cache.get(key)
+        if track_id is not MISSING:
+            logger.debug("Search for %s answered from cache", query)
+            return track_id
+
+    search_results = search_on_spotify(query, sp_api)
+    if search_results["tracks"]["total"] > 0:
+        track_id = search_results["tracks"]["items"][0]["id"]
+    else:
+        track_id = None
+    # searches that return nothing are cached as well
+    if cache is not None:
+        cache.set(key, track_id)
+    return track_id
+
+
+def get_audio_features(track_id: str, sp_api: Optional[spotipy.client.Spotify] = None,
+                       cache: Optional[TTLCache] = None) -> dict:
+    """Gets the audio features of a track from Spotify
+
+    Arguments:
+        track_id -- the Spotify id of the track
+
+    Keyword Arguments:
+        sp_api -- the client to query with, the shared client if None (default: {None})
+        cache -- cache of audio features keyed by track id (default: {None})
+
+    Returns:
+        a dictionary of audio features
+    """
+    if cache is not None:
+        features = cache.get(track_id)
+        if features is not MISSING:
+            logger.debug("Audio features of %s answered from cache", track_id)
+            return features
+
+    if sp_api is None:
+        sp_api = get_spotify_client()
+    features = sp_api.audio_features(tracks=track_id)[0]
+    if cache is not None:
+        cache.set(track_id, features)
+    return features
+
+
+def _audio_features_or_none(track_id: str, sp_api: spotipy.client.Spotify) -> Optional[dict]:
+    try:
+        return sp_api.audio_features(tracks=[track_id])[0]
+    except spotipy.SpotifyException as err:
+        if err.http_status != 400:
+            raise err
+        logger.warning("Spotify rejected the track id %s", track_id)
+        return None
+
+
+def get_audio_features_batch(track_ids: list[str],
+                             sp_api: Optional[spotipy.client.Spotify] = None,
+                             cache: Optional[TTLCache] = None) -> list[Optional[dict]]:
+    """Gets the audio features of many tracks, asking Spotify for up to
+    AUDIO_FEATURES_BATCH tracks per request
+
+    Arguments:
+        track_ids -- the Spotify ids of the tracks
+
+    Keyword Arguments:
+        sp_api -- the client to query with, the shared client if None (default: {None})
+        cache -- cache of audio features keyed by track id (default: {None})
+
+    Returns:
+        the audio features of each track in the given order, None for unknown tracks
+        and for ids Spotify rejects
+    """
+    found: dict = {}
+    if cache is not None:
+        for track_id in track_ids:
+            features = cache.get(track_id)
+            if features is not MISSING:
+                found[track_id] = features
+    # each missing track is fetched once even if it is asked for several times
+    missing = list(dict.fromkeys(tid for tid in track_ids if tid not in found))
+
+    if missing and sp_api is None:
+        sp_api = get_spotify_client()
+    for start in range(0, len(missing), AUDIO_FEATURES_BATCH):
+        batch = missing[start:start + AUDIO_FEATURES_BATCH]
+        try:
+            batch_features = sp_api.audio_features(tracks=batch)
+        except spotipy.SpotifyException as err:
+            if err.http_status != 400:
+                raise err
+            # one malformed id fails the whole request: ask for the tracks one by one
+            logger.warning("Spotify rejected a batch of audio features, fetching %d "
+                           "tracks one by one", len(batch))
+            batch_features = [_audio_features_or_none(track_id, sp_api) for track_id in batch]
+        for track_id, features in zip(batch, batch_features):
+            found[track_id] = features
+            if cache is not None:
+                cache.set(track_id, features)
+    logger.info("Audio features of %d tracks fetched, %d from Spotify",
+                len(track_ids), len(missing))
+    return [found[track_id] for track_id in track_ids]
+
+
+def get_song_features(song_name: str, artist_name: str,
+                      sp_api: Optional[spotipy.client.Spotify] = None,
+                      search_cache: Optional[TTLCache] = None,
+                      features_cache: Optional[TTLCache] = None) -> pd.DataFrame:
     """Get the features for a song. If the search returns nothing,
     then returns an empty dataframe.
 
@@ -100,6 +334,11 @@ def get_song_features(song_name: str, artist_name: str) -> pd.DataFrame:
         song_name -- the song name to be searched for
         artist_name -- the artist of the song to be searched for
 
+    Keyword Arguments:
+        sp_api -- the client to search with, the shared client if None (default: {None})
+        search_cache -- cache of track ids keyed by the normalized query (default: {None})
+        features_cache -- cache of audio features keyed by track id (default: {None})
+
     Returns:
         A dataframe containing the features of the song (one row)
 
@@ -107,17 +346,15 @@ def get_song_features(song_name: str, artist_name: str) -> pd.DataFrame:
         spotipy.exceptions.SpotifyException
         KeyError
     """
-    sp_api = establish_api()
     # form the query
     song_to_search = form_query(song_name, artist_name)
 
     # use spotipy to search for the song
-    search_results = search_on_spotify(song_to_search)
+    song_id = search_track_id(song_to_search, sp_api, search_cache)
 
     # in case the search results returned nothing
-    if search_results["tracks"]["total"] > 0:
-        song_id = search_results["tracks"]["items"][0]["id"]
-        res = [sp_api.audio_features(tracks=song_id)[0]]
+    if song_id is not None:
+        res = [get_audio_features(song_id, sp_api, features_cache)]
         # transform list of song features to a dataframe that contains one row - pertaining to the song
         df = pd.DataFrame.from_records(res, index=[0]*len(res))
         logger.info("%d song has been returned.", len(res))
@@ -159,9 +396,39 @@ def valid_features(sub_features: list[str], all_features: list[str]) -> bool:
     return True
 
 
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalizes each row of a matrix, leaving all-zero rows as they are
+    (the same convention as sklearn's cosine_similarity)
+
+    Arguments:
+        matrix -- a 2d array
+
+    Returns:
+        a new array with rows of unit length
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def cosine_similarity(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Computes the cosine similarity of every row of a matrix with every row of another,
+    as sklearn.metrics.pairwise.cosine_similarity does, so that scoring needs numpy only
+
+    Arguments:
+        left -- (n, n_features) array
+        right -- (m, n_features) array, of the same numeric type
+
+    Returns:
+        (n, m) similarities, in the numeric type of the inputs
+    """
+    return normalize_rows(left) @ normalize_rows(right).T
+
+
 def get_closest_cluster(df_song: pd.DataFrame,
                         centroids: pd.DataFrame,
-                        features: list[str]) -> Union[list[int], int]:
+                        features: list[str],
+                        precision: str = "float64") -> Union[list[int], int]:
     """Based on the selected features, choose the clusters with a centroid closest to the song provided.
 
     Arguments:
@@ -169,8 +436,13 @@ def get_closest_cluster(df_song: pd.DataFrame,
         centroids -- the datafram containing info about centroids
         features -- the features to use when calculating distance
 
+    Keyword Arguments:
+        precision -- numeric type the similarities are computed in, `float64` or `float32`
+            (default: {"float64"})
+
     Raises:
         KeyError -- Nonexisting features
+        ValueError -- unknown precision
 
     Returns:
         if df_song contains only one song, returns the closest clusterId
@@ -181,18 +453,56 @@ def get_closest_cluster(df_song: pd.DataFrame,
         raise KeyError("Nonexisting feature")
 
     # calculate distance between the song and each cluster
-    dist = cosine_similarity(df_song[features], centroids[features])
+    dtype = numeric_type(precision)
+    dist = cosine_similarity(df_song[features].to_numpy(dtype=dtype),
+                             centroids[features].to_numpy(dtype=dtype))
     logger.debug(dist)
 
     # if only one song, return the cluster with the closest centroid
     if df_song.shape[0] == 1:
-        return int(centroids.loc[np.argmax(dist, axis=-1), "clusterId"])
+        return int(centroids.loc[np.argmax(dist, axis=-1), "clusterId"].iloc[0])
     return centroids.loc[np.argmax(dist, axis=-1), "clusterId"].to_list()
 
 
+def get_closest_clusters(df_song: pd.DataFrame,
+                         centroids: pd.DataFrame,
+                         features: list[str],
+                         nprobe: int,
+                         precision: str = "float64") -> list[list[int]]:
+    """Based on the selected features, choose the nprobe clusters with centroids closest to each song.
+
+    Arguments:
+        df_song -- dataframe of songs including their features
+        centroids -- the datafram containing info about centroids
+        features -- the features to use when calculating distance
+        nprobe -- the number of clusters to return for each song
+
+    Keyword Arguments:
+        precision -- numeric type the similarities are computed in, `float64` or `float32`
+            (default: {"float64"})
+
+    Raises:
+        KeyError -- Nonexisting features
+        ValueError -- unknown precision
+
+    Returns:
+        for each song, a list of clusterIds with the closest first
+    """
+    if not (valid_features(features, df_song.columns) and valid_features(features, centroids.columns)):
+        logger.error("The features selected is not an available song feature!")
+        raise KeyError("Nonexisting feature")
+
+    dtype = numeric_type(precision)
+    dist = cosine_similarity(df_song[features].to_numpy(dtype=dtype),
+                             centroids[features].to_numpy(dtype=dtype))
+    order = np.argsort(-dist, axis=-1, kind="stable")[:, :max(nprobe, 1)]
+    cluster_ids = centroids["clusterId"].to_numpy()
+    return cluster_ids[order].tolist()
+
+
 def get_top_n_closest_song(df_song: pd.DataFrame, df_anime: pd.DataFrame,
                            features: list[str], top_n: int,
-                           cluster_id: int) -> list[dict]:
+                           cluster_id: int, precision: str = "float64") -> list[dict]:
     """Select the top N closest song to the given song
 
     Arguments:
@@ -202,6 +512,10 @@ def get_top_n_closest_song(df_song: pd.DataFrame, df_anime: pd.DataFrame,
         top_n -- number of songs to find
         cluster_id -- the cluster to look into
 
+    Keyword Arguments:
+        precision -- numeric type the similarities are computed in, `float64` or `float32`
+            (default: {"float64"})
+
     Returns:
         a list of records containing info about the found closest songs
     """
@@ -212,7 +526,9 @@ def get_top_n_closest_song(df_song: pd.DataFrame, df_anime: pd.DataFrame,
     # select the rows that correspond to the given cluster id
     df_anime = df_anime[df_anime["clusterId"]
                         == cluster_id].reset_index(drop=True)
-    dist = cosine_similarity(df_song[features], df_anime[features])
+    dtype = numeric_type(precision)
+    dist = cosine_similarity(df_song[features].to_numpy(dtype=dtype),
+                             df_anime[features].to_numpy(dtype=dtype))
     inds = np.argpartition(dist, -top_n, axis=-1)
 
     return df_anime.loc[inds[0][-top_n:]].to_dict("records")
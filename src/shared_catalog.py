@@ -0,0 +1,168 @@
+"""
+Share the in-memory catalog (similarity index and title index) between the worker
+processes of a server: it is built once per catalog version, written to a bundle file
+and memory-mapped read-only by every worker, so workers share one copy of the matrix
+"""
+import glob
+import logging
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.bundle import load_bundle, save_bundle
+from src.catalog_lookup import TitleIndex
+from src.preprocessing import numeric_type
+from src.song_index import SongIndex
+from src.song_manager import SongManager
+
+logger = logging.getLogger(__name__)
+
+Catalog = tuple[SongIndex, TitleIndex]
+# prefixes of the arrays of the similarity index and of the title index in a bundle
+CATALOG_PREFIXES = ["index", "titles"]
+
+
+def build_catalog(df_songs: pd.DataFrame, features: list[str],
+                  precision: str = "float32") -> Catalog:
+    """Builds the in-memory search structures from the songs table
+
+    Arguments:
+        df_songs -- songs as stored in the songs table
+        features -- the features to compute similarity on
+
+    Keyword Arguments:
+        precision -- numeric type of the similarity matrix, `float32` or `float64`
+            (default: {"float32"})
+
+    Returns:
+        the similarity index and the title index of the catalog
+    """
+    return (SongIndex.from_dataframe(df_songs, features, dtype=numeric_type(precision)),
+            TitleIndex.from_dataframe(df_songs, features))
+
+
+def catalog_path(directory: str, version: int) -> str:
+    """Returns the path of the file holding a version of the catalog"""
+    return os.path.join(directory, f"catalog.v{version}.bin")
+
+
+def catalog_arrays(catalog: Catalog) -> tuple[dict[str, np.ndarray], dict]:
+    """Returns the arrays and attributes of both indexes, prefixed with `index.` and `titles.`
+
+    Arguments:
+        catalog -- the similarity index and the title index
+
+    Returns:
+        name -> array
+        the attributes of the indexes
+    """
+    arrays = {}
+    attrs = {}
+    for prefix, index in zip(CATALOG_PREFIXES, catalog):
+        index_arrays, attrs[prefix] = index.to_arrays()
+        arrays.update({f"{prefix}.{name}": array for name, array in index_arrays.items()})
+    return arrays, attrs
+
+
+def catalog_from_arrays(arrays: dict[str, np.ndarray], attrs: dict) -> Catalog:
+    """Rebuilds both indexes from the arrays returned by catalog_arrays(), without copies
+
+    Arguments:
+        arrays -- name -> array, e.g. memory-mapped by load_bundle()
+        attrs -- attributes holding those returned by catalog_arrays()
+
+    Returns:
+        the similarity index and the title index
+    """
+    res = []
+    for prefix, index_cls in zip(CATALOG_PREFIXES, [SongIndex, TitleIndex]):
+        index_arrays = {name[len(prefix) + 1:]: array for name, array in arrays.items()
+                        if name.startswith(f"{prefix}.")}
+        res.append(index_cls.from_arrays(index_arrays, attrs[prefix]))
+    return res[0], res[1]
+
+
+def save_catalog(path: str, catalog: Catalog, version: int) -> None:
+    """Writes the catalog to a bundle file
+
+    Arguments:
+        path -- the path of the file to write
+        catalog -- the similarity index and the title index
+        version -- the catalog version they were built from
+    """
+    arrays, attrs = catalog_arrays(catalog)
+    attrs["version"] = version
+    save_bundle(path, arrays, attrs)
+
+
+def load_catalog(path: str, mmap: bool = True) -> Catalog:
+    """Reads a catalog written by save_catalog()
+
+    Arguments:
+        path -- the path of the file
+
+    Keyword Arguments:
+        mmap -- map the arrays instead of reading them into memory (default: {True})
+
+    Returns:
+        the similarity index and the title index
+    """
+    arrays, attrs = load_bundle(path, mmap=mmap)
+    catalog = catalog_from_arrays(arrays, attrs)
+    logger.info("Catalog version %d with %d songs mapped from %s",
+                attrs["version"], len(catalog[0]), path)
+    return catalog
+
+
+def load_shared_catalog(directory: str, version: int,
+                        builder: typing.Callable[[], Catalog]) -> Catalog:
+    """Maps the file of a catalog version, building and writing it first if no other
+    process has. Files of older versions are removed (processes still mapping them
+    keep their pages until they reload), files of newer versions are kept in case
+    another process built one meanwhile.
+
+    Arguments:
+        directory -- the directory shared by the workers
+        version -- the current catalog version
+        builder -- function without arguments that builds the catalog from the database
+
+    Returns:
+        the similarity index and the title index, memory-mapped
+    """
+    path = catalog_path(directory, version)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        save_catalog(path, builder(), version)
+        for old_path in glob.glob(os.path.join(directory, "catalog.v*.bin")):
+            old_version = os.path.basename(old_path)[len("catalog.v"):-len(".bin")]
+            if old_version.isdigit() and int(old_version) < version:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    # removed by another process
+                    pass
+    return load_catalog(path)
+
+
+def prepare_shared_catalog(engine_string: str, features: list[str], directory: str,
+                           precision: str = "float32") -> None:
+    """Writes the file of the current catalog version before the workers start,
+    so that they map it instead of building it
+
+    Arguments:
+        engine_string -- SQLAlchemy connection URI of the database
+        features -- the features to compute similarity on
+        directory -- the directory shared by the workers
+
+    Keyword Arguments:
+        precision -- numeric type of the similarity matrix, `float32` or `float64`
+            (default: {"float32"})
+    """
+    song_manager = SongManager(engine_string=engine_string)
+    try:
+        load_shared_catalog(directory, song_manager.get_catalog_version(),
+                            lambda: build_catalog(song_manager.get_songs(), features, precision))
+    finally:
+        song_manager.close()
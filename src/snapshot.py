@@ -0,0 +1,174 @@
+"""
+Export everything the app needs to serve recommendations (cluster centroids, scaler
+parameters, the normalized feature matrix grouped by cluster and the song metadata)
+to one versioned bundle file, so that the app boots from it without reading the database
+"""
+import datetime
+import hashlib
+import logging
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.bundle import load_bundle, save_bundle
+from src.catalog_lookup import TitleIndex
+from src.preprocessing import validate_features
+from src.shared_catalog import build_catalog, catalog_arrays, catalog_from_arrays
+from src.song_index import SongIndex, as_python
+
+if typing.TYPE_CHECKING:  # the scaler is only written, loading a snapshot needs no sklearn
+    from sklearn.preprocessing import StandardScaler
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+
+def content_version(df_songs: pd.DataFrame, features: list[str]) -> int:
+    """Computes a version that changes whenever the songs, their features or clusters change
+
+    Arguments:
+        df_songs -- the clustered songs
+        features -- the features served
+
+    Returns:
+        a positive integer
+    """
+    digest = hashlib.sha256()
+    digest.update("\n".join(df_songs["track_uri"].astype(str)).encode("utf-8"))
+    digest.update(np.ascontiguousarray(df_songs[features].to_numpy(dtype=np.float64)).tobytes())
+    digest.update(np.ascontiguousarray(df_songs["clusterId"].to_numpy(dtype=np.int64)).tobytes())
+    return int(digest.hexdigest()[:12], 16)
+
+
+class Snapshot:
+    """Everything needed to serve recommendations, loaded from a snapshot file.
+
+    Args:
+        song_index (SongIndex): normalized features of the songs grouped by cluster
+        title_index (TitleIndex): titles of the songs
+        centroids (pd.DataFrame): clusterId column and the average of each feature per cluster
+        scaler_mean (np.ndarray): mean of each scaled column, None without a scaler
+        scaler_scale (np.ndarray): scale of each scaled column, None without a scaler
+        attrs (dict): version, creation time, features and scaled columns of the snapshot
+    """
+
+    def __init__(self, song_index: SongIndex, title_index: TitleIndex,
+                 centroids: pd.DataFrame, scaler_mean: typing.Optional[np.ndarray],
+                 scaler_scale: typing.Optional[np.ndarray], attrs: dict):
+        self.song_index = song_index
+        self.title_index = title_index
+        self.centroids = centroids
+        self.scaler_mean = scaler_mean
+        self.scaler_scale = scaler_scale
+        self.attrs = attrs
+
+    @property
+    def version(self) -> int:
+        """The version of the catalog the snapshot was built from"""
+        return self.attrs["version"]
+
+    @property
+    def features(self) -> list[str]:
+        """The features the similarity is computed on"""
+        return self.attrs["features"]
+
+    def first_songs(self, n_songs: int) -> list[dict]:
+        """Returns the metadata of the songs with the lowest ids, as listed on the index page
+
+        Arguments:
+            n_songs -- number of songs to return
+
+        Returns:
+            a list of records ordered by id
+        """
+        metadata = self.song_index.metadata
+        rows = np.argsort(metadata["id"], kind="stable")[:n_songs]
+        return [{col: as_python(values[row]) for col, values in metadata.items()}
+                for row in rows]
+
+
+def save_snapshot(df_songs: pd.DataFrame, features: list[str], output_path: str,
+                  scaler: typing.Optional["StandardScaler"] = None,
+                  precision: str = "float32") -> int:
+    """Builds the serving snapshot of the clustered songs and writes it to a file
+
+    Arguments:
+        df_songs -- the clustered songs, as ingested into the songs table
+        features -- the features to compute similarity on
+        output_path -- the path of the snapshot file to write
+
+    Keyword Arguments:
+        scaler -- the scaler fitted by the featurize step, stored if given (default: {None})
+        precision -- numeric type of the similarity matrix, `float32` or `float64`.
+            The few centroids are kept in float64 (default: {"float32"})
+
+    Raises:
+        KeyError -- Nonexisting features
+        ValueError -- unknown precision
+
+    Returns:
+        the version of the snapshot
+    """
+    if not validate_features(df_songs, features + ["clusterId", "title", "track_uri"]):
+        logger.error("The features selected is not an available song feature!")
+        raise KeyError("Nonexisting feature")
+    if "id" not in df_songs.columns:
+        # the ids the songs get when ingested into an empty songs table
+        df_songs = df_songs.assign(id=np.arange(1, len(df_songs) + 1))
+
+    arrays, attrs = catalog_arrays(build_catalog(df_songs, features, precision))
+    # the same averages as SongManager.get_centroids() computes in the database
+    centroids = df_songs.groupby("clusterId")[features].mean()
+    arrays["centroids.clusterId"] = centroids.index.to_numpy(dtype=np.int64)
+    arrays["centroids.values"] = centroids.to_numpy(dtype=np.float64)
+    if scaler is not None:
+        arrays["scaler.mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+        arrays["scaler.scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+        attrs["scaler"] = {"columns": [str(col) for col in
+                                       getattr(scaler, "feature_names_in_", [])]}
+
+    version = content_version(df_songs, features)
+    attrs.update({"snapshot_format": SNAPSHOT_FORMAT, "version": version,
+                  "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                  "features": list(features), "n_songs": len(df_songs)})
+    try:
+        save_bundle(output_path, arrays, attrs)
+    except FileNotFoundError as err:
+        logger.error("Path does not exist at %s", output_path)
+        raise err
+    logger.info("Snapshot version %d of %d songs saved to %s",
+                version, len(df_songs), output_path)
+    return version
+
+
+def load_snapshot(path: str, mmap: bool = True) -> Snapshot:
+    """Loads a snapshot written by save_snapshot(). The arrays are memory-mapped,
+    so loading does not depend on the size of the catalog.
+
+    Arguments:
+        path -- the path of the snapshot file
+
+    Keyword Arguments:
+        mmap -- map the arrays instead of reading them into memory (default: {True})
+
+    Raises:
+        ValueError -- the file is not a snapshot of a supported format
+
+    Returns:
+        the Snapshot
+    """
+    arrays, attrs = load_bundle(path, mmap=mmap)
+    if attrs.get("snapshot_format") != SNAPSHOT_FORMAT:
+        logger.error("%s is not a serving snapshot of format %d", path, SNAPSHOT_FORMAT)
+        raise ValueError(f"{path} is not a serving snapshot")
+
+    song_index, title_index = catalog_from_arrays(arrays, attrs)
+    centroids = pd.DataFrame(arrays["centroids.values"], columns=attrs["features"])
+    centroids.insert(0, "clusterId", arrays["centroids.clusterId"])
+    snapshot = Snapshot(song_index, title_index, centroids, arrays.get("scaler.mean"),
+                        arrays.get("scaler.scale"), attrs)
+    logger.info("Snapshot version %d of %d songs loaded from %s",
+                snapshot.version, len(song_index), path)
+    return snapshot
@@ -0,0 +1,365 @@
+"""
+Keep the features of all anime songs in memory as one L2-normalized matrix grouped by cluster,
+so that finding the closest songs to a searched song is one matrix-vector product
+instead of a database query and a dataframe per request
+"""
+import logging
+import time
+import typing
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import validate_features
+from src.search_songs import get_closest_clusters, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+METADATA_COLUMNS = ["id", "title", "track_uri", "clusterId"]
+
+
+def as_python(value: typing.Any) -> typing.Any:
+    """Converts numpy scalars to the matching python type, so that records can be rendered as JSON"""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def top_rows(sims: np.ndarray, top_n: int) -> np.ndarray:
+    """Returns the positions of the top N similarities, highest first
+
+    Arguments:
+        sims -- 1d array of similarities
+        top_n -- number of positions to return
+
+    Returns:
+        an array of at most top_n positions
+    """
+    top_n = min(top_n, sims.shape[0])
+    if top_n <= 0:
+        return np.array([], dtype=np.int64)
+    inds = np.argpartition(sims, -top_n)[-top_n:]
+    return inds[np.argsort(-sims[inds], kind="stable")]
+
+
+class SongIndex:
+    """Holds the normalized features of the catalog, sorted by cluster, with parallel metadata arrays.
+
+    The rows of cluster `cluster_ids[i]` are `matrix[offsets[i]:offsets[i + 1]]`, so each
+    cluster is a contiguous block and no filtering is needed at query time.
+
+    Args:
+        features (list[str]): names of the feature columns, in matrix column order
+        matrix (np.ndarray): (n_songs, n_features) L2-normalized features sorted by cluster
+        cluster_ids (np.ndarray): sorted unique cluster ids
+        offsets (np.ndarray): start row of each cluster, plus the total number of rows
+        metadata (dict): column name -> array of length n_songs, in matrix row order
+    """
+
+    def __init__(self, features: list[str], matrix: np.ndarray,
+                 cluster_ids: np.ndarray, offsets: np.ndarray,
+                 metadata: dict[str, np.ndarray]):
+        self.features = list(features)
+        self.matrix = matrix
+        self.cluster_ids = cluster_ids
+        self.offsets = offsets
+        self.metadata = metadata
+        self._positions = {int(cid): pos for pos, cid in enumerate(cluster_ids)}
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @classmethod
+    def from_dataframe(cls, df_songs: pd.DataFrame, features: list[str],
+                       dtype: typing.Any = np.float32) -> "SongIndex":
+        """Builds the index from a dataframe of songs with features and cluster ids
+
+        Arguments:
+            df_songs -- songs as stored in the songs table
+            features -- the features to compute similarity on
+
+        Keyword Arguments:
+            dtype -- numeric type of the feature matrix (default: {np.float32})
+
+        Raises:
+            KeyError -- Nonexisting features
+
+        Returns:
+            a SongIndex
+        """
+        if not validate_features(df_songs, features + ["clusterId"]):
+            logger.error("The features selected is not an available song feature!")
+            raise KeyError("Nonexisting feature")
+
+        # sort by cluster so that every cluster is a contiguous block of rows
+        df_sorted = df_songs.sort_values("clusterId", kind="stable")
+        labels = df_sorted["clusterId"].to_numpy(dtype=np.int64)
+        cluster_ids, starts = np.unique(labels, return_index=True)
+        offsets = np.append(starts, len(labels)).astype(np.int64)
+
+        matrix = normalize_rows(df_sorted[features].to_numpy(dtype=np.float64))
+        matrix = np.ascontiguousarray(matrix, dtype=dtype)
+        metadata = {col: df_sorted[col].to_numpy()
+                    for col in METADATA_COLUMNS if col in df_sorted.columns}
+        logger.info("Song index built with %d songs in %d clusters",
+                    len(labels), len(cluster_ids))
+        return cls(features, matrix, cluster_ids, offsets, metadata)
+
+    def append(self, df_new: pd.DataFrame) -> "SongIndex":
+        """Returns a new index with songs added to their clusters. Only the new songs are
+        normalized, the rows of the current index are copied as they are.
+
+        Arguments:
+            df_new -- the songs to add, with the features, clusterId and metadata columns
+
+        Raises:
+            KeyError -- Nonexisting features
+
+        Returns:
+            a SongIndex
+        """
+        if not validate_features(df_new, self.features + ["clusterId"]):
+            logger.error("The features selected is not an available song feature!")
+            raise KeyError("Nonexisting feature")
+
+        labels = np.concatenate([np.repeat(self.cluster_ids, np.diff(self.offsets)),
+                                 df_new["clusterId"].to_numpy(dtype=np.int64)])
+        # stable, so the current songs stay in front of the new songs of their cluster
+        order = np.argsort(labels, kind="stable")
+        cluster_ids, starts = np.unique(labels[order], return_index=True)
+        new_rows = normalize_rows(df_new[self.features].to_numpy(dtype=np.float64))
+        matrix = np.concatenate([self.matrix, new_rows.astype(self.matrix.dtype)])[order]
+        metadata = {col: np.concatenate([values, df_new[col].to_numpy()])[order]
+                    for col, values in self.metadata.items()}
+        logger.info("%d songs appended to the song index", len(df_new))
+        return SongIndex(self.features, matrix, cluster_ids,
+                         np.append(starts, len(labels)).astype(np.int64), metadata)
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """Returns the arrays and attributes of the index, e.g. to be written with save_bundle()
+
+        Returns:
+            name -> array, with text metadata as fixed-width strings
+            the attributes of the index
+        """
+        arrays = {"matrix": self.matrix, "cluster_ids": self.cluster_ids,
+                  "offsets": self.offsets}
+        for col, values in self.metadata.items():
+            arrays[f"metadata.{col}"] = values.astype(str) if values.dtype.hasobject else values
+        return arrays, {"features": self.features}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], attrs: dict) -> "SongIndex":
+        """Builds the index from the arrays returned by to_arrays(), without copying them
+
+        Arguments:
+            arrays -- name -> array, e.g. memory-mapped by load_bundle()
+            attrs -- the attributes returned by to_arrays()
+
+        Returns:
+            a SongIndex
+        """
+        metadata = {name.split(".", 1)[1]: values for name, values in arrays.items()
+                    if name.startswith("metadata.")}
+        return cls(attrs["features"], arrays["matrix"], arrays["cluster_ids"],
+                   arrays["offsets"], metadata)
+
+    def cluster_rows(self, cluster_id: int) -> slice:
+        """Returns the rows of the matrix that belong to a cluster
+
+        Arguments:
+            cluster_id -- the cluster to look up
+
+        Raises:
+            KeyError -- the cluster has no songs in the index
+
+        Returns:
+            a slice over the rows of the cluster
+        """
+        pos = self._positions[int(cluster_id)]
+        return slice(int(self.offsets[pos]), int(self.offsets[pos + 1]))
+
+    def records(self, rows: np.ndarray, scores: np.ndarray) -> list[dict]:
+        """Builds result records for the given rows
+
+        Arguments:
+            rows -- matrix rows to report
+            scores -- cosine similarity of each row
+
+        Returns:
+            a list of dictionaries with the metadata of each song and its similarity
+        """
+        res = []
+        for row, score in zip(rows, scores):
+            record = {col: as_python(values[row])
+                      for col, values in self.metadata.items()}
+            record["similarity"] = float(score)
+            res.append(record)
+        return res
+
+    def probe_rows(self, cluster_ids: typing.Union[int, list[int]]) -> list[slice]:
+        """Returns the rows of the clusters to search, skipping clusters without songs
+
+        Arguments:
+            cluster_ids -- one cluster or a list of clusters
+
+        Returns:
+            a list of slices over the matrix
+        """
+        if np.ndim(cluster_ids) == 0:
+            cluster_ids = [cluster_ids]
+        res = []
+        for cluster_id in cluster_ids:
+            try:
+                res.append(self.cluster_rows(cluster_id))
+            except KeyError:
+                logger.warning("Cluster %d has no songs in the index", cluster_id)
+        return res
+
+    def top_n(self, song_vector: np.ndarray, cluster_ids: typing.Union[int, list[int]],
+              top_n: int) -> list[dict]:
+        """Select the top N songs closest to the given song in terms of cosine similarity,
+        looking into one or several clusters
+
+        Arguments:
+            song_vector -- the (unnormalized) features of the song, in the order of `features`
+            cluster_ids -- the cluster (or list of clusters) to look into
+            top_n -- number of songs to find
+
+        Returns:
+            a list of records of the found songs, most similar first
+        """
+        query = normalize_rows(np.asarray(song_vector, dtype=np.float64).reshape(1, -1))
+        query = query[0].astype(self.matrix.dtype)
+        probed = self.probe_rows(cluster_ids)
+        if not probed:
+            return []
+
+        rows = np.concatenate([np.arange(rng.start, rng.stop) for rng in probed])
+        sims = np.concatenate([self.matrix[rng] @ query for rng in probed])
+        inds = top_rows(sims, top_n)
+        return self.records(rows[inds], sims[inds])
+
+    def top_n_batch(self, song_vectors: np.ndarray,
+                    cluster_ids: list[typing.Union[int, list[int]]],
+                    top_n: int) -> list[list[dict]]:
+        """Select the top N closest songs for many songs at once. The songs probing the
+        same cluster are scored together with one matrix product against that cluster.
+
+        Arguments:
+            song_vectors -- (n_songs, n_features) unnormalized features, in the order of `features`
+            cluster_ids -- the cluster (or list of clusters) to look into for each song
+            top_n -- number of songs to find for each song
+
+        Returns:
+            a list with, for each song, the records of the found songs, most similar first
+        """
+        queries = normalize_rows(np.asarray(song_vectors, dtype=np.float64).reshape(
+            len(cluster_ids), -1)).astype(self.matrix.dtype)
+        probes = [[probe] if np.ndim(probe) == 0 else list(probe) for probe in cluster_ids]
+
+        # group the songs by probed cluster
+        members: dict[int, list[int]] = {}
+        for pos, probe in enumerate(probes):
+            for cluster_id in probe:
+                members.setdefault(int(cluster_id), []).append(pos)
+
+        candidates: list[list[tuple]] = [[] for _ in probes]
+        for cluster_id, positions in members.items():
+            probed = self.probe_rows(cluster_id)
+            if not probed:
+                continue
+            rows = probed[0]
+            sims = queries[positions] @ self.matrix[rows].T
+            for pos, member_sims in zip(positions, sims):
+                candidates[pos].append((np.arange(rows.start, rows.stop), member_sims))
+
+        res = []
+        for found in candidates:
+            if not found:
+                res.append([])
+                continue
+            rows = np.concatenate([cand[0] for cand in found])
+            sims = np.concatenate([cand[1] for cand in found])
+            inds = top_rows(sims, top_n)
+            res.append(self.records(rows[inds], sims[inds]))
+        return res
+
+
+def measure_nprobe(index: SongIndex, centroids: pd.DataFrame, df_queries: pd.DataFrame,
+                   top_n: int, nprobe_values: list[int]) -> pd.DataFrame:
+    """Measures the recall and latency of the search for several numbers of probed clusters.
+    Recall is the share of the exact top N (searching every cluster) that is found.
+
+    Arguments:
+        index -- the song index to search
+        centroids -- the dataframe containing info about centroids
+        df_queries -- songs to search for, with the index features as columns
+        top_n -- number of songs to find for each query
+        nprobe_values -- the numbers of clusters to probe
+
+    Returns:
+        a dataframe with the nprobe, recall and mean latency per query in milliseconds
+    """
+    vectors = df_queries[index.features].to_numpy()
+    all_clusters = index.cluster_ids.tolist()
+    exact = [{rec["track_uri"] for rec in index.top_n(vector, all_clusters, top_n)}
+             for vector in vectors]
+
+    res = []
+    for nprobe in nprobe_values:
+        start = time.perf_counter()
+        probes = get_closest_clusters(df_queries, centroids, index.features, nprobe,
+                                      precision=index.matrix.dtype.name)
+        found = [index.top_n(vector, probe, top_n)
+                 for vector, probe in zip(vectors, probes)]
+        latency = (time.perf_counter() - start) / max(len(vectors), 1) * 1000
+        hits = sum(len(truth & {rec["track_uri"] for rec in recs})
+                   for truth, recs in zip(exact, found))
+        recall = hits / max(sum(len(truth) for truth in exact), 1)
+        logger.info("nprobe=%d: recall@%d=%.3f, %.3f ms per query",
+                    nprobe, top_n, recall, latency)
+        res.append({"nprobe": nprobe, "recall": recall, "latency_ms": latency})
+    return pd.DataFrame(res)
+
+
+def measure_precision(df_songs: pd.DataFrame, df_queries: pd.DataFrame,
+                      features: list[str], top_n: int, tolerance: float = 1e-6) -> dict:
+    """Checks that a float32 similarity matrix ranks the songs as the float64 one does,
+    searching the whole catalog. A song of the float32 top N missing from the float64
+    top N is only a disagreement if its float64 similarity is further than `tolerance`
+    below the N-th best one; within the tolerance it is a tie broken by rounding.
+
+    Arguments:
+        df_songs -- songs as stored in the songs table
+        df_queries -- songs to search for, with the features as columns
+        features -- the features to compute similarity on
+        top_n -- number of songs to find for each query
+
+    Keyword Arguments:
+        tolerance -- largest similarity difference treated as a tie (default: {1e-6})
+
+    Returns:
+        the share of the float64 top N found in float32, the largest similarity error,
+        the number of queries whose rankings disagree and whether all of them agree
+    """
+    matrix = normalize_rows(df_songs[features].to_numpy(dtype=np.float64))
+    matrix_32 = matrix.astype(np.float32)
+    queries = normalize_rows(df_queries[features].to_numpy(dtype=np.float64))
+    hits = 0
+    max_error = 0.0
+    n_disagree = 0
+    for query in queries:
+        sims = matrix @ query
+        sims_32 = matrix_32 @ query.astype(np.float32)
+        exact = top_rows(sims, top_n)
+        found = top_rows(sims_32, top_n)
+        hits += len(np.intersect1d(exact, found))
+        max_error = max(max_error, float(np.abs(sims_32 - sims).max(initial=0)))
+        if len(exact) and (sims[found] < sims[exact[-1]] - tolerance).any():
+            n_disagree += 1
+    recall = hits / max(len(queries) * min(top_n, len(matrix)), 1)
+    logger.info("float32 rankings: recall@%d=%.4f, max similarity error %.2e, "
+                "%d of %d queries disagree", top_n, recall, max_error, n_disagree, len(queries))
+    return {"recall": recall, "max_similarity_error": max_error,
+            "n_disagree": n_disagree, "agree": n_disagree == 0}
@@ -12,6 +12,8 @@ import sqlalchemy.orm
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.declarative import declarative_base
 
+from src.tables import read_table
+
 logger = logging.getLogger(__name__)
 
 Base: typing.Any = declarative_base()
@@ -62,6 +64,21 @@ class Songs(Base):
         return f"<Song {self.title} {self.track_uri}>"
 
 
+class CatalogVersion(Base):
+    """Creates a data model holding a single counter that is bumped whenever songs
+    are ingested, so that anything cached from the songs table knows when to reload.
+    """
+
+    __tablename__ = "catalog_version"
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    version = sqlalchemy.Column(sqlalchemy.Integer, unique=False,
+                                nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CatalogVersion {self.version}>"
+
+
 class SongManager:
     """Creates a SQLAlchemy connection to the songs table.
 
@@ -85,6 +102,129 @@ class SongManager:
             raise ValueError(
                 "Need either an engine string or a Flask app to initialize")
 
+    def read_query(self, statement: typing.Any) -> pd.DataFrame:
+        """Runs a select statement and returns the result as a dataframe
+
+        Arguments:
+            statement -- a SQLAlchemy selectable, e.g. `session.query(...).statement`
+
+        Returns:
+            a dataframe with one column per selected field
+        """
+        # run through the connection so that ORM entities come back as plain columns
+        result = self.session.connection().execute(statement)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    def get_songs(self) -> pd.DataFrame:
+        """Reads all songs in the songs table
+
+        Returns:
+            a dataframe with one row per song
+        """
+        songs = self.read_query(self.session.query(Songs).statement)
+        logger.info("%d songs are read from the database", len(songs))
+        return songs
+
+    def get_songs_after(self, song_id: int) -> pd.DataFrame:
+        """Reads the songs added after a song, e.g. to extend an index built from get_songs()
+
+        Arguments:
+            song_id -- the largest id already read
+
+        Returns:
+            a dataframe with one row per song whose id is larger, ordered by id
+        """
+        return self.read_query(self.session.query(Songs).filter(Songs.id > song_id)
+                               .order_by(Songs.id).statement)
+
+    def count_songs(self) -> int:
+        """Returns the number of songs in the songs table"""
+        return self.session.query(sqlalchemy.func.count(Songs.id)).scalar()
+
+    def get_cluster_sizes(self) -> pd.Series:
+        """Counts the songs of each cluster
+
+        Returns:
+            number of songs indexed by clusterId
+        """
+        sizes = self.read_query(self.session.query(
+            Songs.clusterId, sqlalchemy.func.count(Songs.id).label("n_songs")
+        ).group_by(Songs.clusterId).statement)
+        return sizes.set_index("clusterId")["n_songs"]
+
+    def get_existing_track_uris(self, track_uris: list[str]) -> set[str]:
+        """Returns which of the given songs are already in the songs table
+
+        Arguments:
+            track_uris -- Spotify uris of the songs to look up
+
+        Returns:
+            the uris found in the table
+        """
+        found = set()
+        # bounded IN lists, as databases limit the number of parameters of a statement
+        for start in range(0, len(track_uris), 500):
+            chunk = list(track_uris[start:start + 500])
+            found.update(uri for uri, in self.session.query(Songs.track_uri)
+                         .filter(Songs.track_uri.in_(chunk)))
+        return found
+
+    def get_centroids(self, features: list[str]) -> pd.DataFrame:
+        """Computes the centroid of each cluster as the average of its songs' features
+
+        Arguments:
+            features -- the song features to average
+
+        Returns:
+            a dataframe with a clusterId column and one column per feature
+        """
+        query = self.session.query(
+            Songs.clusterId,
+            *[sqlalchemy.func.avg(getattr(Songs, fea)).label(fea)
+              for fea in features]
+        ).group_by(Songs.clusterId).statement
+        centroids = self.read_query(query)
+        logger.info("Centroids of %d clusters are computed", len(centroids))
+        return centroids
+
+    def get_catalog_version(self) -> int:
+        """Returns the current version of the songs table
+
+        Returns:
+            the version number, 0 if the table has never been ingested into
+        """
+        try:
+            record = self.session.query(CatalogVersion).get(1)
+        except sqlalchemy.exc.DatabaseError:
+            # databases created before the version table existed
+            self.session.rollback()
+            logger.warning("No catalog_version table found. "
+                           "Run `run_rds.py create` to add it.")
+            return 0
+        if record is None:
+            return 0
+        return record.version
+
+    def bump_catalog_version(self) -> int:
+        """Increments the version of the songs table after an ingestion
+
+        Returns:
+            the new version number
+        """
+        version = self._increment_catalog_version()
+        self.session.commit()
+        logger.info("Catalog version is now %d", version)
+        return version
+
+    def _increment_catalog_version(self) -> int:
+        # left uncommitted, so that it is part of the transaction of the ingestion
+        record = self.session.query(CatalogVersion).get(1)
+        if record is None:
+            record = CatalogVersion(id=1, version=0)
+            self.session.add(record)
+        record.version += 1
+        return record.version
+
     def close(self) -> None:
         """Closes SQLAlchemy session
 
@@ -107,6 +247,7 @@ class SongManager:
         song = Songs(**kwargs)
         session.add(song)
         session.commit()
+        self.bump_catalog_version()
         try:
             title = kwargs["title"]
             logger.info("A song called %s is added to database", title)
@@ -114,16 +255,27 @@ class SongManager:
             logger.error("The input song features do not contain 'title'")
 
     def add_songs_from_csv(self, data_path: str) -> None:
-        """Reads songs from a csv file and add them to the database
+        """Reads songs from a csv (or parquet) file and add them to the database
 
         Arguments:
-            data_path -- the path to the csv file to read
+            data_path -- the path to the csv or parquet file to read
+        """
+        self.add_songs(read_table(data_path))
+
+    def add_songs(self, df_songs: pd.DataFrame) -> int:
+        """Adds songs to the database and bumps the catalog version once, in one transaction
+
+        Arguments:
+            df_songs -- one row per song, with one column per column of the songs table
+
+        Returns:
+            the number of songs added, 0 if they could not be added
         """
 
         session = self.session
 
         # transform the dataframe to a dictionary for convenience
-        data_list = pd.read_csv(data_path).to_dict(orient="records")
+        data_list = df_songs.to_dict(orient="records")
         persist_list = []
 
         # prepare data to persist into the database
@@ -133,27 +285,33 @@ class SongManager:
         logger.debug("%d records are prepared to be persisted",
                      len(persist_list))
 
-        # add all songs to the database
+        # add all songs to the database, with the new catalog version
         try:
             session.add_all(persist_list)
+            version = self._increment_catalog_version()
             session.commit()
         except sqlite3.OperationalError as err:
+            session.rollback()
             logger.error(
                 "Error page returned. Not able to add song to local sqlite "
                 "Are you offering the right database path? Error: %s ",
                 err)
         except sqlalchemy.exc.OperationalError as err:
+            session.rollback()
             logger.error(
                 "Error page returned. Not able to add song to MySQL database.  "
                 "Please check engine string and VPN. \n Error: %s ", err)
         except sqlalchemy.exc.IntegrityError:
+            session.rollback()
             my_message = ("Have you already inserted the same record into the database before? \n"
                           "This database does not allow duplicate in the input-recommendation pair")
             logger.error("%s \n The original error message is: ",
                          my_message, exc_info=True)
         else:
-            logger.info("%d songs have been added to the database!",
-                        len(persist_list))
+            logger.info("%d songs have been added to the database, catalog version is now %d",
+                        len(persist_list), version)
+            return len(persist_list)
+        return 0
 
 
 def create_db(engine_string: str) -> None:
@@ -0,0 +1,250 @@
+"""
+Read and write the tables passed between the pipeline stages, as csv or as parquet
+depending on the extension of the path. Parquet files are written with an explicit
+schema (float32 features, narrow integers, string metadata), so that the next stage
+reads typed columns instead of parsing text.
+"""
+import io
+import logging
+import os
+import typing
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # parquet support is optional
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_EXTENSIONS = [".parquet", ".pq"]
+# integer columns stored narrower than int64, the other integers stay int64
+INTEGER_TYPES = {"key": np.int8, "mode": np.int8, "time_signature": np.int8,
+                 "clusterId": np.int16, "id": np.int32, "duration": np.int32}
+
+
+def is_parquet(path: str) -> bool:
+    """Returns whether a table path has a parquet extension"""
+    return os.path.splitext(path)[1].lower() in PARQUET_EXTENSIONS
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        logger.error("pyarrow is needed to read and write parquet files, "
+                     "install it with `pip install pyarrow`")
+        raise ImportError("pyarrow is not installed")
+
+
+def arrow_schema(df: pd.DataFrame) -> "pyarrow.Schema":
+    """Returns the parquet schema of a table: floats as float32, known integer columns
+    as narrower integers, the other integers as int64 and text as strings. The known
+    integer columns take their declared type when they hold floats without a fraction,
+    as a missing value turns an integer column into floats: it is then written as a null.
+    Once scaled, they hold fractions and are stored as float32.
+
+    Arguments:
+        df -- the table, or a chunk of it
+
+    Returns:
+        the schema of the parquet file
+    """
+    _require_pyarrow()
+    fields = []
+    for col, dtype in df.dtypes.items():
+        if col in INTEGER_TYPES and _holds_integers(df[col]):
+            arrow_type = pyarrow.from_numpy_dtype(INTEGER_TYPES[col])
+        elif pd.api.types.is_float_dtype(dtype):
+            arrow_type = pyarrow.float32()
+        elif pd.api.types.is_integer_dtype(dtype):
+            arrow_type = pyarrow.int64()
+        elif pd.api.types.is_string_dtype(dtype):
+            arrow_type = pyarrow.string()
+        else:
+            arrow_type = pyarrow.Schema.from_pandas(df[[col]].head(0),
+                                                    preserve_index=False).field(col).type
+        fields.append(pyarrow.field(col, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def _holds_integers(column: pd.Series) -> bool:
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return True
+    if not pd.api.types.is_float_dtype(column.dtype):
+        return False
+    values = column.dropna().to_numpy()
+    return bool((values == np.round(values)).all())
+
+
+def _to_arrow(df: pd.DataFrame, schema: "pyarrow.Schema") -> "pyarrow.Table":
+    # pyarrow casts the columns to the schema, a NaN in an integer column becomes a null
+    # while a fractional value raises instead of being truncated
+    return pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def read_table(path: str, columns: typing.Optional[list[str]] = None) -> pd.DataFrame:
+    """Reads a table written by a pipeline stage
+
+    Arguments:
+        path -- the path of a csv or parquet file
+
+    Keyword Arguments:
+        columns -- only read these columns, all of them if None (default: {None})
+
+    Returns:
+        a pandas dataframe
+    """
+    if is_parquet(path):
+        _require_pyarrow()
+        return pyarrow.parquet.read_table(path, columns=columns).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """Writes a table for the next pipeline stage
+
+    Arguments:
+        df -- the table to write
+        path -- the path of a csv or parquet file
+    """
+    if is_parquet(path):
+        _require_pyarrow()
+        pyarrow.parquet.write_table(_to_arrow(df, arrow_schema(df)), path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_table_chunks(path: str, chunk_size: int) -> typing.Iterator[pd.DataFrame]:
+    """Reads a table in chunks of rows, so that only one chunk is held in memory
+
+    Arguments:
+        path -- the path of a csv or parquet file
+        chunk_size -- number of rows per chunk
+
+    Returns:
+        an iterator over the chunks
+    """
+    if not is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+    _require_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def split_table(path: str, chunk_size: int) -> list[tuple[int, int]]:
+    """Splits a table into parts of about chunk_size rows that read_table_part() reads
+    independently, so that several processes can each read their own part. Parts of a
+    csv file are ranges of bytes cut at line ends (the rows must not hold line breaks
+    within quotes), parts of a parquet file are ranges of row groups.
+
+    Arguments:
+        path -- the path of a csv or parquet file
+        chunk_size -- number of rows per part, approximately
+
+    Returns:
+        the start and end of each part, in the order of the file
+    """
+    if is_parquet(path):
+        _require_pyarrow()
+        metadata = pyarrow.parquet.ParquetFile(path).metadata
+        parts = []
+        start, n_rows = 0, 0
+        for group in range(metadata.num_row_groups):
+            n_rows += metadata.row_group(group).num_rows
+            if n_rows >= chunk_size:
+                parts.append((start, group + 1))
+                start, n_rows = group + 1, 0
+        if start < metadata.num_row_groups:
+            parts.append((start, metadata.num_row_groups))
+        return parts
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.readline()
+        header_end = file.tell()
+        # bytes of chunk_size rows, estimated from the first rows
+        sample = file.read(1 << 20)
+        block = max(1, len(sample) * chunk_size // max(sample.count(b"\n"), 1))
+        parts = []
+        start = header_end
+        while start < size:
+            file.seek(start + block - 1)
+            file.readline()
+            end = min(file.tell(), size)
+            parts.append((start, end))
+            start = end
+    return parts
+
+
+def read_table_part(path: str, part: tuple[int, int]) -> pd.DataFrame:
+    """Reads one part of a table returned by split_table()
+
+    Arguments:
+        path -- the path of a csv or parquet file
+        part -- the start and end of the part
+
+    Returns:
+        a pandas dataframe of the rows of the part
+    """
+    start, end = part
+    if is_parquet(path):
+        _require_pyarrow()
+        return pyarrow.parquet.ParquetFile(path).read_row_groups(range(start, end)).to_pandas()
+    columns = pd.read_csv(path, nrows=0).columns
+    with open(path, "rb") as file:
+        file.seek(start)
+        return pd.read_csv(io.BytesIO(file.read(end - start)), header=None, names=columns)
+
+
+class TableWriter:
+    """Writes a table chunk by chunk, as csv or parquet depending on the extension.
+    The schema of a parquet file is that of arrow_schema() for the columns of its first
+    chunk, so a later chunk with a missing integer is written with a null.
+
+    Args:
+        path (str): the path of the file to write
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.n_rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+
+    def __enter__(self) -> "TableWriter":
+        if is_parquet(self.path):
+            _require_pyarrow()
+        else:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+        return self
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Appends a chunk of rows to the file"""
+        if self._file is not None:
+            df.to_csv(self._file, header=self.n_rows == 0, index=False)
+        else:
+            if self._writer is None:
+                self._schema = arrow_schema(df)
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(_to_arrow(df, self._schema))
+        self.n_rows += len(df)
+
+    def write_csv(self, text: str, n_rows: int) -> None:
+        """Appends rows already formatted as csv, e.g. by a worker process, to a csv file
+
+        Arguments:
+            text -- the rows, with the header if they are the first ones
+            n_rows -- number of rows in text
+        """
+        self._file.write(text)
+        self.n_rows += n_rows
+
+    def __exit__(self, *exc_info) -> None:
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
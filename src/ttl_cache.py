@@ -0,0 +1,169 @@
+"""
+A bounded in-memory cache whose entries expire after a time to live, optionally
+backed by a sqlite file so that cached Spotify lookups survive restarts
+"""
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+# returned by TTLCache.get() when a key is not cached, since None is a valid cached value
+MISSING = object()
+
+
+class TTLCache:
+    """Least-recently-used cache with a time to live and hit/miss counters.
+
+    Args:
+        max_size (int): maximum number of entries kept in memory
+        ttl (float): seconds after which an entry expires
+        path (str): path to a sqlite file to persist entries to. Optional.
+            Values must be JSON serializable when a path is given.
+        table (str): name of the table in the sqlite file, so several caches can share one file
+        commit_every (int): number of disk writes committed together
+        commit_interval (float): seconds after which pending disk writes are committed
+            by the next write, however few they are
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600,
+                 path: typing.Optional[str] = None, table: str = "cache",
+                 commit_every: int = 100, commit_interval: float = 5.0):
+        if max_size <= 0:
+            raise ValueError("max_size needs to be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.table = table
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db: typing.Optional[sqlite3.Connection] = None
+        # disk writes not committed yet, and when the last commit happened
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        if path is not None:
+            self._open(path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: typing.Any = MISSING) -> typing.Any:
+        """Returns the cached value of a key
+
+        Arguments:
+            key -- the key to look up
+
+        Keyword Arguments:
+            default -- returned when the key is not cached or has expired (default: {MISSING})
+
+        Returns:
+            the cached value or default
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                entry = self._read_disk(key)
+                if entry is not None and entry[0] > now:
+                    self._store(key, entry)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # expired
+                self._entries.pop(key, None)
+                self._delete_disk([key])
+            self.misses += 1
+            return default
+
+    def set(self, key: str, value: typing.Any) -> None:
+        """Caches a value under a key
+
+        Arguments:
+            key -- the key to store the value under
+            value -- the value to cache
+        """
+        entry = (time.time() + self.ttl, value)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(f"REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                                 (key, entry[0], json.dumps(value)))
+                self._pending += 1
+                if (self._pending >= self.commit_every
+                        or time.monotonic() - self._last_commit >= self.commit_interval):
+                    self._commit()
+
+    def flush(self) -> None:
+        """Commits the pending disk writes, e.g. before the process exits"""
+        with self._lock:
+            if self._db is not None:
+                self._commit()
+
+    def clear(self) -> None:
+        """Removes every entry, including those persisted to disk"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._commit()
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache
+
+        Returns:
+            a dictionary with the number of hits, misses, evictions and entries
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self._entries)}
+
+    def _store(self, key: str, entry: tuple) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.max_size:
+            evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += 1
+        self._delete_disk(evicted)
+
+    def _delete_disk(self, keys: list[str]) -> None:
+        if self._db is None or not keys:
+            return
+        self._db.executemany(f"DELETE FROM {self.table} WHERE key = ?",
+                             [(key,) for key in keys])
+        self._pending += len(keys)
+
+    def _commit(self) -> None:
+        # the rows not loaded in memory since the file was opened are not evicted by
+        # the LRU, keep the max_size most recently written ones
+        self._db.execute(f"DELETE FROM {self.table} WHERE key NOT IN "
+                         f"(SELECT key FROM {self.table} ORDER BY expires DESC LIMIT ?)",
+                         (self.max_size,))
+        self._db.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def _open(self, path: str) -> None:
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                         "(key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+        # drop what has expired since the last run
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (time.time(),))
+        self._commit()
+        logger.info("Cache table %s persisted to %s", self.table, path)
+
+    def _read_disk(self, key: str) -> typing.Optional[tuple]:
+        row = self._db.execute(f"SELECT expires, value FROM {self.table} WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
@@ -0,0 +1,244 @@
+""" Test the views of app.py, served on a synthetic catalog with a fake Spotify
+get_recommendations()
+get_entry()
+get_catalog_version()
+index()
+cached_response()
+lookup_title()
+metrics()
+"""
+import hashlib
+import importlib
+import logging
+import os
+import types
+
+import pytest
+
+import src.search_songs as search
+from benchmarks.fake_spotify import fake_track_id, spotify_environment, start_fake_spotify
+from benchmarks.synthetic_catalog import generate_catalog, write_catalog
+from src.neighbours import compute_neighbours, save_neighbours
+from src.search_songs import form_query
+from src.song_manager import SongManager
+
+FEATURES = ["danceability", "energy", "loudness", "speechiness", "acousticness",
+            "instrumentalness", "liveness", "valence", "tempo"]
+
+
+def logging_state() -> dict:
+    """Returns the configuration of the loggers, which importing the app replaces"""
+    loggers = [logging.getLogger()] + [logger for logger in
+                                       logging.root.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    return {logger: (logger.level, logger.disabled, logger.propagate, list(logger.handlers))
+            for logger in loggers}
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """Imports the app, configured with a catalog of 200 songs and a fake Spotify"""
+    workdir = tmp_path_factory.mktemp("app")
+    engine_string = f"sqlite:///{workdir / 'songs.db'}"
+    df_songs = generate_catalog(200, seed=1)
+    write_catalog(df_songs, engine_string)
+    save_neighbours(df_songs, *compute_neighbours(df_songs, FEATURES, k=20),
+                    output_path=str(workdir / "neighbours.npz"), features=FEATURES)
+    overrides = workdir / "overrides.py"
+    overrides.write_text(f"NEIGHBOURS_PATH = {str(workdir / 'neighbours.npz')!r}\n"
+                         "SPOTIFY_CACHE_PATH = None\nSLOW_REQUEST_SECONDS = None\n"
+                         "CATALOG_CHECK_INTERVAL = 0\n")
+    fake_spotify = start_fake_spotify()
+    state = logging_state()
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in spotify_environment(fake_spotify).items():
+            patch.setenv(name, value)
+        patch.setenv("SQLALCHEMY_DATABASE_URI", engine_string)
+        patch.setenv("FLASK_CONFIG_OVERRIDES", str(overrides))
+        patch.setattr(search, "_SHARED_API", None)
+        yield importlib.import_module("app")
+    fake_spotify.shutdown()
+    for logger in logging_state():
+        # the loggers the configuration created (e.g. src, until then a placeholder)
+        # are reset to their defaults
+        level, disabled, propagate, handlers = state.get(
+            logger, (logging.NOTSET, False, True, []))
+        logger.setLevel(level)
+        logger.disabled, logger.propagate, logger.handlers = disabled, propagate, handlers
+
+
+def test_recommendations_errors_per_song(app_module):
+    """Unit test - happy path - get_recommendations()
+    invalid songs get an error, the valid ones of the same batch are still answered
+    """
+    client = app_module.app.test_client()
+    response = client.post("/api/recommendations", json={"top_n": 3, "songs": [
+        {"track_id": "0123456789abcdefABCDEF"}, {"track_id": "not-a-track"}, "song"]})
+
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert len(results[0]["songs"]) == 3 and "error" not in results[0]
+    assert results[1]["error"] == "Invalid track id" and results[1]["songs"] == []
+    assert "error" in results[2]
+
+
+def test_recommendations_bool_top_n(app_module):
+    """Unit test - unhappy path - get_recommendations()
+    """
+    client = app_module.app.test_client()
+    response = client.post("/api/recommendations",
+                           json={"top_n": True, "songs": [{"track_id": "0" * 22}]})
+
+    assert response.status_code == 400
+
+
+def test_lookup_title_other_artist(app_module):
+    """Unit test - unhappy path - lookup_title()
+    a name starting a catalog title is not resolved locally when an artist is named,
+    as the song of that artist may be another one
+    """
+    assert app_module.lookup_title("synthetic song 12")["track_uri"].endswith("012")
+    assert app_module.lookup_title("synthetic song 12", "benchmark") is not None
+    assert app_module.lookup_title("Synthetic Song 1", "") is not None
+    assert app_module.lookup_title("synthetic song 1 ", "another artist") is not None
+    assert app_module.lookup_title("synthetic so") is not None
+    assert app_module.lookup_title("synthetic so", "another artist") is None
+
+    client = app_module.app.test_client()
+    response = client.post("/api/recommendations", json={"songs": [
+        {"song_name": "synthetic so", "artist": "another artist"}]})
+    # searched on Spotify instead
+    assert response.get_json()["results"][0]["track_id"] == fake_track_id(
+        form_query("synthetic so", "another artist"))
+
+
+def test_search_after_adding_songs(app_module):
+    """Unit test - happy path - get_entry()
+    songs added to the catalog are recommended for a catalog title, whose precomputed
+    neighbours and cached page were computed before they were added
+    """
+    client = app_module.app.test_client()
+    params = {"song_name": "synthetic song 7", "artist": "benchmark"}
+    before = client.get("/search", query_string=params)
+    assert before.status_code == 200
+    assert app_module.neighbours_cache.get() is not None
+
+    song_manager = SongManager(engine_string=app_module.app.config["SQLALCHEMY_DATABASE_URI"])
+    df_catalog = song_manager.get_songs()
+    df_new = df_catalog[df_catalog["title"] == "synthetic song 7"].drop(columns=["id"])
+    df_new = df_new.assign(title="added song", track_uri="spotify:track:added0000000000000000")
+    assert song_manager.add_songs(df_new) == 1
+    song_manager.close()
+
+    after = client.get("/search", query_string=params)
+    assert after.status_code == 200
+    assert b"added song" not in before.data and b"added song" in after.data
+    # the neighbours do not hold the added song, so every search is computed online
+    assert app_module.neighbours_cache.get() is None
+
+
+def test_neighbours_reloaded_when_recomputed(app_module):
+    """Unit test - happy path - catalog_version()
+    neighbours recomputed on the updated catalog are served again, under a new version
+    """
+    song_manager = SongManager(engine_string=app_module.app.config["SQLALCHEMY_DATABASE_URI"])
+    df_songs = song_manager.get_songs()
+    song_manager.close()
+    version = app_module.catalog_version()
+    path = app_module.app.config["NEIGHBOURS_PATH"]
+
+    save_neighbours(df_songs, *compute_neighbours(df_songs, FEATURES, k=20),
+                    output_path=path, features=FEATURES)
+    # a modification time distinct from that of the previous file
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+
+    assert app_module.neighbours_cache.get() is not None
+    assert app_module.catalog_version() not in (version, f"{app_module.catalog_cache.version}.0")
+
+
+def test_snapshot_dropped_after_update(app_module, monkeypatch):
+    """Unit test - happy path - get_catalog_version()
+    a snapshot is served until the songs table changes
+    """
+    song_manager = SongManager(engine_string=app_module.app.config["SQLALCHEMY_DATABASE_URI"])
+    database_version = song_manager.get_catalog_version()
+    monkeypatch.setattr(app_module, "snapshot", types.SimpleNamespace(version=123))
+    monkeypatch.setattr(app_module, "snapshot_database_version", database_version)
+
+    assert app_module.get_catalog_version() == 123
+    song_manager.bump_catalog_version()
+    song_manager.close()
+    assert app_module.get_catalog_version() == database_version + 1
+    assert app_module.snapshot is None
+
+
+def test_search_page_cached(app_module):
+    """Unit test - happy path - cached_response()
+    a search is rendered once, then answered from the cache with an ETag of the page,
+    or with an empty 304 when the client holds that page
+    """
+    client = app_module.app.test_client()
+    params = {"song_name": "synthetic song 5", "artist": "benchmark"}
+    first = client.get("/search", query_string=params)
+    stats = app_module.response_cache.stats()
+    second = client.get("/search", query_string=params)
+    posted = client.post("/search", data=params)
+
+    assert first.status_code == 200 and b"synthetic song" in first.data
+    assert first.headers["ETag"] == f'"{hashlib.sha1(first.data).hexdigest()}"'
+    assert first.headers["Cache-Control"] == "public, max-age=60"
+    assert second.data == first.data and posted.data == first.data
+    assert app_module.response_cache.stats()["hits"] == stats["hits"] + 2
+
+    not_modified = client.get("/search", query_string=params,
+                              headers={"If-None-Match": first.headers["ETag"]})
+    assert not_modified.status_code == 304 and not_modified.data == b""
+    assert not_modified.headers["ETag"] == first.headers["ETag"]
+
+
+def test_pages_rendered_after_version_bump(app_module):
+    """Unit test - happy path - cached_response()
+    a new catalog version renders the pages again
+    """
+    client = app_module.app.test_client()
+    params = {"song_name": "synthetic song 6", "artist": "benchmark"}
+    client.get("/")
+    client.get("/search", query_string=params)
+    misses = app_module.response_cache.stats()["misses"]
+
+    song_manager = SongManager(engine_string=app_module.app.config["SQLALCHEMY_DATABASE_URI"])
+    song_manager.bump_catalog_version()
+    song_manager.close()
+    index_page = client.get("/")
+    search_page = client.get("/search", query_string=params)
+
+    assert index_page.status_code == 200 and search_page.status_code == 200
+    assert app_module.response_cache.stats()["misses"] == misses + 2
+
+
+def test_index_without_loading_catalog(app_module, monkeypatch):
+    """Unit test - happy path - index()
+    the index page is keyed by the version of the songs table, without loading the
+    catalog and the neighbours
+    """
+    def fail():
+        raise AssertionError("catalog loaded")
+    monkeypatch.setattr(app_module, "catalog_version", fail)
+    monkeypatch.setattr(app_module.response_cache, "get", lambda key: app_module.MISSING)
+
+    response = app_module.app.test_client().get("/")
+
+    assert response.status_code == 200 and b"synthetic song" in response.data
+
+
+def test_metrics_labelled_by_worker(app_module):
+    """Unit test - happy path - metrics()
+    """
+    client = app_module.app.test_client()
+    client.get("/search", query_string={"song_name": "synthetic song 3"})
+    lines = client.get("/metrics").get_data(as_text=True).splitlines()
+
+    samples = [line for line in lines if not line.startswith("#")]
+    assert samples and all(f'{{pid="{os.getpid()}",' in line for line in samples)
+    # the cumulative cache counters are counters, the sizes gauges
+    assert "# TYPE cache_hits_total counter" in lines and "# TYPE cache_size gauge" in lines
@@ -0,0 +1,117 @@
+""" Test the benchmark tooling in benchmarks/
+generate_catalog()
+write_catalog()
+start_fake_spotify()
+run_benchmarks()
+compare()
+machine()
+"""
+import pytest
+import yaml
+
+from benchmarks.fake_spotify import (fake_audio_features, fake_track_id, spotify_environment,
+                                     start_fake_spotify)
+from benchmarks.micro import (BENCHMARKS, EXACT_SILHOUETTE_MAX_ROWS, compare, machine,
+                              run_benchmarks)
+from benchmarks.synthetic_catalog import FEATURE_RANGES, generate_catalog, write_catalog
+from src.search_songs import establish_api, get_audio_features_batch, search_track_id
+from src.song_manager import SongManager, Songs
+
+
+def test_generate_catalog():
+    """Unit test - happy path - generate_catalog()
+    """
+    df_songs = generate_catalog(100, n_clusters=3, seed=1)
+
+    assert list(df_songs.columns) == [column.name for column in Songs.__table__.columns]
+    assert len(df_songs) == 100 and df_songs["track_uri"].is_unique
+    assert set(df_songs["clusterId"]).issubset({0, 1, 2})
+    for feature, (low, high) in FEATURE_RANGES.items():
+        assert df_songs[feature].between(low, high).all()
+
+
+def test_write_catalog(tmp_path):
+    """Unit test - happy path - write_catalog()
+    """
+    engine_string = f"sqlite:///{tmp_path / 'songs.db'}"
+    write_catalog(generate_catalog(25, seed=1), engine_string, chunk_size=10)
+
+    song_manager = SongManager(engine_string=engine_string)
+    assert len(song_manager.get_songs()) == 25
+    assert song_manager.get_catalog_version() == 1
+    song_manager.close()
+
+
+def test_fake_spotify(monkeypatch):
+    """Unit test - happy path - start_fake_spotify()
+    the app's client talks to the fake server through the environment variables
+    """
+    server = start_fake_spotify()
+    try:
+        for name, value in spotify_environment(server).items():
+            monkeypatch.setenv(name, value)
+        sp_api = establish_api()
+
+        track_id = search_track_id("track:one last kiss", sp_api)
+        features = get_audio_features_batch([track_id, "abc"], sp_api)
+    finally:
+        server.shutdown()
+
+    assert track_id == fake_track_id("track:one last kiss")
+    # as Spotify, the fake rejects malformed ids, which the client answers with None
+    assert features == [fake_audio_features(track_id), None]
+
+
+def test_run_benchmarks():
+    """Unit test - happy path - run_benchmarks()
+    every function is timed on each size, but the exact silhouette on small catalogs only
+    """
+    with open("config/model.yaml", "r", encoding="utf-8") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+    sizes = [200, EXACT_SILHOUETTE_MAX_ROWS + 1]
+    results = run_benchmarks(sizes, config, repeat=1,
+                             names=["clean", "evaluate", "get_top_n_closest_song"])
+
+    assert set(results) == {"clean", "evaluate", "get_top_n_closest_song"}
+    assert set(results["clean"]) == {"200", str(EXACT_SILHOUETTE_MAX_ROWS + 1)}
+    assert set(results["evaluate"]) == {"200"}
+    timing = results["clean"]["200"]
+    assert 0 < timing["min_seconds"] <= timing["median_seconds"]
+    assert timing["rows_per_second"] == pytest.approx(200 / timing["min_seconds"])
+    assert {benchmark.name for benchmark in BENCHMARKS} >= {
+        "clean", "featurize", "get_model", "assign_labels", "assign_new_labels", "evaluate",
+        "get_closest_cluster", "get_top_n_closest_song"}
+
+
+def test_run_benchmarks_unknown():
+    """Unit test - unhappy path - run_benchmarks()
+    """
+    with pytest.raises(KeyError):
+        run_benchmarks([200], {}, names=["sort"])
+
+
+def test_compare():
+    """Unit test - happy path - compare()
+    a slowdown past the threshold regresses unless it is shorter than min_seconds
+    """
+    baseline = {"clean": {"1000": {"min_seconds": 0.1}, "10000": {"min_seconds": 0.0001}},
+                "featurize": {"1000": {"min_seconds": 0.1}}}
+    results = {"clean": {"1000": {"min_seconds": 0.2}, "10000": {"min_seconds": 0.0004},
+                         "100000": {"min_seconds": 1.0}},
+               "featurize": {"1000": {"min_seconds": 0.11}}}
+    comparison = compare(results, baseline, threshold=0.25, min_seconds=0.001)
+
+    regressed = {(row["function"], row["rows"]): row["regressed"] for row in comparison}
+    # sizes missing from the baseline are not compared
+    assert regressed == {("clean", 1000): True, ("clean", 10000): False,
+                         ("featurize", 1000): False}
+    assert comparison[0]["ratio"] == pytest.approx(2.0)
+
+
+def test_machine():
+    """Unit test - happy path - machine()
+    """
+    recorded = machine()
+
+    assert recorded["cpus"] >= 1
+    assert set(recorded) == {"platform", "processor", "cpus", "numpy", "pandas", "scikit-learn"}
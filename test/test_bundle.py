@@ -0,0 +1,50 @@
+""" Test the bundle format in bundle.py
+save_bundle()
+load_bundle()
+"""
+
+import numpy as np
+import pytest
+
+from src.bundle import ALIGNMENT, load_bundle, save_bundle
+
+
+def test_save_load_bundle(tmp_path):
+    """Unit test - happy path - save_bundle() and load_bundle()
+    """
+    path = str(tmp_path / "arrays.bin")
+    arrays = {"matrix": np.arange(12, dtype=np.float32).reshape(4, 3),
+              "titles": np.array(["紅蓮華", "Gurenge"]),
+              "empty": np.array([], dtype=np.int64)}
+    save_bundle(path, arrays, {"version": 3})
+
+    for mmap in [True, False]:
+        loaded, attrs = load_bundle(path, mmap=mmap)
+        assert attrs == {"version": 3}
+        assert list(loaded) == list(arrays)
+        for name, array in arrays.items():
+            assert loaded[name].dtype == array.dtype
+            np.testing.assert_array_equal(loaded[name], array)
+
+    loaded, _ = load_bundle(path)
+    # mapped arrays are read-only and aligned
+    assert not loaded["matrix"].flags.writeable
+    assert loaded["matrix"].ctypes.data % ALIGNMENT == 0
+
+
+def test_save_bundle_objects(tmp_path):
+    """Unit test - unhappy path - save_bundle()
+    python objects cannot be mapped
+    """
+    with pytest.raises(TypeError):
+        save_bundle(str(tmp_path / "arrays.bin"),
+                    {"titles": np.array(["a", None], dtype=object)})
+
+
+def test_load_bundle_not_a_bundle(tmp_path):
+    """Unit test - unhappy path - load_bundle()
+    """
+    path = tmp_path / "model.joblib"
+    path.write_bytes(b"not a bundle")
+    with pytest.raises(ValueError):
+        load_bundle(str(path))
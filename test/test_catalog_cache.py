@@ -0,0 +1,94 @@
+""" Test the CatalogCache in catalog_cache.py
+get()
+invalidate()
+"""
+
+from src.catalog_cache import CatalogCache
+
+
+class FakeCatalog:
+    """Counts how many times the cached value is built"""
+
+    def __init__(self):
+        self.version = 1
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return f"centroids v{self.version}"
+
+    def get_version(self):
+        return self.version
+
+
+def test_get_loads_once():
+    """Unit test - happy path - get()
+    """
+    catalog = FakeCatalog()
+    cache = CatalogCache(catalog.load, catalog.get_version)
+
+    assert cache.get() == "centroids v1"
+    assert cache.get() == "centroids v1"
+    assert catalog.loads == 1
+    assert cache.version == 1
+
+
+def test_get_reloads_on_new_version():
+    """Unit test - happy path - get()
+    """
+    catalog = FakeCatalog()
+    cache = CatalogCache(catalog.load, catalog.get_version)
+    cache.get()
+    # an ingestion bumps the version
+    catalog.version = 2
+
+    assert cache.get() == "centroids v2"
+    assert catalog.loads == 2
+
+
+def test_get_skips_check_within_interval():
+    """Unit test - unhappy path - get()
+    """
+    catalog = FakeCatalog()
+    cache = CatalogCache(catalog.load, catalog.get_version,
+                         check_interval=3600)
+    cache.get()
+    catalog.version = 2
+
+    # the new version is not seen until the interval has passed
+    assert cache.get() == "centroids v1"
+    assert catalog.loads == 1
+
+
+def test_invalidate():
+    """Unit test - happy path - invalidate()
+    """
+    catalog = FakeCatalog()
+    cache = CatalogCache(catalog.load, catalog.get_version,
+                         check_interval=3600)
+    cache.get()
+    cache.invalidate()
+
+    assert cache.version is None
+    cache.get()
+    assert catalog.loads == 2
+
+
+def test_get_updates_on_new_version():
+    """Unit test - happy path - get()
+    """
+    catalog = FakeCatalog()
+    cache = CatalogCache(catalog.load, catalog.get_version,
+                         updater=lambda value: None if catalog.version > 2 else value + "+")
+    cache.get()
+    catalog.version = 2
+
+    # updated instead of reloaded
+    assert cache.get() == "centroids v1+"
+    assert catalog.loads == 1
+    assert cache.version == 2
+
+    # reloaded when the updater cannot update
+    catalog.version = 3
+    assert cache.get() == "centroids v3"
+    assert catalog.loads == 2
@@ -0,0 +1,86 @@
+""" Test the functions in catalog_lookup.py
+normalize_title
+TitleIndex.resolve
+TitleIndex.append
+"""
+
+import pandas as pd
+import pytest
+
+from src.catalog_lookup import TitleIndex, normalize_title
+
+features = ["danceability", "energy"]
+
+df_anime = pd.DataFrame([["怪物", "spotify:track:1", 0.627, 0.824],
+                         ["One Last Kiss", "spotify:track:2", 0.561, 0.667],
+                         ["One Last Kiss (Instrumental)", "spotify:track:3", 0.5, 0.6],
+                         ["ＧＥＴ ＷＩＬＤ", "spotify:track:4", 0.7, 0.9],
+                         ["One Last Kiss", "spotify:track:5", 0.1, 0.1]],
+                        columns=["title", "track_uri", "danceability", "energy"])
+
+
+def test_normalize_title():
+    """Unit test - happy path - normalize_title()
+    """
+    assert normalize_title("  ＧＥＴ   Wild ") == "get wild"
+
+
+def test_resolve_exact():
+    """Unit test - happy path - resolve()
+    """
+    index = TitleIndex.from_dataframe(df_anime, features)
+
+    assert index.resolve("怪物") == {"danceability": 0.627, "energy": 0.824,
+                                     "track_uri": "spotify:track:1"}
+    # case, width and duplicated titles
+    assert index.resolve("get wild")["track_uri"] == "spotify:track:4"
+    assert index.resolve("one last kiss")["track_uri"] == "spotify:track:2"
+
+
+def test_resolve_prefix():
+    """Unit test - happy path - resolve()
+    """
+    index = TitleIndex.from_dataframe(df_anime, features)
+
+    # the shortest title starting with the name wins
+    assert index.resolve("One Last")["track_uri"] == "spotify:track:2"
+    assert index.resolve("one last kiss (inst")["track_uri"] == "spotify:track:3"
+
+
+def test_resolve_exact_only():
+    """Unit test - happy path - resolve(exact=True)
+    """
+    index = TitleIndex.from_dataframe(df_anime, features)
+
+    assert index.resolve("One Last", exact=True) is None
+    assert index.resolve("one last kiss", exact=True)["track_uri"] == "spotify:track:2"
+
+
+def test_resolve_no_match():
+    """Unit test - unhappy path - resolve()
+    """
+    index = TitleIndex.from_dataframe(df_anime, features)
+
+    assert index.resolve("Levitating") is None
+    # too short to be matched as a prefix
+    assert index.resolve("One") is None
+    assert index.resolve("") is None
+    assert index.resolve(None) is None
+
+
+def test_from_dataframe_bad_features():
+    """Unit test - unhappy path - TitleIndex.from_dataframe()
+    """
+    with pytest.raises(KeyError):
+        TitleIndex.from_dataframe(df_anime, ["key"])
+
+
+def test_append():
+    """Unit test - happy path - TitleIndex.append()
+    """
+    index = TitleIndex.from_dataframe(df_anime.iloc[:2], features).append(df_anime.iloc[2:])
+
+    assert len(index) == 5
+    assert index.resolve("ＧＥＴ ＷＩＬＤ")["track_uri"] == "spotify:track:4"
+    # duplicated titles still resolve to the first song
+    assert index.resolve("one last kiss")["track_uri"] == "spotify:track:2"
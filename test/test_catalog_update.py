@@ -0,0 +1,126 @@
+""" Test the incremental catalog updates in catalog_update.py
+ClusterState.from_model
+ClusterState.update
+ClusterState.drift
+update_catalog
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+import src.song_manager as sm
+from src.catalog_update import ClusterState, load_state, save_state, update_catalog
+from src.model_artifact import export_artifact, load_artifact
+
+FEATURES = ["danceability", "energy", "loudness", "speechiness", "acousticness",
+            "instrumentalness", "liveness", "valence", "tempo"]
+CLEAN_FEATURES = FEATURES + ["key", "title", "duration", "track_uri"]
+COL_MAPPER = {"name": "title", "duration_ms": "duration", "uri": "track_uri"}
+
+
+def raw_songs(first: int, n_songs: int, value: float) -> pd.DataFrame:
+    """Builds songs as returned by Spotify, with every feature close to value"""
+    rows = []
+    for number in range(first, first + n_songs):
+        song = {fea: value + 0.01 * (number % 3) for fea in FEATURES}
+        song.update({"key": 1, "name": f"Song_{number}", "duration_ms": 200000,
+                     "uri": f"spotify:track:{number}"})
+        rows.append(song)
+    return pd.DataFrame(rows)
+
+
+def test_cluster_state_update():
+    """Unit test - happy path - ClusterState.update()
+    """
+    state = ClusterState(["danceability"], [[0.0], [1.0]], [[0.0], [1.0]], [2, 2], 4,
+                         baseline_rms=0.5)
+    state.update(np.array([[3.0], [1.0]]), np.array([0, 1]))
+
+    # running means of the clusters, the initial centroids are kept
+    assert np.allclose(state.centroids, [[1.0], [1.0]])
+    assert np.allclose(state.initial_centroids, [[0.0], [1.0]])
+    assert list(state.counts) == [3, 3]
+
+    drift = state.drift(max_centroid_shift=1.0, max_fit_ratio=10, max_added_share=1)
+    # cluster 0 moved by 1, which is 2 baseline rms distances
+    assert drift["centroid_shift"] == pytest.approx(2.0)
+    assert drift["added_share"] == pytest.approx(0.5)
+    assert drift["needs_retrain"]
+
+
+def test_cluster_state_from_artifact(tmp_path):
+    """Unit test - happy path - ClusterState.from_model() with a ModelArtifact
+    """
+    df_clean = pd.concat([raw_songs(0, 6, 0.1), raw_songs(6, 6, 0.8)],
+                         ignore_index=True).rename(columns=COL_MAPPER)
+    scaler = StandardScaler().fit(df_clean[FEATURES])
+    model = KMeans(n_clusters=2, random_state=0).fit(
+        pd.DataFrame(scaler.transform(df_clean[FEATURES]), columns=FEATURES))
+    export_artifact(model, scaler, str(tmp_path / "model.bin"))
+    sizes = pd.Series([6, 6])
+
+    state = ClusterState.from_model(load_artifact(str(tmp_path / "model.bin")), sizes)
+
+    assert state.to_dict() == ClusterState.from_model(model, sizes).to_dict()
+
+
+def test_update_catalog(tmp_path):
+    """Unit test - happy path - update_catalog()
+    """
+    engine_string = f"sqlite:///{tmp_path / 'songs.db'}"
+    sm.create_db(engine_string)
+    manager = sm.SongManager(engine_string=engine_string)
+
+    # a catalog of two clusters, and a model trained on it
+    df_raw = pd.concat([raw_songs(0, 6, 0.1), raw_songs(6, 6, 0.8)], ignore_index=True)
+    df_clean = df_raw.rename(columns=COL_MAPPER)[CLEAN_FEATURES]
+    scaler = StandardScaler().fit(df_clean[FEATURES])
+    model = KMeans(n_clusters=2, random_state=0).fit(
+        pd.DataFrame(scaler.transform(df_clean[FEATURES]), columns=FEATURES))
+    manager.add_songs(df_clean.assign(clusterId=model.labels_))
+    state = ClusterState.from_model(model, manager.get_cluster_sizes())
+
+    # new songs close to the second cluster, and one song already in the catalog
+    df_new = pd.concat([raw_songs(20, 3, 0.8), raw_songs(0, 1, 0.1)], ignore_index=True)
+    df_added, state = update_catalog(df_new, scaler, model, state, manager,
+                                     CLEAN_FEATURES, COL_MAPPER, FEATURES)
+
+    second_cluster = model.labels_[-1]
+    assert list(df_added["track_uri"]) == [f"spotify:track:{number}" for number in range(20, 23)]
+    assert (df_added["clusterId"] == second_cluster).all()
+    assert manager.count_songs() == 15
+    assert state.n_added == 3
+    assert state.counts[second_cluster] == 9
+
+    # the state survives a round trip to its file
+    save_state(state, str(tmp_path / "state.json"))
+    loaded = load_state(str(tmp_path / "state.json"))
+    assert np.allclose(loaded.centroids, state.centroids)
+    assert loaded.drift(1, 2, 1) == state.drift(1, 2, 1)
+    manager.close()
+
+
+def test_update_catalog_not_added(tmp_path, monkeypatch):
+    """Unit test - unhappy path - update_catalog()
+    the state is left unchanged when the songs cannot be stored
+    """
+    engine_string = f"sqlite:///{tmp_path / 'songs.db'}"
+    sm.create_db(engine_string)
+    manager = sm.SongManager(engine_string=engine_string)
+    df_clean = raw_songs(0, 6, 0.1).rename(columns=COL_MAPPER)[CLEAN_FEATURES]
+    scaler = StandardScaler().fit(df_clean[FEATURES])
+    model = KMeans(n_clusters=2, random_state=0).fit(
+        pd.DataFrame(scaler.transform(df_clean[FEATURES]), columns=FEATURES))
+    state = ClusterState.from_model(model, pd.Series([3, 3]))
+    centroids = state.centroids.copy()
+    monkeypatch.setattr(manager, "add_songs", lambda df_songs: 0)
+
+    with pytest.raises(ValueError):
+        update_catalog(raw_songs(20, 3, 0.1), scaler, model, state, manager,
+                       CLEAN_FEATURES, COL_MAPPER, FEATURES)
+    assert state.n_added == 0
+    assert np.array_equal(state.centroids, centroids)
+    manager.close()
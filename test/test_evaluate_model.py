@@ -1,14 +1,28 @@
 """ Test the functions in evaluate_model.py
 evaluate()
+silhouette_samples_chunked()
+sampled_silhouette()
 assign_labels()
+assign_labels_streaming()
 assign_new_labels()
+assign_new_labels_parallel()
 """
 
+import json
+import tracemalloc
+
+import numpy as np
 import pandas as pd
 import pytest
 from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_samples
 from sklearn.preprocessing import StandardScaler
-from src.evaluate_model import assign_labels, assign_new_labels, evaluate
+
+import src.evaluate_model as evaluate_model
+from src.evaluate_model import (assign_labels, assign_labels_streaming, assign_new_labels,
+                                 assign_new_labels_parallel, evaluate, sampled_silhouette,
+                                 silhouette_samples_chunked)
+from src.tables import TableWriter, read_table
 
 # Define expected input dataframe
 df_in_values = [[0.627, 1],
@@ -54,6 +68,65 @@ def test_assign_labels_unmatch_columns():
         assign_labels(df_features, model)
 
 
+def test_assign_labels_streaming(tmp_path):
+    """Unit test - happy path - assign_labels_streaming()
+    """
+    # define input values
+    df_features = pd.DataFrame([[0.627], [0.585], [0.561]],
+                               columns=["danceability"])
+    df_origin = pd.DataFrame([["a", 0.627], ["b", 0.585], ["c", 0.561]],
+                             columns=["title", "danceability"])
+    df_features.to_csv(tmp_path / "features.csv", index=False)
+    df_origin.to_csv(tmp_path / "cleaned.csv", index=False)
+    model = KMeans(n_clusters=2, random_state=42)
+    model.fit(df_features)
+
+    # the chunks are labelled the same as the whole dataset
+    n_rows = assign_labels_streaming(str(tmp_path / "features.csv"),
+                                     str(tmp_path / "cleaned.csv"), model,
+                                     str(tmp_path / "labelled.csv"), chunk_size=2)
+    df_true = assign_labels(df_origin, model)
+    df_test = pd.read_csv(tmp_path / "labelled.csv")
+
+    assert n_rows == 3
+    pd.testing.assert_frame_equal(df_true, df_test, check_dtype=False)
+
+
+def test_assign_labels_streaming_more_rows(tmp_path):
+    """Unit test - unhappy path - assign_labels_streaming()
+    """
+    # the featurized file ends on a chunk boundary, before the cleaned one
+    df_features = pd.DataFrame([[0.627], [0.585]], columns=["danceability"])
+    df_origin = pd.DataFrame([["a", 0.627], ["b", 0.585], ["c", 0.561]],
+                             columns=["title", "danceability"])
+    df_features.to_csv(tmp_path / "features.csv", index=False)
+    df_origin.to_csv(tmp_path / "cleaned.csv", index=False)
+    model = KMeans(n_clusters=2, random_state=42).fit(df_features)
+
+    for first, second in [("features", "cleaned"), ("cleaned", "features")]:
+        with pytest.raises(ValueError):
+            assign_labels_streaming(str(tmp_path / f"{first}.csv"),
+                                    str(tmp_path / f"{second}.csv"), model,
+                                    str(tmp_path / "labelled.csv"), chunk_size=2)
+
+
+def test_assign_labels_streaming_float32(tmp_path):
+    """Unit test - happy path - assign_labels_streaming()
+    """
+    # a model fitted in float32 labels the float64 columns read from a csv file
+    df_features = pd.DataFrame([[0.627], [0.585], [0.561]], columns=["danceability"])
+    df_origin = df_features.assign(title=["a", "b", "c"])
+    df_features.to_csv(tmp_path / "features.csv", index=False)
+    df_origin.to_csv(tmp_path / "cleaned.csv", index=False)
+    model = KMeans(n_clusters=2, random_state=42).fit(df_features.astype(np.float32))
+
+    assign_labels_streaming(str(tmp_path / "features.csv"), str(tmp_path / "cleaned.csv"),
+                            model, str(tmp_path / "labelled.csv"), chunk_size=2)
+
+    assert (pd.read_csv(tmp_path / "labelled.csv")["clusterId"].tolist()
+            == model.labels_.tolist())
+
+
 def test_assign_new_labels():
     """Unit test - happy path - assign_new_labels()
     """
@@ -87,6 +160,69 @@ def test_assign_new_labels():
         df_true, df_test, check_dtype=False, atol=1e-3, rtol=1e-3)
 
 
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_assign_new_labels_parallel(tmp_path, n_jobs):
+    """Unit test - happy path - assign_new_labels_parallel()
+    """
+    # define input values
+    features = ["danceability", "energy"]
+    rng = np.random.default_rng(0)
+    df_data = pd.DataFrame(rng.random((20, 2)), columns=features)
+    scalar = StandardScaler().fit(df_data)
+    model = KMeans(n_clusters=3, random_state=42).fit(
+        pd.DataFrame(scalar.transform(df_data), columns=features))
+    df_songs = pd.DataFrame(rng.random((11, 2)), columns=features)
+    df_songs.to_csv(tmp_path / "songs.csv", index=False)
+
+    # chunks scored by the workers are written in the input order
+    n_rows = assign_new_labels_parallel(str(tmp_path / "songs.csv"),
+                                        str(tmp_path / "scores.csv"), scalar, model,
+                                        features, {}, features, chunk_size=3, n_jobs=n_jobs)
+    df_true = assign_new_labels(pd.read_csv(tmp_path / "songs.csv"), scalar, model,
+                                features, {}, features)
+
+    assert n_rows == 11
+    pd.testing.assert_frame_equal(df_true, pd.read_csv(tmp_path / "scores.csv"),
+                                  check_dtype=False)
+    # the songs are scored in this process without setting up a worker
+    assert n_jobs > 1 or not evaluate_model._scorer
+
+
+def test_assign_new_labels_parallel_parquet(tmp_path):
+    """Unit test - happy path - assign_new_labels_parallel()
+    the workers read the row groups of a parquet file
+    """
+    pytest.importorskip("pyarrow")
+    features = ["danceability", "energy"]
+    rng = np.random.default_rng(0)
+    df_data = pd.DataFrame(rng.random((20, 2)), columns=features)
+    scalar = StandardScaler().fit(df_data)
+    model = KMeans(n_clusters=3, random_state=42).fit(
+        pd.DataFrame(scalar.transform(df_data), columns=features))
+    df_songs = pd.DataFrame(rng.random((11, 2)), columns=features)
+    with TableWriter(str(tmp_path / "songs.parquet")) as output:
+        for start in range(0, 11, 3):
+            output.write(df_songs.iloc[start:start + 3])
+
+    n_rows = assign_new_labels_parallel(str(tmp_path / "songs.parquet"),
+                                        str(tmp_path / "scores.parquet"), scalar, model,
+                                        features, {}, features, chunk_size=3, n_jobs=2)
+    df_true = assign_new_labels(read_table(str(tmp_path / "songs.parquet")), scalar, model,
+                                features, {}, features)
+
+    assert n_rows == 11
+    pd.testing.assert_frame_equal(df_true, read_table(str(tmp_path / "scores.parquet")),
+                                  check_dtype=False)
+
+
+def test_assign_new_labels_parallel_not_kmeans(tmp_path):
+    """Unit test - unhappy path - assign_new_labels_parallel()
+    """
+    with pytest.raises(TypeError):
+        assign_new_labels_parallel(str(tmp_path / "songs.csv"), str(tmp_path / "scores.csv"),
+                                   StandardScaler(), StandardScaler(), [], {}, [])
+
+
 def test_assign_new_labels_no_songs():
     """Unit test - unhappy path - assign_new_labels()
     """
@@ -115,14 +251,68 @@ def test_assign_new_labels_no_songs():
 def test_evaluate():
     """Unit test - happy path - evaluate()
     """
-    # Define expected output, df_true
-    true_out = "Silhoutee score: -0.021645021645016176"
-
     # Compute test output
-    test_out = evaluate(df_in)
+    test_out = json.loads(evaluate(df_in))
 
     # Test that the true and test are the same
-    assert true_out == test_out
+    assert test_out["n_songs"] == 3
+    assert test_out["n_clusters"] == 2
+    assert test_out["silhouette"] == {"method": "exact",
+                                      "score": pytest.approx(-0.021645021645016176)}
+    assert test_out["inertia"] == pytest.approx(0.000882)
+    assert set(test_out) >= {"calinski_harabasz", "davies_bouldin"}
+
+
+def test_evaluate_unknown_method():
+    """Unit test - unhappy path - evaluate()
+    """
+    with pytest.raises(ValueError):
+        evaluate(df_in, method="approximate")
+
+
+def test_silhouette_samples_chunked():
+    """Unit test - happy path - silhouette_samples_chunked()
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(200, 3))
+    labels = rng.integers(0, 4, size=200)
+
+    # chunks smaller than the data (31 rows, then 1 row) give the same result as sklearn
+    assert np.allclose(silhouette_samples_chunked(values, labels, max_block_mb=0.05),
+                       silhouette_samples(values, labels))
+    assert np.allclose(silhouette_samples_chunked(values, labels, np.array([5, 7]), 0),
+                       silhouette_samples(values, labels)[[5, 7]])
+
+
+def test_silhouette_samples_chunked_memory():
+    """Unit test - happy path - silhouette_samples_chunked()
+    the distances held at a time stay within the budget, not chunk rows * songs
+    """
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(4000, 3))
+    labels = rng.integers(0, 4, size=4000)
+
+    tracemalloc.start()
+    silhouette_samples_chunked(values, labels, max_block_mb=1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # the whole distance matrix would be 128 MB
+    assert peak < 3e6
+
+
+def test_sampled_silhouette():
+    """Unit test - happy path - sampled_silhouette()
+    """
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(0, 1, size=(300, 2)), rng.normal(4, 1, size=(100, 2))])
+    labels = np.repeat([0, 1], [300, 100])
+    exact = silhouette_samples(values, labels).mean()
+
+    estimate = sampled_silhouette(values, labels, sample_size=100, seed=1)
+
+    assert estimate["sample_size"] == 100
+    assert estimate["ci_low"] <= estimate["score"] <= estimate["ci_high"]
+    assert estimate["ci_low"] <= exact <= estimate["ci_high"]
 
 
 def test_evaluate_not_df():
@@ -0,0 +1,137 @@
+""" Test the request metrics in metrics.py
+Histogram.observe()
+Histogram.render()
+render_gauges()
+render_counters()
+span()
+count_sql_statements()
+RequestMetrics.record()
+"""
+
+import logging
+
+import sqlalchemy
+
+from src.metrics import (Histogram, RequestMetrics, count_sql_statements, current_trace,
+                         end_trace, render_counters, render_gauges, span, start_trace)
+
+
+def test_histogram_render():
+    """Unit test - happy path - Histogram.render()
+    """
+    hist = Histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1))
+    hist.observe(0.05, "search")
+    hist.observe(0.5, "search")
+    hist.observe(2, "search")
+
+    assert hist.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="search",le="0.1"} 1',
+        'latency_seconds_bucket{stage="search",le="1"} 2',
+        'latency_seconds_bucket{stage="search",le="+Inf"} 3',
+        'latency_seconds_sum{stage="search"} 2.55',
+        'latency_seconds_count{stage="search"} 3',
+    ]
+
+
+def test_render_constant_labels():
+    """Unit test - happy path - render_gauges()
+    the labels of the process come before those of the series
+    """
+    hist = Histogram("latency_seconds", "Latency", ("stage",), buckets=(1,))
+    hist.observe(0.5, "search")
+
+    assert hist.render({"pid": 42})[2] == 'latency_seconds_bucket{pid="42",stage="search",le="1"} 1'
+    assert render_gauges("cache_size", "Size", ("cache",), {("search",): 3}, {"pid": 42}) == [
+        "# HELP cache_size Size", "# TYPE cache_size gauge",
+        'cache_size{pid="42",cache="search"} 3']
+
+
+def test_render_counters():
+    """Unit test - happy path - render_counters()
+    """
+    assert render_counters("cache_hits_total", "Hits", ("cache",),
+                           {("search",): 5, ("audio_features",): 2}) == [
+        "# HELP cache_hits_total Hits", "# TYPE cache_hits_total counter",
+        'cache_hits_total{cache="audio_features"} 2',
+        'cache_hits_total{cache="search"} 5']
+
+
+def test_histogram_bucket_bound_inclusive():
+    """Unit test - unhappy path - Histogram.observe()
+    values equal to a bound are counted in its bucket
+    """
+    hist = Histogram("sql_statements", "Statements", buckets=(0, 1))
+    hist.observe(0)
+    hist.observe(1)
+
+    assert hist.render()[2:4] == ['sql_statements_bucket{le="0"} 1',
+                                  'sql_statements_bucket{le="1"} 2']
+
+
+def test_span_records_stages():
+    """Unit test - happy path - span()
+    """
+    trace = start_trace("get_entry")
+    try:
+        with span("similarity"):
+            pass
+        with span("similarity"):
+            pass
+        with span("render"):
+            pass
+    finally:
+        end_trace()
+
+    assert list(trace.stages) == ["similarity", "render"]
+    assert all(seconds >= 0 for seconds in trace.stages.values())
+    assert current_trace() is None
+
+
+def test_span_without_trace():
+    """Unit test - unhappy path - span()
+    spans outside of a traced request do nothing
+    """
+    with span("similarity"):
+        value = 1
+    assert value == 1 and current_trace() is None
+
+
+def test_count_sql_statements():
+    """Unit test - happy path - count_sql_statements()
+    """
+    engine = sqlalchemy.create_engine("sqlite://")
+    count_sql_statements(engine)
+    # registering twice does not count statements twice
+    count_sql_statements(engine)
+
+    trace = start_trace("index")
+    try:
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("SELECT 1"))
+            conn.execute(sqlalchemy.text("SELECT 2"))
+    finally:
+        end_trace()
+    with engine.connect() as conn:
+        conn.execute(sqlalchemy.text("SELECT 3"))
+
+    assert trace.sql_statements == 2
+
+
+def test_record_slow_request(caplog):
+    """Unit test - happy path - RequestMetrics.record()
+    """
+    request_metrics = RequestMetrics(slow_request_seconds=0)
+    trace = start_trace("get_entry")
+    end_trace()
+    trace.add("spotify_search", 0.2)
+    trace.sql_statements = 3
+
+    with caplog.at_level(logging.WARNING, logger="src.metrics"):
+        request_metrics.record(trace, 200)
+
+    assert request_metrics.request_latency.count("get_entry", "200") == 1
+    assert request_metrics.stage_latency.count("get_entry", "spotify_search") == 1
+    assert "spotify_search=200.0ms" in caplog.text
+    assert any(line.startswith("request_sql_statements_sum") for line in request_metrics.render())
@@ -1,12 +1,17 @@
 """ Test the functions in model.py
 get_train_data
 get_model
+get_minibatch_model
+select_candidate
+sweep_k
 """
 
+import logging
+
 import numpy as np
 import pandas as pd
 import pytest
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 
 import src.model as mod
 
@@ -69,6 +74,18 @@ def test_get_model():
                        np.array([[0.573],[0.627]]))
 
 
+def test_get_model_float32():
+    """Unit test - happy path - get_model()
+    """
+    feature_columns = ["danceability"]
+    fit = mod.get_model(df_in, feature_columns, 2, 42, precision="float32")
+
+    # fitted in float32, with the clusters of the float64 model
+    assert fit.cluster_centers_.dtype == np.float32
+    assert np.allclose(fit.cluster_centers_, np.array([[0.573], [0.627]]))
+    assert list(fit.labels_) == list(mod.get_model(df_in, feature_columns, 2, 42).labels_)
+
+
 def test_get_model_not_valid_data():
     """Unit test - unhappy path - get_model()
     """
@@ -78,3 +95,71 @@ def test_get_model_not_valid_data():
 
     with pytest.raises(TypeError):
         mod.get_model(nonexist_in, feature_columns, 2, 42)
+
+
+def test_get_minibatch_model(tmp_path, caplog):
+    """Unit test - happy path - get_minibatch_model()
+    """
+    # two well separated groups of songs, streamed in chunks smaller than the file
+    caplog.set_level(logging.INFO)
+    input_path = tmp_path / "features.csv"
+    pd.DataFrame({"danceability": [0.1, 0.11, 0.12, 0.9, 0.91, 0.92] * 5,
+                  "title": ["song"] * 30}).to_csv(input_path, index=False)
+    fit = mod.get_minibatch_model(str(input_path), ["danceability"], 2, 42,
+                                  chunk_size=4, n_epochs=2)
+
+    assert isinstance(fit, MiniBatchKMeans)
+    assert fit.feature_names_in_ == ["danceability"]
+    assert np.allclose(np.sort(fit.cluster_centers_.ravel()), [0.11, 0.91], atol=0.02)
+    # the columns are checked on the first chunk only, not on each chunk of each epoch
+    assert caplog.text.count("All the given columns are used in clustering") == 1
+
+
+def test_get_minibatch_model_too_few_rows(tmp_path):
+    """Unit test - unhappy path - get_minibatch_model()
+    """
+    # fewer songs than clusters
+    input_path = tmp_path / "features.csv"
+    pd.DataFrame({"danceability": [0.1, 0.9]}).to_csv(input_path, index=False)
+
+    with pytest.raises(ValueError):
+        mod.get_minibatch_model(str(input_path), ["danceability"], 3, 42, chunk_size=1)
+
+
+def test_select_candidate():
+    """Unit test - happy path - select_candidate()
+    """
+    report = pd.DataFrame({"k": [2, 2, 3, 4, 5],
+                           "seed": [1, 2, 1, 1, 1],
+                           "inertia": [100.0, 90.0, 30.0, 25.0, 22.0],
+                           "silhouette": [0.3, 0.35, 0.5, 0.4, 0.2]})
+
+    assert mod.select_candidate(report, "silhouette") == 2
+    # the inertia curve bends the most at k=3
+    assert mod.select_candidate(report, "elbow") == 2
+    # with a single k, the seed with the lowest inertia
+    assert mod.select_candidate(report.iloc[:2], "elbow") == 1
+
+
+def test_sweep_k():
+    """Unit test - happy path - sweep_k()
+    """
+    # three well separated groups of songs
+    df_songs = pd.DataFrame({"danceability": [0.1, 0.11, 0.12, 0.5, 0.51, 0.52,
+                                              0.9, 0.91, 0.92]})
+    fit, report = mod.sweep_k(df_songs, ["danceability"], [2, 3, 4], [1, 2],
+                              n_jobs=2)
+
+    assert isinstance(fit, KMeans)
+    assert fit.n_clusters == 3
+    assert list(report.columns) == ["k", "seed", "inertia", "silhouette", "selected"]
+    assert len(report) == 6
+    assert report["selected"].sum() == 1
+    assert report.loc[report["selected"], "k"].item() == 3
+
+
+def test_sweep_k_unknown_criterion():
+    """Unit test - unhappy path - sweep_k()
+    """
+    with pytest.raises(ValueError):
+        mod.sweep_k(df_in, ["danceability"], [2], [42], criterion="inertia")
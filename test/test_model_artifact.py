@@ -0,0 +1,116 @@
+""" Test the functions in model_artifact.py
+export_artifact
+load_artifact
+run.py score
+ModelArtifact.predict
+ArtifactScaler.transform
+"""
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+from src.bundle import save_bundle
+from src.evaluate_model import assign_new_labels
+from src.model import load_model, save_model
+from src.model_artifact import ModelArtifact, export_artifact, load_artifact
+
+features = ["danceability", "energy"]
+rng = np.random.default_rng(0)
+df_songs = pd.DataFrame(rng.random((30, 3)), columns=features + ["tempo"])
+scaler = StandardScaler().fit(df_songs)
+df_scaled = pd.DataFrame(scaler.transform(df_songs), columns=df_songs.columns)
+model = KMeans(n_clusters=3, random_state=42).fit(df_scaled[features])
+
+
+def test_export_load_artifact(tmp_path):
+    """Unit test - happy path - export_artifact() and load_artifact()
+    """
+    export_artifact(model, scaler, str(tmp_path / "model.bin"), data_hash="abc")
+    artifact = load_artifact(str(tmp_path / "model.bin"))
+
+    assert artifact.feature_names_in_.tolist() == features
+    assert np.array_equal(artifact.cluster_centers_, model.cluster_centers_)
+    assert artifact.scaler.feature_names_in_.tolist() == df_songs.columns.tolist()
+    assert artifact.attrs["k"] == 3
+    assert artifact.attrs["seed"] == 42
+    assert artifact.attrs["data_hash"] == "abc"
+    # the same outputs as the sklearn estimators
+    assert np.allclose(artifact.scaler.transform(df_songs), scaler.transform(df_songs))
+    assert np.array_equal(artifact.predict(df_scaled[features]),
+                          model.predict(df_scaled[features]))
+
+
+def test_assign_new_labels_artifact(tmp_path):
+    """Unit test - happy path - assign_new_labels() with a ModelArtifact
+    """
+    export_artifact(model, scaler, str(tmp_path / "model.bin"))
+    artifact = load_model(str(tmp_path / "model.bin"))
+    save_model(model, str(tmp_path / "model.joblib"))
+    df_new = pd.DataFrame(rng.random((10, 3)), columns=df_songs.columns)
+    clean_features = df_songs.columns.tolist()
+
+    assert isinstance(artifact, ModelArtifact)
+    pd.testing.assert_frame_equal(
+        assign_new_labels(df_new, artifact.scaler, artifact, clean_features, {}, features),
+        assign_new_labels(df_new, scaler, load_model(str(tmp_path / "model.joblib")),
+                          clean_features, {}, features))
+
+
+def test_load_artifact_without_sklearn(tmp_path):
+    """Unit test - happy path - load_artifact() does not import sklearn
+    """
+    export_artifact(model, scaler, str(tmp_path / "model.bin"))
+    code = ("import sys; from src.model_artifact import load_artifact; "
+            f"artifact = load_artifact({str(tmp_path / 'model.bin')!r}); "
+            "artifact.predict(artifact.scaler.transform([[0.5, 0.5, 0.5]])[:, :2]); "
+            "assert not any(name.startswith('sklearn') for name in sys.modules)")
+
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_score_without_sklearn(tmp_path):
+    """Unit test - happy path - run.py score with a model artifact, with sklearn blocked
+    """
+    export_artifact(model, scaler, str(tmp_path / "model.bin"))
+    df_new = pd.DataFrame(rng.random((10, 3)), columns=df_songs.columns)
+    df_new.to_csv(tmp_path / "sample.csv", index=False)
+    settings = {"clean_features": df_songs.columns.tolist(), "col_mapper": {},
+                "features": features}
+    with open(tmp_path / "model.yaml", "w", encoding="utf-8") as file:
+        yaml.dump({"evaluate_model": {"assign_new_labels": settings}}, file)
+    argv = ["run.py", "score", f"--model={tmp_path / 'model.bin'}",
+            f"--input={tmp_path / 'sample.csv'}", f"--file_output={tmp_path / 'scores.csv'}",
+            f"--config={tmp_path / 'model.yaml'}"]
+    # importing sklearn, or any of its modules, raises an ImportError
+    code = ("import runpy, sys; sys.modules['sklearn'] = None; "
+            f"sys.argv = {argv!r}; runpy.run_path('run.py', run_name='__main__')")
+
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "scores.csv"),
+        assign_new_labels(df_new, scaler, model, **settings), check_dtype=False)
+
+
+def test_export_artifact_unscaled_feature(tmp_path):
+    """Unit test - unhappy path - export_artifact()
+    """
+    other_scaler = StandardScaler().fit(df_songs[["tempo"]])
+
+    with pytest.raises(KeyError):
+        export_artifact(model, other_scaler, str(tmp_path / "model.bin"))
+
+
+def test_load_artifact_not_artifact(tmp_path):
+    """Unit test - unhappy path - load_artifact()
+    """
+    save_bundle(str(tmp_path / "other.bin"), {"values": np.zeros(3)}, {"version": 1})
+
+    with pytest.raises(ValueError):
+        load_artifact(str(tmp_path / "other.bin"))
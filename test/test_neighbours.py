@@ -0,0 +1,110 @@
+""" Test the functions in neighbours.py
+compute_neighbours
+save_neighbours
+NeighbourTable.lookup
+NeighbourTable.matches
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.neighbours import NeighbourTable, compute_neighbours, save_neighbours
+from src.snapshot import content_version
+from src.song_index import SongIndex
+
+features = ["danceability", "energy"]
+
+df_anime = pd.DataFrame([["Song_1", "uri_1", 0, 0.5, 0.1],
+                         ["Song_2", "uri_2", 1, 0.3, 0.3],
+                         ["Song_3", "uri_3", 0, 0.1, 0.5],
+                         ["Song_4", "uri_4", 0, 0.4, 0.2],
+                         ["Song_5", "uri_5", 1, 0.9, 0.1]],
+                        columns=["title", "track_uri", "clusterId",
+                                 "danceability", "energy"])
+
+
+def test_compute_neighbours():
+    """Unit test - happy path - compute_neighbours()
+    """
+    # small blocks to go through several of them
+    indices, scores = compute_neighbours(df_anime, features, 3, block_size=2)
+
+    assert indices.shape == (5, 3)
+    # every song is its own closest song
+    assert indices[:, 0].tolist() == [0, 1, 2, 3, 4]
+    assert np.allclose(scores[:, 0], 1)
+    # the same as an exact search over every cluster
+    index = SongIndex.from_dataframe(df_anime, features)
+    true_out = index.top_n(np.array([0.4, 0.2]), [0, 1], 3)
+    assert df_anime["title"][indices[3]].tolist() == [rec["title"] for rec in true_out]
+
+
+def test_compute_neighbours_bad_features():
+    """Unit test - unhappy path - compute_neighbours()
+    """
+    with pytest.raises(KeyError):
+        compute_neighbours(df_anime, ["key"], 3)
+
+
+def test_lookup(tmp_path):
+    """Unit test - happy path - NeighbourTable.lookup()
+    """
+    path = str(tmp_path / "neighbours.npz")
+    save_neighbours(df_anime, *compute_neighbours(df_anime, features, 3), output_path=path,
+                    features=features)
+    table = NeighbourTable.load(path)
+
+    test_out = table.lookup("uri_4", 2)
+
+    assert "uri_4" in table
+    assert test_out == [{"title": "Song_4", "track_uri": "uri_4", "clusterId": 0,
+                         "similarity": pytest.approx(1, abs=1e-6)},
+                        {"title": "Song_1", "track_uri": "uri_1", "clusterId": 0,
+                         "similarity": pytest.approx(0.965, abs=1e-3)}]
+
+
+def test_lookup_not_in_catalog(tmp_path):
+    """Unit test - unhappy path - NeighbourTable.lookup()
+    """
+    path = str(tmp_path / "neighbours.npz")
+    save_neighbours(df_anime, *compute_neighbours(df_anime, features, 3), output_path=path,
+                    features=features)
+    table = NeighbourTable.load(path)
+
+    assert table.lookup("uri_6", 2) is None
+    # more songs than were precomputed
+    assert table.lookup("uri_4", 4) is None
+
+
+def test_matches(tmp_path):
+    """Unit test - happy path - NeighbourTable.matches()
+    """
+    path = str(tmp_path / "neighbours.npz")
+    save_neighbours(df_anime, *compute_neighbours(df_anime, features, 3), output_path=path,
+                    features=features)
+    table = NeighbourTable.load(path)
+    uris, clusters = df_anime["track_uri"].tolist(), df_anime["clusterId"].tolist()
+
+    assert table.matches(uris[::-1], clusters[::-1])
+    # a song added to the catalog, or removed from it
+    assert not table.matches(uris + ["uri_6"], clusters + [0])
+    assert not table.matches(uris[1:], clusters[1:])
+    # a song moved to another cluster
+    assert not table.matches(uris, [1 - cluster for cluster in clusters[:1]] + clusters[1:])
+
+
+def test_catalog_version(tmp_path):
+    """Unit test - happy path - save_neighbours()
+    the neighbours record the version a snapshot of the same songs has
+    """
+    path = str(tmp_path / "neighbours.npz")
+    save_neighbours(df_anime, *compute_neighbours(df_anime, features, 3), output_path=path,
+                    features=features)
+
+    assert NeighbourTable.load(path).catalog_version == content_version(df_anime, features)
+    # files written before the version was recorded
+    with np.load(path) as data:
+        np.savez(path, **{name: data[name] for name in data.files
+                          if name != "catalog_version"})
+    assert NeighbourTable.load(path).catalog_version == 0
\ No newline at end of file
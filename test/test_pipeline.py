@@ -0,0 +1,95 @@
+""" Test the in-process pipeline in pipeline.py
+run_pipeline()
+"""
+
+import joblib
+import pandas as pd
+import pytest
+import yaml
+
+from src.pipeline import run_pipeline
+from src.profiling import StepProfiler
+
+
+@pytest.fixture(name="config")
+def fixture_config(tmp_path):
+    """The configuration of the repository, with the artifacts in a temporary directory"""
+    with open("config/model.yaml", "r", encoding="utf-8") as file:
+        config = yaml.load(file, Loader=yaml.FullLoader)
+    config["pipeline"]["paths"] = {name: str(tmp_path / path.split("/")[-1])
+                                   for name, path in config["pipeline"]["paths"].items()}
+    config["neighbours"]["compute_neighbours"]["k"] = 5
+    df_raw = pd.read_csv("data/raw/anime_songs.csv").head(60)
+    df_raw.to_csv(config["pipeline"]["paths"]["raw"], index=False)
+    df_raw.head(20).to_csv(config["pipeline"]["paths"]["sample"], index=False)
+    return config
+
+
+def test_run_pipeline(config):
+    """Unit test - happy path - run_pipeline()
+    """
+    stages = ["clean", "featurize", "train", "export", "score", "evaluate", "neighbours",
+              "snapshot"]
+    assert run_pipeline(config) == {stage: "ran" for stage in stages}
+    # nothing changed
+    assert run_pipeline(config) == {stage: "skipped" for stage in stages}
+
+    # only the stages downstream of a changed parameter run again
+    config["evaluate_model"]["evaluate"]["method"] = "sampled"
+    assert [stage for stage, status in run_pipeline(config).items()
+            if status == "ran"] == ["evaluate"]
+    config["model"]["get_model"]["k"] = 4
+    assert [stage for stage, status in run_pipeline(config).items()
+            if status == "ran"] == ["train", "export", "score", "evaluate", "neighbours",
+                                    "snapshot"]
+    assert pd.read_csv(config["pipeline"]["paths"]["clusters"])["clusterId"].nunique() == 4
+
+
+def test_run_pipeline_precision(config):
+    """Unit test - happy path - run_pipeline()
+    the top-level precision is used by every stage it applies to
+    """
+    config["precision"] = "float32"
+    run_pipeline(config)
+    config["precision"] = "float64"
+
+    assert [stage for stage, status in run_pipeline(config).items()
+            if status == "ran"] == ["featurize", "train", "export", "score", "evaluate",
+                                    "neighbours", "snapshot"]
+    assert joblib.load(config["pipeline"]["paths"]["model"]).cluster_centers_.dtype == "float64"
+
+
+def test_run_pipeline_profiled(config):
+    """Unit test - happy path - run_pipeline() with a profiler
+    """
+    profiler = StepProfiler("all", enabled=True)
+    profiler.start()
+    run_pipeline(config, profiler=profiler)
+    profiler.stop()
+
+    # each stage that ran is a phase, with the rows of the table it read
+    phases = {phase["name"]: phase for phase in profiler.report()["phases"]}
+    assert list(phases)[:3] == ["clean", "featurize", "train"]
+    assert phases["clean"]["rows"] == 60
+    assert phases["score"]["rows"] == 20
+
+
+def test_run_pipeline_missing_input(config, tmp_path):
+    """Unit test - unhappy path - run_pipeline()
+    """
+    # without sample songs, the stages scoring them do not run
+    config["pipeline"]["paths"]["sample"] = str(tmp_path / "nonexistent.csv")
+    status = run_pipeline(config)
+
+    assert status["score"] == "missing input"
+    assert status["evaluate"] == "missing input"
+    assert status["snapshot"] == "ran"
+
+
+def test_run_pipeline_streaming(config):
+    """Unit test - unhappy path - run_pipeline()
+    """
+    config["preprocessing"]["mode"] = "streaming"
+
+    with pytest.raises(ValueError):
+        run_pipeline(config)
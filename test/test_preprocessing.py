@@ -1,7 +1,10 @@
 """ Test the functions in preprocessing.py
 validate_features
+numeric_type
 clean
 featurize
+clean_streaming
+featurize_streaming
 """
 
 import numpy as np
@@ -113,6 +116,27 @@ def test_featurize():
     assert std_test.scale_ == np.array([0.027276363393971693])
 
 
+def test_featurize_float32():
+    """Unit test - happy path - featurize()
+    """
+    feature_columns = ["danceability", "name"]
+    df_true, std_true = prep.featurize(df_in, features=feature_columns)
+    df_test, std_test = prep.featurize(df_in, features=feature_columns, precision="float32")
+
+    # the scaled columns are float32, the scaler is still fitted in float64
+    assert df_test["danceability"].dtype == np.float32
+    assert np.allclose(df_test["danceability"], df_true["danceability"], atol=1e-6)
+    assert std_test.mean_.dtype == np.float64
+    assert np.allclose(std_test.scale_, std_true.scale_)
+
+
+def test_numeric_type_unknown():
+    """Unit test - unhappy path - numeric_type()
+    """
+    with pytest.raises(ValueError):
+        prep.numeric_type("float16")
+
+
 def test_featurize_not_df():
     """Unit test - unhappy path - featurize()
     """
@@ -122,3 +146,48 @@ def test_featurize_not_df():
 
     with pytest.raises(TypeError):
         prep.featurize(nonexist_in, feature_columns)
+
+
+def test_clean_streaming(tmp_path):
+    """Unit test - happy path - clean_streaming()
+    """
+    df_in.to_csv(tmp_path / "raw.csv", index=False)
+    col_mapper = {"name": "title", "duration_ms": "duration"}
+    features = ["danceability", "title", "duration"]
+
+    # chunks smaller than the data give the same result as clean()
+    n_rows = prep.clean_streaming(str(tmp_path / "raw.csv"), str(tmp_path / "cleaned.csv"),
+                                  col_mapper, features, chunk_size=2)
+    df_true = prep.clean(pd.read_csv(tmp_path / "raw.csv"), col_mapper, features)
+
+    assert n_rows == 3
+    pd.testing.assert_frame_equal(df_true, pd.read_csv(tmp_path / "cleaned.csv"))
+
+
+def test_featurize_streaming(tmp_path):
+    """Unit test - happy path - featurize_streaming()
+    """
+    df_in.to_csv(tmp_path / "cleaned.csv", index=False)
+    feature_columns = ["danceability", "key", "name"]
+
+    # chunks smaller than the data give the same result as featurize()
+    std_test = prep.featurize_streaming(str(tmp_path / "cleaned.csv"),
+                                        str(tmp_path / "features.csv"),
+                                        feature_columns, chunk_size=2)
+    df_true, std_true = prep.featurize(df_in, features=feature_columns)
+
+    pd.testing.assert_frame_equal(df_true, pd.read_csv(tmp_path / "features.csv"))
+    assert list(std_test.feature_names_in_) == ["danceability", "key"]
+    assert np.allclose(std_test.mean_, std_true.mean_)
+    assert np.allclose(std_test.scale_, std_true.scale_)
+
+
+def test_featurize_streaming_empty(tmp_path):
+    """Unit test - unhappy path - featurize_streaming()
+    """
+    pd.DataFrame(columns=["danceability", "name"]).to_csv(tmp_path / "cleaned.csv",
+                                                          index=False)
+
+    with pytest.raises(ValueError):
+        prep.featurize_streaming(str(tmp_path / "cleaned.csv"),
+                                 str(tmp_path / "features.csv"), ["danceability", "name"])
@@ -0,0 +1,72 @@
+""" Test the functions in profiling.py
+StepProfiler.phase
+StepProfiler.report
+StepProfiler.save
+"""
+import json
+
+from src.profiling import StepProfiler
+
+
+def test_profiler(tmp_path):
+    """Unit test - happy path - StepProfiler
+    """
+    profiler = StepProfiler("score", enabled=True)
+    profiler.start()
+    with profiler.phase("read input") as phase:
+        phase.rows = 1000
+        values = [float(i) for i in range(100_000)]
+    with profiler.phase("score"):
+        sum(values)
+    profiler.stop()
+    profiler.save(str(tmp_path / "scores.csv"))
+
+    report = profiler.report()
+    assert report["step"] == "score"
+    assert [phase["name"] for phase in report["phases"]] == ["read input", "score"]
+    read_input = report["phases"][0]
+    assert read_input["rows"] == 1000
+    assert read_input["rows_per_second"] > 0
+    # the list of floats is traced
+    assert read_input["peak_traced_mb"] > 1
+    assert report["phases"][1]["rows_per_second"] is None
+
+    with open(tmp_path / "scores.csv.profile.json", "r", encoding="utf-8") as file:
+        assert json.load(file) == report
+    summary = (tmp_path / "scores.csv.profile.txt").read_text(encoding="utf-8")
+    assert "read input" in summary
+    assert "functions by cumulative time" in summary
+    assert (tmp_path / "scores.csv.profile.prof").exists()
+
+
+def test_profiler_disabled(tmp_path):
+    """Unit test - happy path - StepProfiler when disabled
+    """
+    profiler = StepProfiler("score")
+    profiler.start()
+    with profiler.phase("read input") as phase:
+        phase.rows = 1000
+    profiler.stop()
+    profiler.save(str(tmp_path / "scores.csv"))
+
+    # nothing is measured or written
+    assert not profiler.phases
+    assert not list(tmp_path.iterdir())
+
+
+def test_profiler_nested_phases():
+    """Unit test - happy path - StepProfiler.phase
+    the peak of a phase includes what it allocated before a nested phase
+    """
+    profiler = StepProfiler("all", enabled=True)
+    profiler.start()
+    with profiler.phase("all"):
+        values = [float(i) for i in range(100_000)]
+        del values
+        with profiler.phase("featurize"):
+            sum(range(10))
+    profiler.stop()
+
+    featurize, outer = profiler.phases
+    assert featurize.peak_traced_mb < 1
+    assert outer.peak_traced_mb > 1
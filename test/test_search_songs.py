@@ -1,13 +1,19 @@
 """ Test the functions in search_songs.py
 form_query
+make_requests_session
+get_spotify_client
+get_song_features
+get_audio_features_batch
 valid_features
 get_closest_cluster
+get_closest_clusters
 get_top_n_closest_song
 """
 
 import pandas as pd
 import pytest
 import src.search_songs as search
+from src.ttl_cache import TTLCache
 
 # Define expected input dataframe
 df_in_values = [[0.627, "怪物"],
@@ -85,6 +91,18 @@ def test_get_closest_cluster():
     assert true_out == test_out
 
 
+def test_get_closest_cluster_float32():
+    """Unit test - happy path - get_closest_cluster()
+    """
+    centroids = pd.DataFrame([[0, 0.627], [1, 0.573]],
+                             columns=["clusterId", "danceability"])
+
+    test_out = search.get_closest_cluster(df_in, centroids, ["danceability"],
+                                          precision="float32")
+
+    assert test_out == [0, 0, 0]
+
+
 def test_get_closest_cluster_bad_features():
     """Unit test - unhappy path - get_closest_cluster()
     """
@@ -126,3 +144,136 @@ def test_get_top_n_closest_song_bad_features():
     with pytest.raises(KeyError):
         search.get_top_n_closest_song(
             df_in.iloc[[0]], df_anime, features, 2, 0)
+
+
+def test_make_requests_session():
+    """Unit test - happy path - make_requests_session()
+    the POST requests of the token exchange are retried, whatever the urllib3 version
+    """
+    retry = search.make_requests_session(4).get_adapter("https://api.spotify.com").max_retries
+
+    assert retry.total == 3
+    assert retry.is_retry("POST", 503)
+
+
+def test_get_spotify_client(monkeypatch):
+    """Unit test - happy path - get_spotify_client()
+    """
+    monkeypatch.setenv("SPOTIPY_CLIENT_ID", "client_id")
+    monkeypatch.setenv("SPOTIPY_CLIENT_SECRET", "client_secret")
+    monkeypatch.setattr(search, "_SHARED_API", None)
+
+    sp_api = search.get_spotify_client()
+
+    # the same client, token manager and connection pool are reused
+    assert search.get_spotify_client() is sp_api
+    assert isinstance(sp_api.client_credentials_manager,
+                      search.LockedClientCredentials)
+
+
+def test_get_spotify_client_no_credentials(monkeypatch):
+    """Unit test - unhappy path - get_spotify_client()
+    """
+    monkeypatch.delenv("SPOTIPY_CLIENT_ID", raising=False)
+    monkeypatch.delenv("SPOTIPY_CLIENT_SECRET", raising=False)
+    monkeypatch.setattr(search, "_SHARED_API", None)
+
+    with pytest.raises(search.spotipy.oauth2.SpotifyOauthError):
+        search.get_spotify_client()
+    assert search._SHARED_API is None
+
+
+class FakeSpotify:
+    """Stands in for spotipy.Spotify and counts the calls made"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, limit, offset, type):  # pylint: disable=redefined-builtin
+        self.calls += 1
+        return {"tracks": {"total": 1, "items": [{"id": "id_1"}]}}
+
+    def audio_features(self, tracks):
+        self.calls += 1
+        if isinstance(tracks, list):
+            return [{"id": track, "danceability": 0.627} for track in tracks]
+        return [{"id": tracks, "danceability": 0.627}]
+
+
+def test_get_song_features_cached():
+    """Unit test - happy path - get_song_features()
+    """
+    sp_api = FakeSpotify()
+    search_cache = TTLCache(max_size=10, ttl=60)
+    features_cache = TTLCache(max_size=10, ttl=60)
+
+    df_first = search.get_song_features("One Last Kiss", "Hikaru Utada", sp_api,
+                                        search_cache, features_cache)
+    # the same query typed differently is answered without calling Spotify
+    df_second = search.get_song_features("one last  kiss", "HIKARU UTADA", sp_api,
+                                         search_cache, features_cache)
+
+    pd.testing.assert_frame_equal(df_first, df_second)
+    assert df_second.loc[0, "danceability"] == 0.627
+    assert sp_api.calls == 2
+
+
+def test_get_audio_features_batch():
+    """Unit test - happy path - get_audio_features_batch()
+    """
+    sp_api = FakeSpotify()
+    cache = TTLCache(max_size=1000, ttl=60)
+    cache.set("id_0", {"id": "id_0", "danceability": 0.1})
+    track_ids = [f"id_{i}" for i in range(250)] + ["id_1"]
+
+    test_out = search.get_audio_features_batch(track_ids, sp_api, cache)
+
+    # 249 tracks are not cached, which takes 3 requests of at most 100 tracks
+    assert sp_api.calls == 3
+    assert [features["id"] for features in test_out] == track_ids
+    assert test_out[0]["danceability"] == 0.1
+
+
+def test_get_audio_features_batch_rejected_id():
+    """Unit test - happy path - get_audio_features_batch()
+    a batch Spotify rejects for one malformed id is fetched track by track
+    """
+    class RejectingSpotify(FakeSpotify):
+        """Fails a request with a 400 when it holds a malformed id"""
+
+        def audio_features(self, tracks):
+            if "bad" in tracks:
+                self.calls += 1
+                raise search.spotipy.SpotifyException(400, -1, "invalid request")
+            return super().audio_features(tracks)
+
+    sp_api = RejectingSpotify()
+    test_out = search.get_audio_features_batch(["id_1", "bad", "id_2"], sp_api)
+
+    assert [features and features["id"] for features in test_out] == ["id_1", None, "id_2"]
+    # the batch, then each track
+    assert sp_api.calls == 4
+
+
+def test_get_closest_clusters():
+    """Unit test - happy path - get_closest_clusters()
+    """
+    centroids = pd.DataFrame([[0, 0.1, 0.9], [1, 0.9, 0.1], [2, 0.5, 0.5]],
+                             columns=["clusterId", "danceability", "energy"])
+    df_songs = pd.DataFrame([[0.8, 0.3], [0.2, 0.7]],
+                            columns=["danceability", "energy"])
+
+    test_out = search.get_closest_clusters(
+        df_songs, centroids, ["danceability", "energy"], 2)
+
+    assert test_out == [[1, 2], [0, 2]]
+
+
+def test_get_closest_clusters_bad_features():
+    """Unit test - unhappy path - get_closest_clusters()
+    """
+    centroids = pd.DataFrame([[0, 0.627], [1, 0.573]],
+                             columns=["clusterId", "danceability"])
+
+    with pytest.raises(KeyError):
+        search.get_closest_clusters(df_in, centroids, ["key"], 2)
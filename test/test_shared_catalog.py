@@ -0,0 +1,59 @@
+""" Test the catalog shared between workers in shared_catalog.py
+save_catalog()
+load_catalog()
+load_shared_catalog()
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.shared_catalog import (build_catalog, catalog_path, load_catalog, load_shared_catalog,
+                                save_catalog)
+
+features = ["danceability", "energy"]
+
+df_anime = pd.DataFrame([[1, "Song_1", "spotify:track:1", 0, 0.5, 0.1],
+                         [2, "Gurenge", "spotify:track:2", 1, 0.3, 0.3],
+                         [3, "Song_3", "spotify:track:3", 0, 0.1, 0.5],
+                         [4, "Unravel", "spotify:track:4", 0, 0.4, 0.2],
+                         [5, "Song_5", "spotify:track:5", 1, 0.9, 0.1]],
+                        columns=["id", "title", "track_uri", "clusterId",
+                                 "danceability", "energy"])
+
+
+def test_save_load_catalog(tmp_path):
+    """Unit test - happy path - save_catalog() and load_catalog()
+    the mapped catalog answers like the one built in memory
+    """
+    path = str(tmp_path / "catalog.bin")
+    song_index, title_index = build_catalog(df_anime, features)
+    save_catalog(path, (song_index, title_index), 1)
+    mapped_index, mapped_titles = load_catalog(path)
+
+    assert isinstance(mapped_index.matrix, np.ndarray)
+    assert mapped_index.top_n([0.4, 0.2], [0, 1], 3) == song_index.top_n([0.4, 0.2], [0, 1], 3)
+    assert mapped_titles.resolve("gurenge") == title_index.resolve("gurenge")
+    assert mapped_titles.resolve("Unra") == title_index.resolve("Unra")
+    assert mapped_titles.resolve("Nothing") is None
+
+
+def test_load_shared_catalog(tmp_path):
+    """Unit test - happy path - load_shared_catalog()
+    the catalog is built once per version and older versions are removed
+    """
+    directory = str(tmp_path / "shared")
+    builds = []
+
+    def builder():
+        builds.append(1)
+        return build_catalog(df_anime, features)
+
+    load_shared_catalog(directory, 1, builder)
+    song_index, _ = load_shared_catalog(directory, 1, builder)
+    assert len(builds) == 1 and len(song_index) == 5
+
+    load_shared_catalog(directory, 2, builder)
+    assert len(builds) == 2
+    assert os.listdir(directory) == [os.path.basename(catalog_path(directory, 2))]
@@ -0,0 +1,72 @@
+""" Test the serving snapshot in snapshot.py
+save_snapshot()
+load_snapshot()
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+from src.shared_catalog import build_catalog, save_catalog
+from src.snapshot import content_version, load_snapshot, save_snapshot
+
+features = ["danceability", "energy"]
+
+df_anime = pd.DataFrame([["Song_1", "spotify:track:1", 0, 0.5, 0.1],
+                         ["Gurenge", "spotify:track:2", 1, 0.3, 0.3],
+                         ["Song_3", "spotify:track:3", 0, 0.1, 0.5],
+                         ["Unravel", "spotify:track:4", 0, 0.4, 0.2],
+                         ["Song_5", "spotify:track:5", 1, 0.9, 0.1]],
+                        columns=["title", "track_uri", "clusterId",
+                                 "danceability", "energy"])
+
+
+def test_save_load_snapshot(tmp_path):
+    """Unit test - happy path - save_snapshot() and load_snapshot()
+    """
+    path = str(tmp_path / "snapshot.bin")
+    scaler = StandardScaler().fit(df_anime[features])
+    version = save_snapshot(df_anime, features, path, scaler=scaler)
+    snapshot = load_snapshot(path)
+
+    assert snapshot.version == version == content_version(df_anime, features)
+    assert snapshot.features == features
+    # centroids are the average features of each cluster
+    pd.testing.assert_frame_equal(snapshot.centroids, pd.DataFrame(
+        [[0, 1 / 3, 0.8 / 3], [1, 0.6, 0.2]], columns=["clusterId"] + features))
+    np.testing.assert_allclose(snapshot.scaler_mean, scaler.mean_)
+    np.testing.assert_allclose(snapshot.scaler_scale, scaler.scale_)
+    assert snapshot.attrs["scaler"]["columns"] == features
+    # songs get the ids of a fresh ingestion
+    assert [song["title"] for song in snapshot.first_songs(2)] == ["Song_1", "Gurenge"]
+    assert snapshot.first_songs(1)[0] == {"id": 1, "title": "Song_1",
+                                          "track_uri": "spotify:track:1", "clusterId": 0}
+    assert snapshot.title_index.resolve("gurenge")["track_uri"] == "spotify:track:2"
+    assert [song["title"] for song in snapshot.song_index.top_n([0.4, 0.2], 0, 2)] \
+        == ["Unravel", "Song_1"]
+
+
+def test_content_version_changes():
+    """Unit test - happy path - content_version()
+    """
+    df_moved = df_anime.assign(clusterId=[0, 1, 0, 1, 1])
+    assert content_version(df_anime, features) == content_version(df_anime.copy(), features)
+    assert content_version(df_anime, features) != content_version(df_moved, features)
+
+
+def test_save_snapshot_missing_feature(tmp_path):
+    """Unit test - unhappy path - save_snapshot()
+    """
+    with pytest.raises(KeyError):
+        save_snapshot(df_anime, ["tempo"], str(tmp_path / "snapshot.bin"))
+
+
+def test_load_snapshot_other_bundle(tmp_path):
+    """Unit test - unhappy path - load_snapshot()
+    a bundle that is not a snapshot is rejected
+    """
+    path = str(tmp_path / "catalog.bin")
+    save_catalog(path, build_catalog(df_anime.assign(id=range(1, 6)), features), 1)
+    with pytest.raises(ValueError):
+        load_snapshot(path)
@@ -0,0 +1,188 @@
+""" Test the SongIndex in song_index.py
+normalize_rows
+SongIndex.from_dataframe
+SongIndex.append
+SongIndex.top_n
+SongIndex.top_n_batch
+measure_nprobe
+measure_precision
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.search_songs as search
+from src.song_index import SongIndex, measure_nprobe, measure_precision, normalize_rows
+
+features = ["danceability", "energy"]
+
+df_anime = pd.DataFrame([[1, "Song_1", "uri_1", 0, 0.5, 0.1],
+                         [2, "Song_2", "uri_2", 1, 0.3, 0.3],
+                         [3, "Song_3", "uri_3", 0, 0.1, 0.5],
+                         [4, "Song_4", "uri_4", 0, 0.4, 0.2],
+                         [5, "Song_5", "uri_5", 1, 0.9, 0.1]],
+                        columns=["id", "title", "track_uri", "clusterId",
+                                 "danceability", "energy"])
+
+
+def test_normalize_rows():
+    """Unit test - happy path - normalize_rows()
+    """
+    matrix = np.array([[3.0, 4.0], [0.0, 0.0]])
+
+    true_out = np.array([[0.6, 0.8], [0.0, 0.0]])
+    test_out = normalize_rows(matrix)
+
+    assert np.allclose(true_out, test_out)
+
+
+def test_from_dataframe():
+    """Unit test - happy path - SongIndex.from_dataframe()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+
+    assert len(index) == 5
+    assert index.matrix.dtype == np.float32
+    assert index.matrix.flags["C_CONTIGUOUS"]
+    assert index.cluster_ids.tolist() == [0, 1]
+    assert index.offsets.tolist() == [0, 3, 5]
+    # rows of a cluster are contiguous and keep their original order
+    assert index.metadata["title"][index.cluster_rows(0)].tolist() == [
+        "Song_1", "Song_3", "Song_4"]
+
+
+def test_from_dataframe_bad_features():
+    """Unit test - unhappy path - SongIndex.from_dataframe()
+    """
+    with pytest.raises(KeyError):
+        SongIndex.from_dataframe(df_anime, ["key"])
+
+
+def test_top_n():
+    """Unit test - happy path - top_n()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+    song = pd.DataFrame([[0.45, 0.15]], columns=features)
+
+    test_out = index.top_n(song.to_numpy()[0], 0, 2)
+
+    # same songs as the dataframe implementation, most similar first
+    true_songs = search.get_top_n_closest_song(song, df_anime, features, 2, 0)
+    assert sorted(rec["title"] for rec in true_songs) == sorted(
+        rec["title"] for rec in test_out)
+    assert [rec["title"] for rec in test_out] == ["Song_1", "Song_4"]
+    assert test_out[0]["similarity"] >= test_out[1]["similarity"]
+    assert test_out[0] == {"id": 1, "title": "Song_1", "track_uri": "uri_1",
+                           "clusterId": 0,
+                           "similarity": pytest.approx(0.993, abs=1e-3)}
+
+
+def test_top_n_unknown_cluster():
+    """Unit test - unhappy path - top_n()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+
+    assert index.top_n(np.array([0.4, 0.2]), 7, 2) == []
+
+
+def test_top_n_more_than_cluster_size():
+    """Unit test - unhappy path - top_n()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+
+    test_out = index.top_n(np.array([0.4, 0.2]), 1, 10)
+
+    assert [rec["title"] for rec in test_out] == ["Song_2", "Song_5"]
+
+
+def test_top_n_batch():
+    """Unit test - happy path - top_n_batch()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+    songs = np.array([[0.45, 0.15], [0.4, 0.2], [0.1, 0.6]])
+    cluster_ids = [0, 1, 0]
+
+    test_out = index.top_n_batch(songs, cluster_ids, 2)
+
+    # the same results as one top_n() call per song
+    true_out = [index.top_n(song, cluster_id, 2)
+                for song, cluster_id in zip(songs, cluster_ids)]
+    for test_songs, true_songs in zip(test_out, true_out):
+        assert [rec["title"] for rec in test_songs] == [rec["title"] for rec in true_songs]
+        assert [rec["similarity"] for rec in test_songs] == pytest.approx(
+            [rec["similarity"] for rec in true_songs], abs=1e-6)
+
+
+def test_top_n_batch_unknown_cluster():
+    """Unit test - unhappy path - top_n_batch()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+
+    test_out = index.top_n_batch(np.array([[0.4, 0.2], [0.4, 0.2]]), [7, 1], 1)
+
+    assert test_out[0] == []
+    assert [rec["title"] for rec in test_out[1]] == ["Song_2"]
+
+
+def test_top_n_multiple_clusters():
+    """Unit test - happy path - top_n()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+    song = np.array([0.4, 0.2])
+
+    test_out = index.top_n(song, [1, 0], 3)
+
+    # candidates of both clusters are ranked together
+    assert [rec["title"] for rec in test_out] == ["Song_4", "Song_1", "Song_2"]
+    assert [rec["title"] for rec in index.top_n_batch([song], [[1, 0]], 3)[0]] == [
+        "Song_4", "Song_1", "Song_2"]
+
+
+def test_measure_nprobe():
+    """Unit test - happy path - measure_nprobe()
+    """
+    index = SongIndex.from_dataframe(df_anime, features)
+    centroids = pd.DataFrame([[0, 0.33, 0.27], [1, 0.6, 0.2]],
+                             columns=["clusterId"] + features)
+    df_queries = pd.DataFrame([[0.4, 0.2], [0.2, 0.4]], columns=features)
+
+    test_out = measure_nprobe(index, centroids, df_queries, 2, [1, 2])
+
+    assert test_out["nprobe"].tolist() == [1, 2]
+    # probing every cluster is the exact search
+    assert test_out["recall"].tolist()[-1] == 1
+    assert (test_out["latency_ms"] > 0).all()
+
+
+def test_measure_precision():
+    """Unit test - happy path - measure_precision()
+    """
+    rng = np.random.default_rng(0)
+    df_songs = pd.DataFrame({"danceability": rng.random(2000), "energy": rng.random(2000),
+                             "loudness": rng.normal(-8, 3, 2000),
+                             "tempo": rng.normal(120, 25, 2000)})
+    df_queries = df_songs.sample(20, random_state=0)
+
+    test_out = measure_precision(df_songs, df_queries, df_songs.columns.tolist(), 10)
+
+    # float32 rankings only differ from float64 by ties within rounding
+    assert test_out["agree"]
+    assert test_out["n_disagree"] == 0
+    assert test_out["max_similarity_error"] < 1e-6
+    assert test_out["recall"] > 0.9
+
+
+def test_append():
+    """Unit test - happy path - SongIndex.append()
+    """
+    index = SongIndex.from_dataframe(df_anime.iloc[:3], features)
+    test_index = index.append(df_anime.iloc[3:])
+    true_index = SongIndex.from_dataframe(df_anime, features)
+
+    # the same as building the index from all the songs
+    assert np.allclose(test_index.matrix, true_index.matrix)
+    assert list(test_index.cluster_ids) == list(true_index.cluster_ids)
+    assert list(test_index.offsets) == list(true_index.offsets)
+    assert list(test_index.metadata["title"]) == list(true_index.metadata["title"])
+    assert len(index) == 3
@@ -0,0 +1,110 @@
+""" Test the functions in song_manager.py
+SongManager.get_centroids
+SongManager.get_catalog_version
+SongManager.bump_catalog_version
+SongManager.add_songs
+SongManager.get_songs_after
+"""
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+import src.song_manager as sm
+
+FEATURES = ["danceability", "energy", "loudness", "speechiness", "acousticness",
+            "instrumentalness", "liveness", "valence", "tempo"]
+
+
+def make_song(song_id: int, cluster_id: int, value: float) -> dict:
+    """Builds the fields of one song with every feature set to value"""
+    song = {fea: value for fea in FEATURES}
+    song.update({"title": f"Song_{song_id}", "clusterId": cluster_id, "key": 1,
+                 "duration": 200000, "track_uri": f"spotify:track:{song_id}"})
+    return song
+
+
+@pytest.fixture(name="manager")
+def fixture_manager(tmp_path):
+    """A SongManager on a fresh sqlite database"""
+    engine_string = f"sqlite:///{tmp_path / 'songs.db'}"
+    sm.create_db(engine_string)
+    manager = sm.SongManager(engine_string=engine_string)
+    yield manager
+    manager.close()
+
+
+def test_get_centroids(manager):
+    """Unit test - happy path - get_centroids()
+    """
+    manager.add_song(**make_song(1, 0, 0.2))
+    manager.add_song(**make_song(2, 0, 0.4))
+    manager.add_song(**make_song(3, 1, 0.9))
+
+    df_true = pd.DataFrame([[0, 0.3, 0.3], [1, 0.9, 0.9]],
+                           columns=["clusterId", "danceability", "tempo"])
+    df_test = manager.get_centroids(["danceability", "tempo"])
+
+    pd.testing.assert_frame_equal(df_true, df_test, check_dtype=False)
+
+
+def test_catalog_version_bumped_by_ingestion(manager, tmp_path):
+    """Unit test - happy path - get_catalog_version()
+    """
+    assert manager.get_catalog_version() == 0
+    manager.add_song(**make_song(1, 0, 0.2))
+    assert manager.get_catalog_version() == 1
+
+    data_path = tmp_path / "songs.csv"
+    pd.DataFrame([make_song(2, 0, 0.4), make_song(3, 1, 0.9)]).to_csv(
+        data_path, index=False)
+    manager.add_songs_from_csv(str(data_path))
+    assert manager.get_catalog_version() == 2
+
+
+def test_catalog_version_no_table(tmp_path):
+    """Unit test - unhappy path - get_catalog_version()
+    """
+    manager = sm.SongManager(
+        engine_string=f"sqlite:///{tmp_path / 'empty.db'}")
+
+    assert manager.get_catalog_version() == 0
+    manager.close()
+
+
+def test_add_songs(manager):
+    """Unit test - happy path - add_songs()
+    """
+    df_songs = pd.DataFrame([make_song(1, 0, 0.2), make_song(2, 1, 0.4),
+                             make_song(3, 1, 0.9)])
+
+    assert manager.add_songs(df_songs) == 3
+    # one version for the whole batch
+    assert manager.get_catalog_version() == 1
+    assert manager.count_songs() == 3
+    assert manager.get_cluster_sizes().to_dict() == {0: 1, 1: 2}
+    assert manager.get_existing_track_uris(["spotify:track:2", "spotify:track:4"]) == {
+        "spotify:track:2"}
+    assert list(manager.get_songs_after(1)["title"]) == ["Song_2", "Song_3"]
+
+
+def test_add_songs_duplicated(manager):
+    """Unit test - unhappy path - add_songs()
+    """
+    manager.add_song(**make_song(1, 0, 0.2))
+
+    # track uris are unique, so nothing is added
+    assert manager.add_songs(pd.DataFrame([make_song(1, 0, 0.2), make_song(2, 0, 0.4)])) == 0
+    assert manager.count_songs() == 1
+    assert manager.get_catalog_version() == 1
+
+
+def test_add_songs_one_transaction(manager):
+    """Unit test - unhappy path - add_songs()
+    the songs are not kept when the catalog version cannot be bumped
+    """
+    manager.session.execute(sqlalchemy.text("DROP TABLE catalog_version"))
+    manager.session.commit()
+
+    assert manager.add_songs(pd.DataFrame([make_song(1, 0, 0.2)])) == 0
+    assert manager.count_songs() == 0
@@ -0,0 +1,124 @@
+""" Test the tables passed between the pipeline stages in tables.py
+read_table()
+write_table()
+read_table_chunks()
+TableWriter
+arrow_schema()
+split_table()
+read_table_part()
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.tables import (TableWriter, arrow_schema, read_table, read_table_chunks, read_table_part,
+                        split_table, write_table)
+
+df_songs = pd.DataFrame({"danceability": [0.627, 0.585, 0.561],
+                         "key": [1, 5, 8],
+                         "title": ["怪物", "廻廻奇譚", "One Last Kiss"],
+                         "duration": [206000, 221426, 252027],
+                         "clusterId": [0, 1, 0]})
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_write_read_table(tmp_path, extension):
+    """Unit test - happy path - write_table() and read_table()
+    """
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"songs.{extension}")
+    write_table(df_songs, path)
+    df_test = read_table(path)
+
+    assert list(df_test.columns) == list(df_songs.columns)
+    assert list(df_test["title"]) == list(df_songs["title"])
+    np.testing.assert_allclose(df_test["danceability"], df_songs["danceability"], rtol=1e-6)
+    np.testing.assert_array_equal(df_test["key"], df_songs["key"])
+    if extension == "parquet":
+        # the types are stored in the file
+        assert df_test["danceability"].dtype == np.float32
+        assert df_test["key"].dtype == np.int8
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_table_writer_chunks(tmp_path, extension):
+    """Unit test - happy path - TableWriter and read_table_chunks()
+    """
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"songs.{extension}")
+    with TableWriter(path) as output:
+        for start in range(0, len(df_songs), 2):
+            output.write(df_songs.iloc[start:start + 2])
+
+    chunks = list(read_table_chunks(path, 2))
+
+    assert output.n_rows == 3
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(pd.concat(chunks)["title"]) == list(df_songs["title"])
+
+
+def test_table_writer_missing_integer(tmp_path):
+    """Unit test - unhappy path - TableWriter
+    a missing integer after the first chunk is written as a null
+    """
+    pytest.importorskip("pyarrow")
+    path = str(tmp_path / "songs.parquet")
+    df_missing = df_songs.iloc[2:].assign(key=[np.nan])
+    with TableWriter(path) as output:
+        output.write(df_songs.iloc[:2])
+        output.write(df_missing)
+
+    df_test = read_table(path)
+
+    assert df_test["key"].iloc[:2].tolist() == [1, 5]
+    assert df_test["key"].isna().tolist() == [False, False, True]
+
+
+def test_arrow_schema_declared_types():
+    """Unit test - happy path - arrow_schema()
+    the known integer columns keep their type when missing values made them floats
+    """
+    pyarrow = pytest.importorskip("pyarrow")
+    schema = arrow_schema(df_songs.assign(key=np.nan, tempo=[120, 95, 140]))
+
+    assert schema.field("key").type == pyarrow.int8()
+    assert schema.field("tempo").type == pyarrow.int64()
+    assert schema.field("danceability").type == pyarrow.float32()
+    assert schema.field("title").type == pyarrow.string()
+
+
+def test_arrow_schema_scaled_integers():
+    """Unit test - happy path - arrow_schema()
+    a known integer column holding scaled values is stored as floats
+    """
+    pyarrow = pytest.importorskip("pyarrow")
+    schema = arrow_schema(df_songs.assign(key=[-1.22, 0.0, 1.22]))
+
+    assert schema.field("key").type == pyarrow.float32()
+    assert schema.field("clusterId").type == pyarrow.int16()
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_split_table(tmp_path, extension):
+    """Unit test - happy path - split_table() and read_table_part()
+    the parts are read independently and hold every row once, in order
+    """
+    if extension == "parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"songs.{extension}")
+    df_many = pd.concat([df_songs] * 10, ignore_index=True)
+    with TableWriter(path) as output:
+        for start in range(0, len(df_many), 4):
+            output.write(df_many.iloc[start:start + 4])
+
+    parts = split_table(path, 8)
+    df_test = pd.concat([read_table_part(path, part) for part in reversed(parts)][::-1],
+                        ignore_index=True)
+
+    assert len(parts) > 1
+    assert list(df_test.columns) == list(df_songs.columns)
+    assert list(df_test["title"]) == list(df_many["title"])
+    np.testing.assert_array_equal(df_test["duration"], df_many["duration"])
@@ -0,0 +1,138 @@
+""" Test the TTLCache in ttl_cache.py
+get()
+set()
+stats()
+flush()
+"""
+import sqlite3
+
+
+import pytest
+
+import src.ttl_cache as ttl_cache
+from src.ttl_cache import MISSING, TTLCache
+
+
+def test_get_hit_and_miss():
+    """Unit test - happy path - get()
+    """
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("track:one last kiss", "5RhWszHMSKzb7KiXk4Ae0M")
+    # searches that return nothing are cached as None
+    cache.set("track:nothing", None)
+
+    assert cache.get("track:one last kiss") == "5RhWszHMSKzb7KiXk4Ae0M"
+    assert cache.get("track:nothing") is None
+    assert cache.get("track:unknown") is MISSING
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 0, "size": 2}
+
+
+def test_least_recently_used_evicted():
+    """Unit test - happy path - set()
+    """
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_get_expired(monkeypatch):
+    """Unit test - unhappy path - get()
+    """
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, "time", lambda: now[0])
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+
+    now[0] += 61
+    assert cache.get("a", default="expired") == "expired"
+    assert len(cache) == 0
+
+
+def test_persisted_to_disk(tmp_path):
+    """Unit test - happy path - TTLCache(path=...)
+    """
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(max_size=10, ttl=60, path=path, table="audio_features")
+    cache.set("id_1", {"danceability": 0.627, "tempo": 169.935})
+    cache.flush()
+
+    # a new process starts with an empty memory but reads from disk
+    restarted = TTLCache(max_size=10, ttl=60, path=path, table="audio_features")
+    assert restarted.get("id_1") == {"danceability": 0.627, "tempo": 169.935}
+    assert restarted.get("id_2") is MISSING
+
+
+def test_disk_rows_evicted(tmp_path):
+    """Unit test - happy path - TTLCache(path=...)
+    the rows evicted from memory are deleted from disk, and the table keeps at most
+    max_size rows even with rows not loaded since a restart
+    """
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(max_size=2, ttl=60, path=path, commit_every=1)
+    for key in ["a", "b", "c"]:
+        cache.set(key, key)
+    restarted = TTLCache(max_size=2, ttl=60, path=path, commit_every=1)
+    restarted.set("d", "d")
+
+    assert restarted.get("a") is MISSING
+    with sqlite3.connect(path) as db:
+        assert sorted(row[0] for row in db.execute("SELECT key FROM cache")) == ["c", "d"]
+
+
+def test_expired_disk_row_not_stored(tmp_path, monkeypatch):
+    """Unit test - unhappy path - get()
+    a row that expired on disk since the restart does not evict a live entry
+    """
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache.time, "time", lambda: now[0])
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(max_size=2, ttl=60, path=path)
+    cache.set("x", "x")
+    cache.flush()
+    now[0] += 10
+    restarted = TTLCache(max_size=2, ttl=60, path=path, commit_interval=60)
+    restarted.set("a", "a")
+    restarted.set("b", "b")
+
+    now[0] += 55
+    assert restarted.get("x") is MISSING
+    assert restarted.evictions == 0
+    assert restarted.get("a") == "a" and restarted.get("b") == "b"
+    restarted.flush()
+    with sqlite3.connect(path) as db:
+        assert sorted(row[0] for row in db.execute("SELECT key FROM cache")) == ["a", "b"]
+
+
+def test_batched_commits(tmp_path):
+    """Unit test - happy path - flush()
+    the writes are committed every commit_every writes or on flush()
+    """
+    path = str(tmp_path / "cache.db")
+    cache = TTLCache(max_size=10, ttl=60, path=path, commit_every=3, commit_interval=60)
+
+    def disk_keys():
+        with sqlite3.connect(path) as db:
+            return sorted(row[0] for row in db.execute("SELECT key FROM cache"))
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert disk_keys() == []
+    cache.set("c", 3)
+    assert disk_keys() == ["a", "b", "c"]
+    cache.set("d", 4)
+    cache.flush()
+    assert disk_keys() == ["a", "b", "c", "d"]
+
+
+def test_bad_size():
+    """Unit test - unhappy path - TTLCache()
+    """
+    with pytest.raises(ValueError):
+        TTLCache(max_size=0)